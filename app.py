@@ -1,113 +1,307 @@
-from flask import Flask, render_template, request, jsonify
-import os
+import gzip
+import time
+
+from flask import Flask, Response, abort, g, render_template, request, jsonify
 
 # Import custom modules
-from modules import gpio_control
-from modules import db_operations
+from modules import admission
+from modules import api
+from modules import assets
+from modules import events
+from modules import federation
+from modules import metrics
+from modules.api import controller
 
 app = Flask(__name__)
 
-# Initialize GPIO and Database
-db_operations.init_db()  # Initialize the database
-db_operations.create_default_device()  # Create default device if none exist
-gpio_control.setup_pins()  # Set up GPIO pins
+# Initialize the database, device states and GPIO pins
+controller.start()
+
+# Content-hashed, precompressed copies of static/ for the dashboard to link to
+assets.build()
+app.jinja_env.globals["asset_url"] = assets.url
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def admit():
+    """Turn the request away if its client is over a limit (modules/admission.py)"""
+    if admission.exempt(request.path):
+        return None
+    rejection = admission.admit(request.method, request.headers, request.remote_addr)
+    if rejection is None:
+        g.admitted = True
+        return None
+    payload, status, retry_after = rejection
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+@app.teardown_request
+def release(exc):
+    if g.pop("admitted", False):
+        admission.release()
+
+
+@app.after_request
+def record_request(response):
+    if metrics.ENABLED and "request_start" in g:
+        api.record_request(
+            api.route_label(request.url_rule.rule if request.url_rule else None),
+            request.method,
+            response.status_code,
+            time.perf_counter() - g.request_start,
+        )
+    return response
+
+
+def request_json():
+    """Decoded JSON body, or None"""
+    with metrics.stage("parse"):
+        return request.get_json(silent=True)
+
+
+def respond(payload, status):
+    """JSON response for an api handler result"""
+    with metrics.stage("json"):
+        return jsonify(payload), status
+
+
+def versioned_json(cache_key, build):
+    """JSON response with a strong ETag derived from the state version
 
-# Retrieve device states from the database and set GPIO pins accordingly
-device_states = db_operations.get_device_states()
-gpio_control.set_device_states(device_states)
+    Answers If-None-Match with 304 without calling build(), and serializes the
+    payload at most once per state version.
+    """
+    version, etag = api.current_etag()
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = api.cached_json(cache_key, version, build)
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # Always revalidate
+    return response
+
+
+def render_index():
+    devices = controller.get_all_devices()
+    with metrics.stage("render"):
+        return render_template(
+            "index.html", devices=devices, federated=federation.enabled()
+        )
 
 
 @app.route("/")
 def index():
-    devices = db_operations.get_all_devices()
-    return render_template("index.html", devices=devices)
+    """Dashboard, rendered (and gzipped) at most once per state version"""
+    version, etag = api.current_etag()
+    gzipped = "gzip" in assets.accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    if gzipped:
+        etag += "-gzip"  # Each encoding of the page needs its own strong ETag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        html = api.cached_body("index", version, render_index)
+        if gzipped:
+            body = api.cached_body(
+                "index.gz", version, lambda: gzip.compress(html.encode(), compresslevel=6)
+            )
+            response = Response(body, mimetype="text/html")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(html, mimetype="text/html")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # Always revalidate
+    response.vary.add("Accept-Encoding")
+    # Marks the page's own API requests as interactive (modules/admission.py)
+    response.set_cookie(
+        admission.DASHBOARD_COOKIE, admission.dashboard_key(), httponly=True, samesite="Strict"
+    )
+    return response
+
+
+@app.route("/assets/<path:name>")
+def static_asset(name):
+    """Hashed static asset, precompressed, cacheable for a year"""
+    found = assets.lookup(name, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        abort(404)
+    body, encoding, mimetype, etag = found
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={assets.MAX_AGE}, immutable"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @app.route("/device", methods=["POST"])
 def control_device():
-    data = request.get_json()
-    device_id = data.get("device_id")
-    action = data.get("action")  # 'high' or 'low'
+    payload, status = api.control_device(request_json())
+    return respond(payload, status)
 
-    try:
-        device_id = int(device_id)
-    except (ValueError, TypeError):
-        return jsonify({"error": "Invalid device ID"}), 400
 
-    if action not in ["high", "low"]:
-        return jsonify({"error": "Invalid action"}), 400
+@app.route("/federation/devices", methods=["GET"])
+def get_federation_devices():
+    payload, status = api.federation_devices()
+    return respond(payload, status)
 
-    try:
-        gpio_control.control_device(device_id, action)
-        db_operations.update_device_state(device_id, action)
-        return jsonify({"message": f"Device {device_id} turned {action}"}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+@app.route("/federation/device", methods=["POST"])
+def control_federation_device():
+    payload, status = api.federation_control(request_json())
+    return respond(payload, status)
+
+
+@app.route("/devices/batch", methods=["POST"])
+def control_devices_batch():
+    payload, status = api.control_devices_batch(request_json())
+    return respond(payload, status)
 
 
 @app.route("/devices", methods=["GET"])
 def get_device_states():
-    devices = db_operations.get_all_devices()
-    return jsonify(devices), 200
+    return versioned_json("devices", controller.get_all_devices)
 
 
 @app.route("/devices", methods=["POST"])
 def add_device():
-    data = request.get_json()
-    name = data.get("name")
-    icon = data.get("icon", "fa-plug")
-    pin_number = data.get("pin_number")
-
-    if not name or not pin_number:
-        return jsonify({"error": "Name and pin number are required"}), 400
-
-    try:
-        pin_number = int(pin_number)
-        device_id = db_operations.add_device(name, icon, pin_number)
-
-        # Refresh GPIO setup to include new device
-        gpio_control.setup_pins()
-
-        return (
-            jsonify(
-                {
-                    "message": f"Device '{name}' added successfully",
-                    "device_id": device_id,
-                }
-            ),
-            201,
-        )
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+    payload, status = api.add_device(request_json())
+    return respond(payload, status)
 
 
 @app.route("/devices/<int:device_id>", methods=["DELETE"])
 def delete_device(device_id):
-    try:
-        db_operations.remove_device(device_id)
+    payload, status = api.delete_device(device_id)
+    return respond(payload, status)
+
+
+@app.route("/devices/<int:device_id>/history", methods=["GET"])
+def get_device_history(device_id):
+    payload, status = api.device_history(device_id, request.args)
+    return respond(payload, status)
+
+
+@app.route("/groups", methods=["GET"])
+def get_groups():
+    return versioned_json("groups", controller.get_groups)
+
+
+@app.route("/groups", methods=["POST"])
+def add_group():
+    payload, status = api.add_group(request_json())
+    return respond(payload, status)
+
+
+@app.route("/groups/<int:group_id>", methods=["PUT"])
+def update_group(group_id):
+    payload, status = api.update_group(group_id, request_json())
+    return respond(payload, status)
+
+
+@app.route("/groups/<int:group_id>", methods=["DELETE"])
+def delete_group(group_id):
+    payload, status = api.delete_group(group_id)
+    return respond(payload, status)
+
+
+@app.route("/groups/<int:group_id>/action", methods=["POST"])
+def group_action(group_id):
+    payload, status = api.group_action(group_id, request_json())
+    return respond(payload, status)
 
-        # Refresh GPIO setup to remove deleted device
-        gpio_control.setup_pins()
 
-        return jsonify({"message": f"Device {device_id} deleted successfully"}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+@app.route("/schedules", methods=["GET"])
+def get_schedules():
+    payload, status = api.get_schedules(request.args)
+    return respond(payload, status)
+
+
+@app.route("/schedules", methods=["POST"])
+def add_schedule():
+    payload, status = api.add_schedule(request_json())
+    return respond(payload, status)
+
+
+@app.route("/schedules/<int:schedule_id>", methods=["DELETE"])
+def delete_schedule(schedule_id):
+    payload, status = api.delete_schedule(schedule_id)
+    return respond(payload, status)
+
+
+@app.route("/rules", methods=["GET"])
+def get_rules():
+    payload, status = api.get_rules()
+    return respond(payload, status)
+
+
+@app.route("/rules", methods=["POST"])
+def add_rule():
+    payload, status = api.add_rule(request_json())
+    return respond(payload, status)
+
+
+@app.route("/rules/<int:rule_id>", methods=["DELETE"])
+def delete_rule(rule_id):
+    payload, status = api.delete_rule(rule_id)
+    return respond(payload, status)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus metrics"""
+    if not metrics.ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(api.metrics_text(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/events", methods=["GET"])
+def device_events():
+    """Server-sent event stream of device changes"""
+    controller.watch_events()
+    try:
+        subscriber = events.subscribe()
+    except events.TooManySubscribers as e:
+        return jsonify({"error": str(e)}), 503
+
+    return Response(
+        events.stream(subscriber),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Tell nginx not to buffer the stream
+        },
+    )
 
 
 @app.route("/pins", methods=["GET"])
 def get_pins():
-    pins = db_operations.get_available_pins()
-    return jsonify(pins), 200
+    return versioned_json("pins", controller.get_available_pins)
 
 
 @app.route("/pins/usable", methods=["GET"])
 def get_usable_pins():
-    pins = db_operations.get_usable_pins()
-    return jsonify(pins), 200
+    return versioned_json("pins_usable", controller.get_usable_pins)
 
 
 if __name__ == "__main__":
     try:
         app.run(host="0.0.0.0", port=5001, debug=True)
     finally:
-        gpio_control.cleanup()
+        controller.stop()
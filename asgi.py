@@ -0,0 +1,396 @@
+"""DEWHOME control API on an asyncio event loop.
+
+An optional alternative to the Flask app for the JSON and event-stream routes.
+Device and database calls still block, so they run on a bounded thread pool;
+waiting requests and idle event streams only cost a coroutine, not a thread.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+The dashboard page (/) and static files are only served by app.py. The
+request handling itself is shared with it through modules.api.
+"""
+
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from modules import admission
+from modules import api
+from modules import config
+from modules import events
+from modules import metrics
+from modules.api import controller
+
+_executor = ThreadPoolExecutor(
+    max_workers=config.ASGI_EXECUTOR_THREADS, thread_name_prefix="dewhome-asgi"
+)
+_loop = None
+_slots = None  # asyncio.Semaphore, created on the serving loop
+_streams = set()
+
+# Route labels for metrics; anything else is counted as "unmatched"
+ROUTES = {
+    "/device",
+    "/devices",
+    "/devices/batch",
+    "/federation/devices",
+    "/federation/device",
+    "/devices/<id>",
+    "/devices/<id>/history",
+    "/groups",
+    "/groups/<id>",
+    "/groups/<id>/action",
+    "/schedules",
+    "/schedules/<id>",
+    "/rules",
+    "/rules/<id>",
+    "/pins",
+    "/pins/usable",
+    "/metrics",
+}
+
+
+class _Stream:
+    """An open GET /events stream, fed from the event loop"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=config.EVENTS_QUEUE_SIZE)
+
+    def deliver(self, event):
+        """Queue an event; on overflow replace the backlog with a resync"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"id": event["id"], "type": "resync", "data": {}})
+
+
+def _dispatch_event(event):
+    """events listener: hand the event to the loop, never blocking the publisher"""
+    if _loop is not None and _streams:
+        _loop.call_soon_threadsafe(_fan_out, event)
+
+
+def _fan_out(event):
+    for stream in list(_streams):
+        stream.deliver(event)
+
+
+async def _run(func, *args):
+    """Run a blocking call on the executor"""
+    return await _loop.run_in_executor(_executor, partial(func, *args))
+
+
+async def _startup():
+    global _loop, _slots
+
+    _loop = asyncio.get_running_loop()
+    _slots = asyncio.Semaphore(config.ASGI_MAX_CONCURRENCY)
+    await _run(controller.start)
+    events.add_listener(_dispatch_event)
+
+
+async def _shutdown():
+    await _run(controller.stop)
+    _executor.shutdown(wait=True)
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def _parse_json(body):
+    """Decoded request body, or None if it is not valid JSON"""
+    with metrics.stage("parse"):
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+
+async def _send_response(send, status, body=b"", headers=()):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.encode(), value.encode()) for name, value in headers]
+            + [(b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, payload, status):
+    with metrics.stage("json"):
+        body = json.dumps(payload).encode()
+    await _send_response(send, status, body, [("content-type", "application/json")])
+
+
+async def _versioned_json(scope, send, cache_key, build):
+    """ETag/304 handling, as in app.versioned_json"""
+    version, etag = await _run(api.current_etag)
+    quoted = f'"{etag}"'
+    headers = [("etag", quoted), ("cache-control", "no-cache")]
+
+    if_none_match = dict(scope["headers"]).get(b"if-none-match", b"").decode()
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    if quoted in tags or "*" in tags:
+        await _send_response(send, 304, headers=headers)
+        return
+
+    body = await _run(api.cached_json, cache_key, version, build)
+    await _send_response(
+        send, 200, body.encode(), headers + [("content-type", "application/json")]
+    )
+
+
+async def _wait_for_disconnect(receive):
+    """Return once the client has gone away"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _event_stream(receive, send):
+    """GET /events: same wire format as the Flask route
+
+    The server's send() does nothing once the client has gone, so the stream
+    also watches receive() for the disconnect and ends there.
+    """
+    if len(_streams) >= config.EVENTS_MAX_SUBSCRIBERS:
+        await _send_json(
+            send,
+            {"error": f"Too many event subscribers (limit {config.EVENTS_MAX_SUBSCRIBERS})"},
+            503,
+        )
+        return
+
+    await _run(controller.watch_events)
+    stream = _Stream()
+    _streams.add(stream)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        chunk = "retry: 3000\n\n"
+        while True:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+            getter = asyncio.ensure_future(stream.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=config.EVENTS_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter in done:
+                chunk = events.format_sse(getter.result())
+            else:
+                getter.cancel()  # An unread event stays queued
+                chunk = ": keep-alive\n\n"
+            if disconnected in done:
+                break
+    except OSError:
+        pass  # Client went away
+    finally:
+        disconnected.cancel()
+        _streams.discard(stream)
+
+
+async def _route(scope, receive, send):
+    method = scope["method"]
+    path = scope["path"].rstrip("/") or "/"
+
+    if path == "/device" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.control_device, data))
+
+    if path == "/federation/devices" and method == "GET":
+        return await _send_json(send, *await _run(api.federation_devices))
+
+    if path == "/federation/device" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.federation_control, data))
+
+    if path == "/devices/batch" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.control_devices_batch, data))
+
+    if path == "/devices" and method == "GET":
+        return await _versioned_json(scope, send, "devices", controller.get_all_devices)
+
+    if path == "/devices" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.add_device, data))
+
+    if path.startswith("/devices/") and path.endswith("/history") and method == "GET":
+        try:
+            device_id = int(path[len("/devices/"):-len("/history")])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        args = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        return await _send_json(send, *await _run(api.device_history, device_id, args))
+
+    if path.startswith("/devices/") and method == "DELETE":
+        try:
+            device_id = int(path[len("/devices/"):])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        return await _send_json(send, *await _run(api.delete_device, device_id))
+
+    if path == "/groups" and method == "GET":
+        return await _versioned_json(scope, send, "groups", controller.get_groups)
+
+    if path == "/groups" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.add_group, data))
+
+    if path.startswith("/groups/") and path.endswith("/action") and method == "POST":
+        try:
+            group_id = int(path[len("/groups/"):-len("/action")])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.group_action, group_id, data))
+
+    if path.startswith("/groups/") and method in ("PUT", "DELETE"):
+        try:
+            group_id = int(path[len("/groups/"):])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        if method == "DELETE":
+            return await _send_json(send, *await _run(api.delete_group, group_id))
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.update_group, group_id, data))
+
+    if path == "/schedules" and method == "GET":
+        args = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        return await _send_json(send, *await _run(api.get_schedules, args))
+
+    if path == "/schedules" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.add_schedule, data))
+
+    if path.startswith("/schedules/") and method == "DELETE":
+        try:
+            schedule_id = int(path[len("/schedules/"):])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        return await _send_json(send, *await _run(api.delete_schedule, schedule_id))
+
+    if path == "/rules" and method == "GET":
+        return await _send_json(send, *await _run(api.get_rules))
+
+    if path == "/rules" and method == "POST":
+        data = _parse_json(await _read_body(receive))
+        return await _send_json(send, *await _run(api.add_rule, data))
+
+    if path.startswith("/rules/") and method == "DELETE":
+        try:
+            rule_id = int(path[len("/rules/"):])
+        except ValueError:
+            return await _send_json(send, {"error": "Not found"}, 404)
+        return await _send_json(send, *await _run(api.delete_rule, rule_id))
+
+    if path == "/metrics" and method == "GET":
+        if not metrics.ENABLED:
+            return await _send_json(send, {"error": "Metrics are disabled"}, 404)
+        body = await _run(api.metrics_text)
+        return await _send_response(
+            send, 200, body.encode(), [("content-type", "text/plain; version=0.0.4")]
+        )
+
+    if path == "/pins" and method == "GET":
+        return await _versioned_json(scope, send, "pins", controller.get_available_pins)
+
+    if path == "/pins/usable" and method == "GET":
+        return await _versioned_json(
+            scope, send, "pins_usable", controller.get_usable_pins
+        )
+
+    await _send_json(send, {"error": "Not found"}, 404)
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await _startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await _shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if scope["path"] == "/events" and scope["method"] == "GET":
+        # Long-lived; limited by EVENTS_MAX_SUBSCRIBERS, not by the slots
+        await _event_stream(receive, send)
+        return
+
+    start = time.perf_counter()
+    status = []
+
+    async def send_and_record(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        await send(message)
+
+    rejection = None
+    if not admission.exempt(scope["path"]):
+        headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        client = scope.get("client")
+        rejection = admission.admit(scope["method"], headers, client[0] if client else None)
+
+    if rejection is not None:
+        payload, status_code, retry_after = rejection
+        await _send_response(
+            send_and_record,
+            status_code,
+            json.dumps(payload).encode(),
+            [("content-type", "application/json"), ("retry-after", str(retry_after))],
+        )
+    else:
+        try:
+            async with _slots:
+                await _route(scope, receive, send_and_record)
+        except Exception as e:
+            print(f"Error handling {scope['method']} {scope['path']}: {e}")
+            await _send_json(send_and_record, {"error": str(e)}, 500)
+        finally:
+            if not admission.exempt(scope["path"]):
+                admission.release()
+
+    if metrics.ENABLED:
+        route = re.sub(r"/\d+", "/<id>", scope["path"].rstrip("/") or "/")
+        api.record_request(
+            route if route in ROUTES else "unmatched",
+            scope["method"],
+            status[0] if status else 500,
+            time.perf_counter() - start,
+        )
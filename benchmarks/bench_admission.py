@@ -0,0 +1,202 @@
+"""Admission control: per-request cost, and the dashboard under a flooding script.
+
+Part 1 times admission.admit() + release() in-process with a growing number
+of known clients, to show the check stays constant-time.
+
+Part 2 launches gunicorn the way the service does, with the simulated GPIO
+backend and a per-write latency, and floods it from S threads of a "script"
+client (its own API token) switching its devices with POST /devices/batch as
+fast as they can; every batch holds the controller's write lock. A
+dashboard client meanwhile toggles a device and reloads GET /devices once
+per interval, with the cookie GET / gives it. Its latency is reported with
+admission control off and on.
+
+    python benchmarks/bench_admission.py [--script-threads 32] [--latency-ms 5] [--seconds 5]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+GUNICORN = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+SCRIPT_TOKEN = "bench-script-token"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def admit_cost(clients, calls):
+    from modules import admission
+
+    addresses = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(clients)]
+    for address in addresses:
+        admission.admit("GET", {}, address)
+        admission.release()
+    start = time.perf_counter()
+    for i in range(calls):
+        if admission.admit("GET", {}, addresses[i % clients]) is None:
+            admission.release()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def request(conn, method, path, body=None, headers=None, response_headers=None):
+    headers = dict(headers or {})
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    if response_headers is not None:
+        response_headers.update(response.getheaders())
+    return response.status
+
+
+def start_hub(workdir, port, latency_ms, admission_on):
+    env = dict(
+        os.environ,
+        DEWHOME_DB_PATH=os.path.join(workdir, f"hub-{port}.db"),
+        DEWHOME_GPIO_BACKEND="simulated",
+        DEWHOME_SIM_WRITE_LATENCY_MS=str(latency_ms),
+        DEWHOME_API_TOKENS=f"script={SCRIPT_TOKEN}",
+    )
+    if not admission_on:
+        env.update(
+            DEWHOME_RATE_WRITE_PER_SECOND="0",
+            DEWHOME_RATE_READ_PER_SECOND="0",
+            DEWHOME_MAX_IN_FLIGHT="0",
+        )
+    env.pop("DEWHOME_GPIO_SOCKET", None)
+    process = subprocess.Popen(
+        [GUNICORN, "--workers", "1", "--worker-class", "gthread", "--threads", "64",
+         "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.perf_counter() + 30
+    while True:
+        try:
+            if request(http.client.HTTPConnection("127.0.0.1", port, timeout=1), "GET", "/devices") == 200:
+                return process
+        except OSError:
+            time.sleep(0.05)
+        if time.perf_counter() > deadline:
+            process.terminate()
+            raise RuntimeError("gunicorn did not answer within 30 s")
+
+
+def flood(args, workdir, admission_on):
+    port = free_port()
+    process = start_hub(workdir, port, args.latency_ms, admission_on)
+    stop = threading.Event()
+    statuses = {}
+    lock = threading.Lock()
+
+    def script():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        headers = {"Authorization": f"Bearer {SCRIPT_TOKEN}"}
+        i = 0
+        while not stop.is_set():
+            action = "high" if i % 2 else "low"
+            commands = [{"device_id": device_id, "action": action} for device_id in script_devices]
+            try:
+                status = request(conn, "POST", "/devices/batch", {"commands": commands}, headers)
+            except OSError:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = "error"
+            i += 1
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        for pin_number in (11, 12, 13, 15, 16, 18, 22):
+            request(conn, "POST", "/devices", {"name": f"Pin {pin_number}", "icon": "fa-plug", "pin_number": pin_number})
+        script_devices = list(range(3, 9))  # Device 2 is the dashboard's
+        threads = [threading.Thread(target=script, daemon=True) for _ in range(args.script_threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+
+        page = {}
+        request(conn, "GET", "/", response_headers=page)
+        dashboard = {"Cookie": page["Set-Cookie"].split(";")[0]}
+        samples = []
+        failures = 0
+        deadline = time.perf_counter() + args.seconds
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            toggled = request(conn, "POST", "/device",
+                              {"device_id": 2, "action": "high" if i % 2 else "low"}, dashboard)
+            listed = request(conn, "GET", "/devices", headers=dashboard)
+            samples.append((time.perf_counter() - start) * 1000)
+            failures += (toggled != 200) + (listed != 200)
+            i += 1
+            time.sleep(args.interval_ms / 1000)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=30)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    label = "on" if admission_on else "off"
+    script_total = sum(statuses.values())
+    print(
+        f"  admission {label:<3}  dashboard toggle+reload p50 {statistics.median(samples):7.1f} ms   "
+        f"p95 {percentile(samples, 0.95):7.1f} ms   failed {failures}/{2 * len(samples)}"
+    )
+    print(
+        f"                 script {script_total} requests: "
+        + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--script-threads", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--interval-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "inproc.db")
+    try:
+        print("admit() + release() per request")
+        for clients in (10, 1000, 100000):
+            print(f"  {clients:>7} clients   {admit_cost(clients, args.calls):6.2f} us")
+
+        if not os.path.exists(GUNICORN):
+            print("\ngunicorn not installed; skipping the flood test")
+            return
+        print(f"\n{args.script_threads} script threads flooding POST /devices/batch, "
+              f"{args.latency_ms:g} ms per pin write")
+        for admission_on in (False, True):
+            flood(args, workdir, admission_on)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
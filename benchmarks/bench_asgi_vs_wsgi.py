@@ -0,0 +1,191 @@
+"""Control API throughput and latency: gunicorn (WSGI) vs uvicorn (ASGI).
+
+Starts each server in turn on a throwaway database with the simulated GPIO
+backend, then drives a mix of GET /devices and POST /device from several
+keep-alive client threads at increasing concurrency. Prints requests per
+second and latency percentiles so the serving mode can be chosen per hub.
+
+    python benchmarks/bench_asgi_vs_wsgi.py [--duration S] [--concurrency 1,8,32]
+                                            [--latency-ms MS] [--write-ratio R]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BIN = os.path.dirname(sys.executable)
+
+SERVERS = {
+    "gunicorn-sync": [
+        os.path.join(BIN, "gunicorn"), "--workers", "1", "--bind", "127.0.0.1:{port}",
+        "--log-level", "warning", "app:app",
+    ],
+    "gunicorn-gthread": [
+        os.path.join(BIN, "gunicorn"), "--workers", "1", "--worker-class", "gthread",
+        "--threads", "64", "--bind", "127.0.0.1:{port}", "--log-level", "warning", "app:app",
+    ],
+    "uvicorn": [
+        os.path.join(BIN, "uvicorn"), "--host", "127.0.0.1", "--port", "{port}",
+        "--log-level", "warning", "asgi:app",
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/devices")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def client(port, deadline, write_ratio, samples, errors):
+    """One keep-alive client issuing requests until the deadline"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    rng = random.Random()
+    state = "high"
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if rng.random() < write_ratio:
+                state = "low" if state == "high" else "high"
+                body = json.dumps({"device_id": 1, "action": state})
+                conn.request(
+                    "POST", "/device", body, {"Content-Type": "application/json"}
+                )
+            else:
+                conn.request("GET", "/devices")
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append("connection")
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        samples.append((time.perf_counter() - start) * 1000)
+    conn.close()
+
+
+def run_load(port, concurrency, duration, write_ratio):
+    samples = []
+    errors = []
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client, args=(port, deadline, write_ratio, samples, errors))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors
+
+
+def report(label, concurrency, samples, errors, duration):
+    if not samples:
+        print(f"{label:<18} c={concurrency:<4} no successful requests ({len(errors)} errors)")
+        return
+    samples.sort()
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    print(
+        f"{label:<18} c={concurrency:<4} {len(samples) / duration:8.0f} req/s   "
+        f"p50 {pct(0.50):7.2f} ms   p95 {pct(0.95):7.2f} ms   p99 {pct(0.99):7.2f} ms   "
+        f"errors {len(errors)}"
+    )
+
+
+def bench_server(name, args, workdir):
+    port = free_port()
+    command = [part.format(port=port) for part in SERVERS[name]]
+    env = dict(
+        os.environ,
+        DEWHOME_DB_PATH=os.path.join(workdir, f"{name}.db"),
+        DEWHOME_GPIO_BACKEND="simulated",
+        DEWHOME_SIM_WRITE_LATENCY_MS=str(args.latency_ms),
+        # One client sending on purpose: measure the server, not the rate limiter
+        DEWHOME_RATE_WRITE_PER_SECOND="0",
+        DEWHOME_RATE_READ_PER_SECOND="0",
+        DEWHOME_MAX_IN_FLIGHT="0",
+    )
+    env.pop("DEWHOME_GPIO_SOCKET", None)
+
+    process = subprocess.Popen(
+        command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(port)
+        run_load(port, 4, 1.0, args.write_ratio)  # Warm up
+        for concurrency in args.concurrency:
+            samples, errors = run_load(port, concurrency, args.duration, args.write_ratio)
+            report(name, concurrency, samples, errors, args.duration)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per level")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 8, 32],
+        help="comma-separated client counts",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="simulated GPIO write latency"
+    )
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.2, help="share of POST /device requests"
+    )
+    parser.add_argument(
+        "--servers",
+        default=",".join(SERVERS),
+        help=f"comma-separated subset of: {', '.join(SERVERS)}",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    try:
+        for name in args.servers.split(","):
+            if not os.path.exists(SERVERS[name][0]):
+                print(f"{name:<18} skipped ({os.path.basename(SERVERS[name][0])} not installed)")
+                continue
+            bench_server(name, args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Dashboard first paint: server time and bytes on the wire.
+
+Boots app.py in-process against a throwaway database with the simulated GPIO
+backend and N devices, then measures:
+
+- GET / rendered with Jinja on every request (the old index()) against the
+  version-cached page, gzipped, and a 304 revalidation;
+- the bytes of the page, stylesheet, script and favicon, plain and as
+  served precompressed from /assets/;
+- an estimate of the transfer time of a first and a repeat visit on a weak
+  link (bandwidth and round-trip time are options).
+
+    python benchmarks/bench_dashboard.py [--devices 12] [--kbps 1000] [--rtt-ms 80]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def timed_ms(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=12)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--kbps", type=float, default=1000.0)
+    parser.add_argument("--rtt-ms", type=float, default=80.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["DEWHOME_GPIO_BACKEND"] = "simulated"
+    os.environ.pop("DEWHOME_GPIO_SOCKET", None)
+    os.chdir(ROOT)
+    import app
+    from modules import controller, pin_catalog
+
+    try:
+        for pin_number in pin_catalog.USABLE_PINS[1 : args.devices]:
+            controller.add_device(f"Device {pin_number}", "fa-plug", pin_number)
+        client = app.app.test_client()
+        gzip_headers = {"Accept-Encoding": "gzip, deflate, br"}
+
+        def render_every_time():
+            with app.app.test_request_context("/"):
+                app.render_index()
+
+        page = client.get("/", headers=gzip_headers)
+        etag = page.headers["ETag"]
+        print(f"GET / with {args.devices} devices (median of {args.runs})")
+        print(f"  {'Jinja render every request':<32} {timed_ms(render_every_time, args.runs):7.3f} ms")
+        print(f"  {'cached per state version (gzip)':<32} "
+              f"{timed_ms(lambda: client.get('/', headers=gzip_headers), args.runs):7.3f} ms")
+        print(f"  {'304 revalidation':<32} "
+              f"{timed_ms(lambda: client.get('/', headers=dict(gzip_headers, **{'If-None-Match': etag})), args.runs):7.3f} ms")
+
+        html = client.get("/").data
+        urls = re.findall(r'"(/assets/[^"]+)"', html.decode())
+        plain = {"/": len(html)}
+        served = {"/": len(page.data)}
+        for url in urls:
+            plain[url] = len(client.get(url).data)
+            served[url] = len(client.get(url, headers=gzip_headers).data)
+
+        print("\nbytes on the wire")
+        for url in plain:
+            print(f"  {url:<40} {plain[url]:7d} -> {served[url]:7d}")
+        print(f"  {'total':<40} {sum(plain.values()):7d} -> {sum(served.values()):7d}")
+
+        bytes_per_ms = args.kbps * 1000 / 8 / 1000
+
+        def visit_ms(sizes, requests):
+            # One round trip for the page, one for the assets fetched in parallel
+            return requests * args.rtt_ms + sum(sizes) / bytes_per_ms
+
+        print(f"\nestimated transfer at {args.kbps:g} kbit/s, {args.rtt_ms:g} ms RTT")
+        print(f"  {'first visit, uncompressed':<32} {visit_ms(plain.values(), 2):7.0f} ms")
+        print(f"  {'first visit, precompressed':<32} {visit_ms(served.values(), 2):7.0f} ms")
+        # Repeat visit: assets come from the browser cache, the page is a 304
+        print(f"  {'repeat visit, nothing changed':<32} {visit_ms([0], 1):7.0f} ms")
+    finally:
+        controller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
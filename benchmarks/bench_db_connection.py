@@ -0,0 +1,117 @@
+"""Per-call latency of db_operations before and after connection pooling.
+
+Runs the same workload against two throwaway databases: one using the
+original connect-per-call pattern with the default rollback journal, and one
+using the pooled WAL connections from modules.db_pool.
+
+    python benchmarks/bench_db_connection.py [--iterations N]
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def legacy_update_device_state(db_path, device_id, state):
+    """The pre-pool implementation: open, write, commit, close"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE devices SET state = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (state, device_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_get_device_states(db_path):
+    """The pre-pool read path"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, pin_number, state FROM devices")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def measure(label, func, iterations):
+    """Time func() iterations times and print latency statistics"""
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    print(
+        f"{label:<34} mean {statistics.mean(samples):8.1f} us   "
+        f"p50 {samples[len(samples) // 2]:8.1f} us   "
+        f"p99 {samples[int(len(samples) * 0.99) - 1]:8.1f} us"
+    )
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    legacy_db = os.path.join(workdir, "legacy.db")
+    pooled_db = os.path.join(workdir, "pooled.db")
+
+    # db_pool reads the path at import time
+    os.environ["DEWHOME_DB_PATH"] = pooled_db
+    from modules import db_operations, db_pool
+
+    db_operations.init_db()
+    db_operations.create_default_device()
+
+    conn = sqlite3.connect(legacy_db)
+    conn.execute(
+        "CREATE TABLE devices (id INTEGER PRIMARY KEY, pin_number INTEGER, "
+        "state TEXT, updated_at TIMESTAMP)"
+    )
+    conn.execute("INSERT INTO devices VALUES (1, 7, 'low', CURRENT_TIMESTAMP)")
+    conn.commit()
+    conn.close()
+
+    states = ("high", "low")
+    n = args.iterations
+    print(f"{n} iterations, databases in {workdir}\n")
+
+    before = measure(
+        "update_device_state (legacy)",
+        lambda i: legacy_update_device_state(legacy_db, 1, states[i % 2]),
+        n,
+    )
+    after = measure(
+        "update_device_state (pooled WAL)",
+        lambda i: db_operations.update_device_state(1, states[i % 2]),
+        n,
+    )
+    print(f"{'':<34} speedup x{before / after:.1f}\n")
+
+    before = measure(
+        "get_device_states (legacy)", lambda i: legacy_get_device_states(legacy_db), n
+    )
+    after = measure(
+        "get_device_states (pooled WAL)",
+        lambda i: db_operations.get_device_states(),
+        n,
+    )
+    print(f"{'':<34} speedup x{before / after:.1f}")
+
+    db_pool.close_all()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
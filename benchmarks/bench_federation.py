@@ -0,0 +1,175 @@
+"""Federation: merged device list from several hubs, sequential vs fan-out.
+
+Launches N hubs with gunicorn, each with its own throwaway database and the
+simulated GPIO backend, on local ports. Then, from this process:
+
+- asks every hub for GET /devices one after the other over a fresh
+  connection each time (what a naive aggregator does);
+- asks them through modules/federation.py: concurrently, over pooled
+  keep-alive connections, with If-None-Match;
+- freezes one hub with SIGSTOP and shows that the merged view still comes
+  back within DEWHOME_PEER_TIMEOUT_SECONDS, with that hub marked stale.
+
+    python benchmarks/bench_federation.py [--hubs 3] [--devices 8] [--runs 50]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+GUNICORN = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def call(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def launch_hub(workdir, name):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DEWHOME_DB_PATH=os.path.join(workdir, f"{name}.db"),
+        DEWHOME_GPIO_BACKEND="simulated",
+        DEWHOME_HUB_NAME=name,
+        # One client sending on purpose: measure the server, not the rate limiter
+        DEWHOME_RATE_WRITE_PER_SECOND="0",
+        DEWHOME_RATE_READ_PER_SECOND="0",
+        DEWHOME_MAX_IN_FLIGHT="0",
+    )
+    env.pop("DEWHOME_GPIO_SOCKET", None)
+    env.pop("DEWHOME_PEERS", None)
+    process = subprocess.Popen(
+        [GUNICORN, "--workers", "1", "--worker-class", "gthread", "--threads", "8",
+         "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # So the worker can be frozen with its master
+    )
+    deadline = time.perf_counter() + 30
+    while True:
+        try:
+            if call(port, "GET", "/devices")[0] == 200:
+                return process, port
+        except OSError:
+            time.sleep(0.01)
+        if time.perf_counter() > deadline:
+            process.kill()
+            raise RuntimeError(f"hub {name} did not start within 30 s")
+
+
+def sequential(ports):
+    """Merged device list, one hub after the other, a new connection each"""
+    devices = []
+    for port in ports:
+        status, body = call(port, "GET", "/devices")
+        devices.extend(json.loads(body))
+    return devices
+
+
+def timed(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hubs", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    if not os.path.exists(GUNICORN):
+        print("gunicorn not installed; skipping")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    hubs = {}
+    try:
+        for i in range(args.hubs):
+            hubs[f"hub{i + 1}"] = launch_hub(workdir, f"hub{i + 1}")
+        for name, (_, port) in hubs.items():
+            for pin_number in (11, 13, 15, 16, 18, 22, 29, 31, 36, 37)[: args.devices - 1]:
+                call(port, "POST", "/devices", {"name": f"{name} {pin_number}", "icon": "fa-plug", "pin_number": pin_number})
+
+        os.environ["DEWHOME_HUB_NAME"] = "bench"
+        os.environ["DEWHOME_PEERS"] = ",".join(
+            f"{name}=http://127.0.0.1:{port}" for name, (_, port) in hubs.items()
+        )
+        from modules import config, federation
+
+        ports = [port for _, port in hubs.values()]
+        merged = sequential(ports)
+        print(f"{args.hubs} hubs, {len(merged)} devices in total\n")
+
+        median, worst = timed(lambda: sequential(ports), args.runs)
+        print(f"{'sequential, new connection each':<36} median {median:7.2f} ms   max {worst:7.2f} ms")
+
+        federation.get_devices([])  # Open the pooled connections
+        median, worst = timed(lambda: federation.get_devices([]), args.runs)
+        print(f"{'fan-out, pooled, If-None-Match':<36} median {median:7.2f} ms   max {worst:7.2f} ms")
+
+        # Changes on a hub must show up on the next view
+        name, (_, port) = next(iter(hubs.items()))
+        call(port, "POST", "/device", {"device_id": 1, "action": "high"})
+        view = federation.get_devices([])
+        state = next(d["state"] for d in view["devices"] if d["uid"] == f"{name}:1")
+        print(f"\nafter switching {name}:1 on, the merged view shows it {state!r}")
+
+        process, _ = hubs[name]
+        os.killpg(process.pid, signal.SIGSTOP)
+        try:
+            start = time.perf_counter()
+            view = federation.get_devices([])
+            elapsed = (time.perf_counter() - start) * 1000
+        finally:
+            os.killpg(process.pid, signal.SIGCONT)
+        status = {hub["name"]: hub["status"] for hub in view["hubs"]}
+        shown = sum(1 for d in view["devices"] if d["hub"] == name)
+        print(
+            f"{name} frozen: merged view in {elapsed:.0f} ms "
+            f"(timeout {config.PEER_TIMEOUT_SECONDS * 1000:.0f} ms), "
+            f"{name} {status[name]} with {shown} cached devices"
+        )
+    finally:
+        for process, _ in hubs.values():
+            process.terminate()
+        for process, _ in hubs.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""GPIO backend write latency and full-stack toggle latency off a Pi.
+
+Measures single-pin and batched writes for every backend that can be
+loaded here, then drives POST /device through the Flask app on the simulated
+backend against a throwaway database.
+
+    python benchmarks/bench_gpio_backend.py [--iterations N] [--latency-ms MS]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# Output pins used for the raw backend measurements (BCM numbers)
+TEST_PINS = (4, 17, 27, 22, 23, 24)
+
+
+def report(label, samples):
+    """Print latency statistics for a list of microsecond samples"""
+    samples.sort()
+    print(
+        f"{label:<40} mean {statistics.mean(samples):8.1f} us   "
+        f"p50 {samples[len(samples) // 2]:8.1f} us   "
+        f"p99 {samples[int(len(samples) * 0.99) - 1]:8.1f} us"
+    )
+
+
+def bench_backend(backend, iterations):
+    """Single writes and write_many over TEST_PINS"""
+    for pin in TEST_PINS:
+        backend.setup_output(pin, 1)
+
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        backend.write(TEST_PINS[0], i % 2)
+        samples.append((time.perf_counter() - start) * 1e6)
+    report(f"{backend.name}: write (1 pin)", samples)
+
+    samples = []
+    for i in range(iterations):
+        levels = {pin: i % 2 for pin in TEST_PINS}
+        start = time.perf_counter()
+        backend.write_many(levels)
+        samples.append((time.perf_counter() - start) * 1e6)
+    report(f"{backend.name}: write_many ({len(TEST_PINS)} pins)", samples)
+    backend.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="write latency injected into the simulated backend",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["DEWHOME_GPIO_BACKEND"] = "simulated"
+    os.environ["DEWHOME_SIM_WRITE_LATENCY_MS"] = str(args.latency_ms)
+
+    from modules import gpio_backend
+
+    for name in gpio_backend.BACKENDS:
+        try:
+            backend = gpio_backend.create_backend(name)
+        except Exception as e:
+            print(f"{name}: unavailable here ({e})")
+            continue
+        bench_backend(backend, args.iterations)
+
+    # Full Flask stack on the simulated backend
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as dewhome
+
+        client = dewhome.app.test_client()
+        samples = []
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            client.post(
+                "/device", json={"device_id": 1, "action": ("high", "low")[i % 2]}
+            )
+            samples.append((time.perf_counter() - start) * 1e6)
+    report("flask: POST /device (simulated)", samples)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
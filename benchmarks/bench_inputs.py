@@ -0,0 +1,131 @@
+"""Input devices: edge-to-notification latency, debouncing and idle CPU.
+
+Boots the controller in-process against a throwaway database with the
+simulated GPIO backend and N input devices, subscribes to the device event
+stream the way GET /events does, then:
+
+- toggles one input at a time and measures the time from the edge to the
+  device_state event (with debouncing off, and with the configured window);
+- feeds bursts of contact bounce and counts the events published (one per
+  settled change is expected);
+- measures the process CPU used while the inputs are quiet.
+
+    python benchmarks/bench_inputs.py [--inputs 8] [--edges 200]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inputs", type=int, default=8)
+    parser.add_argument("--edges", type=int, default=200)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["DEWHOME_STATE_MAX_LOSS_SECONDS"] = "1"
+    from modules import config, controller, events, gpio_control, inputs, pin_catalog, state_store
+    from modules.gpio_backend import HIGH, LOW, SimulatedBackend
+
+    backend = SimulatedBackend()
+    gpio_control.set_backend(backend)
+    controller.start()
+
+    pins = {}
+    for pin_number in pin_catalog.USABLE_PINS[1 : args.inputs + 1]:
+        device_id = controller.add_device(f"Input {pin_number}", "fa-bell", pin_number, "input")
+        pins[device_id] = gpio_control.get_pin_for_device(device_id)
+
+    received = {}
+    arrived = threading.Condition()
+
+    def on_event(event):
+        data = event["data"]
+        if event["type"] == "device_state" and data["id"] in pins:
+            with arrived:
+                received[data["id"]] = (data["state"], time.perf_counter())
+                arrived.notify_all()
+
+    events.add_listener(on_event)
+    idle_level = HIGH if config.INPUT_PULL == "up" else LOW
+
+    def toggle(device_id, level):
+        """Drive an input and wait for its event; returns seconds from the edge"""
+        state = "high" if level != idle_level else "low"
+        start = time.perf_counter()
+        backend.set_input(pins[device_id], level)
+        with arrived:
+            arrived.wait_for(
+                lambda: received.get(device_id, (None, 0))[0] == state
+                and received[device_id][1] >= start,
+                timeout=5,
+            )
+        return received[device_id][1] - start
+
+    try:
+        for debounce_ms in (0, config.INPUT_DEBOUNCE_MS):
+            config.INPUT_DEBOUNCE_MS = debounce_ms
+            inputs.stop()
+            inputs.start(state_store.set_state, gpio_control.read_inputs)
+
+            samples = []
+            device_ids = list(pins)
+            for i in range(args.edges):
+                device_id = device_ids[i % len(device_ids)]
+                level = LOW if backend.read(pins[device_id]) == HIGH else HIGH
+                samples.append(toggle(device_id, level) * 1000)
+            print(
+                f"debounce {debounce_ms:3d} ms   edge -> event  "
+                f"median {statistics.median(samples):7.3f} ms   "
+                f"p99 {percentile(samples, 0.99):7.3f} ms   "
+                f"(minus debounce: {statistics.median(samples) - debounce_ms:6.3f} ms)"
+            )
+
+        # Contact bounce: 10 flips 1 ms apart, ending on the opposite level
+        device_id = next(iter(pins))
+        published = []
+        events.add_listener(
+            lambda event: event["type"] == "device_state"
+            and event["data"]["id"] == device_id
+            and published.append(event["data"]["state"])
+        )
+        for _ in range(10):
+            start_level = backend.read(pins[device_id])
+            for flip in range(11):
+                backend.set_input(pins[device_id], start_level if flip % 2 else 1 - start_level)
+                time.sleep(0.001)
+            time.sleep(config.INPUT_DEBOUNCE_MS / 1000 + 0.05)
+        print(f"\n10 bouncy presses (11 edges each): {len(published)} events published")
+
+        time.sleep(1.5)  # Let the write-behind flush settle
+        start = time.process_time()
+        time.sleep(args.idle_seconds)
+        idle_ms = (time.process_time() - start) * 1000
+        print(
+            f"idle CPU with {len(pins)} inputs: {idle_ms:.2f} ms over "
+            f"{args.idle_seconds:g} s ({idle_ms / args.idle_seconds / 10:.3f}% of a core)"
+        )
+    finally:
+        controller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
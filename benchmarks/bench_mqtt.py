@@ -0,0 +1,180 @@
+"""MQTT bridge: command latency, publish batching and writes without a broker.
+
+Boots the controller in-process against a throwaway database with the
+simulated GPIO backend and N devices, with the MQTT bridge pointed at a
+broker (mosquitto on localhost by default), then:
+
+- publishes <prefix>/devices/<id>/set commands one at a time and measures
+  the time until the device's retained state message comes back;
+- switches every device back and forth in a tight loop and counts the state
+  messages that reach a subscriber, with batching on and off;
+- points the bridge at a port where no broker listens and measures GPIO
+  write latency while it keeps reconnecting.
+
+    mosquitto -p 1883 &
+    python benchmarks/bench_mqtt.py [--host 127.0.0.1] [--port 1883] [--devices 8]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("timed out")
+        time.sleep(0.0005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        print("paho-mqtt not installed; skipping")
+        return
+    try:
+        socket.create_connection((args.host, args.port), timeout=1).close()
+    except OSError:
+        print(f"no MQTT broker on {args.host}:{args.port}; skipping")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ.update(
+        DEWHOME_DB_PATH=os.path.join(workdir, "bench.db"),
+        DEWHOME_MQTT_HOST=args.host,
+        DEWHOME_MQTT_PORT=str(args.port),
+        DEWHOME_MQTT_PREFIX=f"dewhome-bench/{os.getpid()}",
+        DEWHOME_COMMAND_COALESCE_MS="0",  # Measure the bridge, not the coalescer
+    )
+    from modules import config, controller, gpio_control, mqtt_bridge, pin_catalog
+    from modules.gpio_backend import SimulatedBackend
+
+    gpio_control.set_backend(SimulatedBackend())
+    controller.start()
+    for pin_number in pin_catalog.USABLE_PINS[1 : args.devices]:
+        controller.add_device(f"Device {pin_number}", "fa-plug", pin_number)
+    device_ids = [device["id"] for device in controller.get_all_devices()]
+
+    received = {}  # topic -> (payload, time)
+    counts = {"messages": 0}
+    lock = threading.Lock()
+
+    def on_message(client, userdata, message):
+        with lock:
+            received[message.topic] = (message.payload.decode(), time.perf_counter())
+            counts["messages"] += 1
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        observer = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    else:
+        observer = mqtt.Client()
+    observer.on_message = on_message
+    observer.connect(args.host, args.port)
+    observer.subscribe(f"{config.MQTT_PREFIX}/devices/+/state", qos=1)
+    observer.loop_start()
+
+    def state_topic(device_id):
+        return f"{config.MQTT_PREFIX}/devices/{device_id}/state"
+
+    try:
+        wait_for(mqtt_bridge.connected)
+        wait_for(lambda: all(state_topic(d) in received for d in device_ids))
+
+        # Command in, retained state out
+        samples = []
+        for i in range(args.commands):
+            device_id = device_ids[i % len(device_ids)]
+            action = "low" if controller.get_device(device_id)["state"] == "high" else "high"
+            start = time.perf_counter()
+            observer.publish(f"{config.MQTT_PREFIX}/devices/{device_id}/set", action, qos=1)
+            wait_for(lambda: received[state_topic(device_id)][0] == action
+                     and received[state_topic(device_id)][1] >= start)
+            samples.append((received[state_topic(device_id)][1] - start) * 1000)
+        print(
+            f"command -> state message   median {statistics.median(samples):6.2f} ms   "
+            f"p99 {percentile(samples, 0.99):6.2f} ms   ({args.commands} commands)"
+        )
+
+        # Bursts: every device switched back and forth as fast as possible
+        print()
+        for batch_ms in (0, config.MQTT_BATCH_MS or 20):
+            config.MQTT_BATCH_MS = batch_ms
+            mqtt_bridge.stop()
+            controller.stop()
+            controller.start()
+            wait_for(mqtt_bridge.connected)
+            time.sleep(0.3)  # Let the reconnect snapshot arrive
+            with lock:
+                counts["messages"] = 0
+            start = time.perf_counter()
+            for round_number in range(args.rounds):
+                action = "high" if round_number % 2 == 0 else "low"
+                controller.control_devices({device_id: action for device_id in device_ids})
+            elapsed = (time.perf_counter() - start) * 1000
+            final = "high" if (args.rounds - 1) % 2 == 0 else "low"
+            wait_for(lambda: all(received[state_topic(d)][0] == final for d in device_ids))
+            time.sleep(0.2)
+            changes = args.rounds * len(device_ids)
+            print(
+                f"batch {batch_ms:3d} ms   {changes} state changes in {elapsed:6.1f} ms -> "
+                f"{counts['messages']} messages published"
+            )
+
+        # No broker: writes must not wait for the network
+        print()
+        for label in ("broker connected", "broker unreachable"):
+            if label == "broker unreachable":
+                mqtt_bridge.stop()
+                config.MQTT_PORT = free_port()
+                mqtt_bridge.start(controller.control_device, controller.set_brightness, controller.get_all_devices)
+                time.sleep(0.5)
+            samples = []
+            for i in range(args.commands):
+                device_id = device_ids[i % len(device_ids)]
+                action = "low" if controller.get_device(device_id)["state"] == "high" else "high"
+                start = time.perf_counter()
+                controller.control_device(device_id, action)
+                samples.append((time.perf_counter() - start) * 1000)
+            print(
+                f"{label:<20} write median {statistics.median(samples):6.3f} ms   "
+                f"p99 {percentile(samples, 0.99):6.3f} ms"
+            )
+    finally:
+        observer.loop_stop()
+        observer.disconnect()
+        controller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
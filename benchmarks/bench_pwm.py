@@ -0,0 +1,132 @@
+"""CPU cost and timing jitter of software PWM versus hardware PWM dimmers.
+
+Software PWM (kind "soft_dimmer") toggles the pin from a Python thread, so it
+uses CPU for as long as the output is dimmed and its edges drift whenever the
+interpreter is busy, which shows up as visible flicker. Hardware PWM (kind
+"dimmer") programs the SoC's PWM peripheral once per brightness change.
+
+For each frequency the script holds a software PWM output at a fixed duty
+cycle for a few seconds (writes go to a no-op pin) and reports the CPU used and
+the spread of the measured period. The hardware path is measured on the
+simulated backend, which records duty changes the way the sysfs driver writes
+them. A fade (the default DIMMER_FADE_MS) is timed on both paths.
+
+    python benchmarks/bench_pwm.py [--seconds 3] [--frequencies 100,500,1000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def cpu_during(seconds, func=None):
+    """Process CPU time (ms) spent while sleeping for seconds after func()"""
+    start = time.process_time()
+    if func is not None:
+        func()
+    time.sleep(seconds)
+    return (time.process_time() - start) * 1000
+
+
+def software_pwm(frequency, duty, seconds):
+    from modules import pwm
+
+    rising = []
+
+    def write(level):
+        if level:
+            rising.append(time.perf_counter())
+
+    idle_ms = cpu_during(seconds)
+    output = pwm.SoftwarePWM(write, frequency, duty)
+    try:
+        busy_ms = cpu_during(seconds)
+    finally:
+        output.stop()
+
+    periods = [(b - a) * 1e6 for a, b in zip(rising, rising[1:])]
+    expected_us = 1e6 / frequency
+    return {
+        "cpu": (busy_ms - idle_ms) / seconds / 10,  # percent of one core
+        "periods": len(periods),
+        "expected_us": expected_us,
+        "median_us": statistics.median(periods) if periods else 0,
+        "stdev_us": statistics.pstdev(periods) if periods else 0,
+        "worst_us": max(periods) if periods else 0,
+    }
+
+
+def hardware_pwm(seconds):
+    from modules.gpio_backend import SimulatedBackend
+
+    backend = SimulatedBackend()
+    backend.setup_pwm(18, 1000, 50, hardware=True)
+    idle_ms = cpu_during(seconds)
+    busy_ms = cpu_during(seconds)
+    backend.cleanup()
+    return max(0.0, (busy_ms - idle_ms) / seconds / 10)
+
+
+def fade(hardware, fade_ms):
+    """CPU ms and duty writes for one fade from 0 to 100%"""
+    from modules import pwm
+    from modules.gpio_backend import SimulatedBackend
+
+    backend = SimulatedBackend()
+    backend.setup_pwm(18, 100, 0, hardware=hardware)
+    writes = []
+
+    def set_duty(pin, duty):
+        writes.append(duty)
+        backend.set_duty(pin, duty)
+
+    fader = pwm.Fader(set_duty)
+    start = time.process_time()
+    fader.fade(18, 100, fade_ms / 1000)
+    time.sleep(fade_ms / 1000 + 0.1)
+    cpu_ms = (time.process_time() - start) * 1000
+    backend.cleanup()
+    return cpu_ms, len(writes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument(
+        "--frequencies",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[100, 500, 1000],
+    )
+    parser.add_argument("--duty", type=float, default=50.0)
+    args = parser.parse_args()
+
+    from modules import config
+
+    print(f"holding {args.duty:g}% duty for {args.seconds:g} s per run\n")
+    print(f"{'output':<24} {'CPU':>8} {'period':>10} {'jitter':>10} {'worst':>10}")
+    for frequency in args.frequencies:
+        result = software_pwm(frequency, args.duty, args.seconds)
+        print(
+            f"{f'software {frequency} Hz':<24} {result['cpu']:7.1f}% "
+            f"{result['median_us']:8.0f}us {result['stdev_us']:8.0f}us "
+            f"{result['worst_us']:8.0f}us   (expected {result['expected_us']:.0f}us)"
+        )
+    print(f"{'hardware (sysfs)':<24} {hardware_pwm(args.seconds):7.1f}%        (generated by the SoC)")
+
+    print()
+    for hardware in (False, True):
+        cpu_ms, writes = fade(hardware, config.DIMMER_FADE_MS)
+        label = "hardware" if hardware else "software"
+        print(
+            f"{config.DIMMER_FADE_MS} ms fade, {label}: {writes} duty updates, "
+            f"{cpu_ms:.1f} ms CPU"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Relay restore after power-up: pin snapshot against a full app boot.
+
+Seeds a throwaway database and pin snapshot with N relays using the
+simulated GPIO backend, then measures:
+
+- the time from launching restore_pins.py until it exits with the relays
+  driven, against the time from launching gunicorn until the first GET
+  /devices succeeds (the app has configured every pin by then);
+- the cost of a snapshot write with and without an msync per write;
+- that a torn write (a corrupted newest slot) falls back to the other slot.
+
+    python benchmarks/bench_restore.py [--runs 5] [--devices 12]
+"""
+
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+GUNICORN = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def restore_ms(env):
+    """Milliseconds from launching restore_pins.py to its exit"""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "restore_pins.py"], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def first_request_ms(env):
+    """Milliseconds from launching gunicorn to the first 200 from /devices"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [GUNICORN, "--workers", "1", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/devices")
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.005)
+            if time.perf_counter() - start > 30:
+                raise RuntimeError("gunicorn did not answer within 30 s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def write_cost_us(snapshot, config, sync, writes):
+    config.SNAPSHOT_SYNC = sync
+    samples = []
+    for i in range(writes):
+        start = time.perf_counter()
+        snapshot.record({4: i % 2})
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=12)
+    parser.add_argument("--writes", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    os.environ.update(DEWHOME_DB_PATH=db_path, DEWHOME_GPIO_BACKEND="simulated")
+    os.environ.pop("DEWHOME_GPIO_SOCKET", None)
+    from modules import config, controller, pin_catalog, snapshot
+
+    try:
+        controller.start()
+        for pin_number in pin_catalog.USABLE_PINS[1 : args.devices]:
+            device_id = controller.add_device(f"Device {pin_number}", "fa-plug", pin_number)
+            controller.control_device(device_id, "high")
+        controller.stop()
+        env = dict(os.environ)
+
+        print(f"power-up to relays restored ({len(snapshot.read())} relays, median of {args.runs})")
+        restored = [restore_ms(env) for _ in range(args.runs)]
+        print(f"  {'restore_pins.py':<28} {statistics.median(restored):8.1f} ms")
+        if os.path.exists(GUNICORN):
+            booted = [first_request_ms(env) for _ in range(args.runs)]
+            print(f"  {'gunicorn first request':<28} {statistics.median(booted):8.1f} ms")
+        else:
+            print("  gunicorn not installed; skipping the app boot")
+
+        print(f"\nsnapshot write ({args.writes} writes)")
+        for sync in (True, False):
+            median, worst = write_cost_us(snapshot, config, sync, args.writes)
+            label = "msync every write" if sync else "no msync"
+            print(f"  {label:<28} median {median:8.1f} us   max {worst:8.1f} us")
+        snapshot.close()
+
+        # Tear the newest slot: the previous snapshot must still be read
+        before = snapshot.read()
+        snapshot.record({4: 1 - before[4]})
+        snapshot.close()
+        with open(config.SNAPSHOT_PATH, "r+b") as f:
+            data = bytearray(f.read())
+            newest = max(range(2), key=lambda i: int.from_bytes(data[i * 64 + 8 : i * 64 + 12], "little"))
+            data[newest * 64 + 20] ^= 0xFF
+            f.seek(0)
+            f.write(data)
+        after = snapshot.read()
+        result = "ok, previous snapshot read" if after == before else f"FAILED: {after}"
+        print(f"\ntorn newest slot: {result}")
+    finally:
+        controller.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Automation rules: compile time, per-event evaluation cost and reaction latency.
+
+Part 1 stores N rules (device triggers spread over D trigger devices, plus
+some daily time triggers) in a throwaway database, compiles them with
+rules.load() and measures the cost of one device_state event in the events
+listener, through the (device, state) index, against scanning every rule
+for a match.
+
+Part 2 boots the controller with the simulated GPIO backend and those rules
+loaded, adds one real rule (device A on -> device B on), and measures the
+time from switching A until B has been switched by the rule.
+
+    python benchmarks/bench_rules.py [--rules 1000,10000,50000] [--trigger-devices 200]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+VIRTUAL_DEVICE_BASE = 100000  # Trigger device ids that never exist as devices
+
+
+def store_rules(count, trigger_devices):
+    from modules.db_pool import get_connection
+
+    rows = []
+    for i in range(count):
+        if i % 20 == 0:
+            rows.append((None, None, f"{random.randrange(24):02d}:{random.randrange(60):02d}"))
+        else:
+            rows.append(
+                (VIRTUAL_DEVICE_BASE + random.randrange(trigger_devices), random.choice(["high", "low"]), None)
+            )
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM rules")
+        conn.executemany(
+            """
+            INSERT INTO rules (trigger_device_id, trigger_state, trigger_at, device_id, action, delay)
+            VALUES (?, ?, ?, 1, 'low', 0)
+        """,
+            rows,
+        )
+
+
+def scan(all_rules, device_id, state):
+    """The alternative to the index: test every rule's trigger"""
+    return [
+        rule["id"]
+        for rule in all_rules
+        if rule["trigger_device_id"] == device_id and rule["trigger_state"] == state
+    ]
+
+
+def evaluation(args, count):
+    from modules import rules
+
+    store_rules(count, args.trigger_devices)
+    start = time.perf_counter()
+    rules.load()
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    # The listener only runs while the engine is started; actions go nowhere
+    rules.start(lambda actions: {}, lambda: {})
+    all_rules = list(rules._rules.values())
+    events = []
+    for i in range(args.events):
+        device_id = VIRTUAL_DEVICE_BASE + random.randrange(args.trigger_devices)
+        events.append({"id": i, "type": "device_state", "data": {"id": device_id, "state": "high" if i % 2 else "low"}})
+
+    matched = [len(scan(all_rules, e["data"]["id"], e["data"]["state"])) for e in events]
+    indexed = []
+    for event in events:
+        rules._states.pop(event["data"]["id"], None)  # Make every event a change
+        start = time.perf_counter()
+        rules._on_event(event)
+        indexed.append((time.perf_counter() - start) * 1e6)
+    scanned = []
+    for event in events[: max(1, args.events // 10)]:
+        start = time.perf_counter()
+        scan(all_rules, event["data"]["id"], event["data"]["state"])
+        scanned.append((time.perf_counter() - start) * 1e6)
+    rules.stop()
+
+    print(
+        f"  {count:>6} rules   compile {compile_ms:7.1f} ms   "
+        f"index {statistics.median(indexed):7.2f} us   scan {statistics.median(scanned):9.1f} us   "
+        f"({statistics.mean(matched):.1f} rules matched per event)"
+    )
+
+
+def reaction(args, count):
+    from modules import controller, gpio_control, pin_catalog, rules
+    from modules.gpio_backend import SimulatedBackend
+
+    store_rules(count, args.trigger_devices)
+    gpio_control.set_backend(SimulatedBackend())
+    controller.start()
+    device_a = controller.add_device("A", "fa-plug", pin_catalog.USABLE_PINS[1])
+    device_b = controller.add_device("B", "fa-plug", pin_catalog.USABLE_PINS[2])
+    controller.add_rule({"device_id": device_a, "state": "high"}, device_b, "high")
+    try:
+        samples = []
+        for _ in range(args.reactions):
+            controller.control_devices({device_a: "low", device_b: "low"})
+            time.sleep(0.01)
+            start = time.perf_counter()
+            controller.control_devices({device_a: "high"})
+            while controller.get_device(device_b)["state"] != "high":
+                time.sleep(0.0001)
+            samples.append((time.perf_counter() - start) * 1000)
+        print(
+            f"  {len(rules._rules):>6} rules loaded   A on -> B on by rule   "
+            f"median {statistics.median(samples):6.2f} ms   max {max(samples):6.2f} ms"
+        )
+    finally:
+        controller.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", default="1000,10000,50000")
+    parser.add_argument("--trigger-devices", type=int, default=200)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--reactions", type=int, default=100)
+    args = parser.parse_args()
+    counts = [int(count) for count in args.rules.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["DEWHOME_COMMAND_COALESCE_MS"] = "0"
+    from modules import db_operations
+
+    random.seed(1)
+    db_operations.init_db()
+    try:
+        print(f"one device_state event, triggers over {args.trigger_devices} devices (median)")
+        for count in counts:
+            evaluation(args, count)
+        print("\nreaction time through the controller")
+        reaction(args, counts[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
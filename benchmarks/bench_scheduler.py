@@ -0,0 +1,83 @@
+"""Scheduler cost as the number of stored schedules grows.
+
+Fills a throwaway database with N recurring schedules, then measures loading
+them, the next-due lookup, adding one more schedule and firing a batch of
+actions that fall due at the same instant (with a no-op fire callback, so only
+scheduler overhead is measured).
+
+    python benchmarks/bench_scheduler.py [--schedules 1000,10000,50000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+BATCH = 100  # schedules due at the same instant
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--schedules",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1000, 10000, 50000],
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "bench.db")
+    from modules import db_operations, db_pool, scheduler
+    from modules.db_pool import get_connection
+
+    db_operations.init_db()
+    fired = []
+    scheduler._fire = lambda actions: fired.append(len(actions)) or {}
+
+    conn = get_connection()
+    now = time.time()
+    try:
+        for count in args.schedules:
+            with conn:
+                conn.execute("DELETE FROM schedules")
+                conn.executemany(
+                    "INSERT INTO schedules (device_id, action, next_run, every) "
+                    "VALUES (?, ?, ?, 86400)",
+                    [
+                        (i % 40, "high", now + 3600 + random.random() * 86400)
+                        for i in range(count - BATCH)
+                    ]
+                    + [(i, "low", now + 1800) for i in range(BATCH)],
+                )
+
+            _, load_ms = timed(scheduler.load)
+            _, peek_ms = timed(lambda: scheduler._heap[0])
+            _, add_ms = timed(
+                lambda: scheduler.add_schedule(1, "high", now + 7200, 3600)
+            )
+            ran, run_ms = timed(lambda: scheduler.run_due(now + 1800))
+            print(
+                f"{count:>7} schedules   load {load_ms:8.2f} ms   "
+                f"next-due {peek_ms * 1000:6.1f} us   add {add_ms:6.2f} ms   "
+                f"fire {ran} due {run_ms:6.2f} ms ({len(fired)} GPIO pass)"
+            )
+            fired.clear()
+    finally:
+        db_pool.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
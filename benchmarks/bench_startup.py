@@ -0,0 +1,191 @@
+"""Boot cost: schema check, device load, pin setup and time to first request.
+
+Part 1 boots the controller in-process against a throwaway database with the
+simulated GPIO backend, first on an empty database (cold) and then on the
+existing one (warm), and reports the time per step and the pin operations
+issued per pin. The pre-versioning boot (seed every time, query devices
+twice, set up every pin and then drive it again) is replayed for comparison.
+
+Part 2 launches gunicorn the way the service does and measures the time from
+process start to the first successful GET /devices.
+
+    python benchmarks/bench_startup.py [--runs N] [--devices N]
+"""
+
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+GUNICORN = os.path.join(os.path.dirname(sys.executable), "gunicorn")
+
+
+def timed(label, func, results):
+    start = time.perf_counter()
+    func()
+    results.append((label, (time.perf_counter() - start) * 1000))
+
+
+def pin_operations(backend):
+    """Pin operations issued per pin since the backend was created"""
+    counts = {}
+    for _, pin, _ in backend.history:
+        counts[pin] = counts.get(pin, 0) + 1
+    return counts
+
+
+def boot_single_pass(modules):
+    """The current controller.start() data path, step by step"""
+    db_operations, gpio_control, pin_catalog, state_store = modules
+    results = []
+    timed("schema check", db_operations.init_db, results)
+
+    devices = []
+    timed("load devices", lambda: devices.extend(db_operations.get_all_devices()), results)
+    pin_catalog.load_used(device["pin_number"] for device in devices)
+    state_store.load(devices)
+    timed(
+        "configure pins",
+        lambda: gpio_control.reconcile(state_store.get_device_states()),
+        results,
+    )
+    return results
+
+
+def boot_legacy(modules):
+    """The pre-versioning boot sequence"""
+    db_operations, gpio_control, pin_catalog, state_store = modules
+    conn = db_operations.get_connection()
+    results = []
+
+    def seed():
+        with conn:
+            db_operations.MIGRATIONS[1](conn.cursor())
+        db_operations.load_used_pins()
+
+    timed("seed schema", seed, results)
+    timed("default device check", db_operations.create_default_device, results)
+    timed("setup pins", gpio_control.setup_pins, results)
+    timed("load devices", state_store.load, results)
+    timed(
+        "drive pins again",
+        lambda: gpio_control.set_device_states(state_store.get_device_states()),
+        results,
+    )
+    return results
+
+
+def in_process(args, workdir):
+    os.environ["DEWHOME_DB_PATH"] = os.path.join(workdir, "inproc.db")
+    from modules import db_operations, gpio_control, pin_catalog, state_store
+    from modules.gpio_backend import SimulatedBackend
+    from modules import controller
+
+    modules = (db_operations, gpio_control, pin_catalog, state_store)
+
+    # Cold boot: empty database
+    backend = SimulatedBackend()
+    gpio_control.set_backend(backend)
+    start = time.perf_counter()
+    db_operations.init_db()
+    db_operations.create_default_device()
+    print(f"cold schema create + seed      {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    for pin_number in pin_catalog.USABLE_PINS[1 : args.devices]:
+        db_operations.add_device(f"Device {pin_number}", "fa-plug", pin_number)
+    controller.stop()
+
+    for label, boot in (("single pass", boot_single_pass), ("legacy", boot_legacy)):
+        samples = {}
+        operations = None
+        for _ in range(args.runs):
+            gpio_control.DEVICE_PINS.clear()
+            backend = SimulatedBackend()
+            gpio_control.set_backend(backend)
+            for step, ms in boot(modules):
+                samples.setdefault(step, []).append(ms)
+            operations = pin_operations(backend)
+
+        total = sum(statistics.median(values) for values in samples.values())
+        print(f"\nwarm boot, {label} ({len(operations)} device pins)")
+        for step, values in samples.items():
+            print(f"  {step:<28} {statistics.median(values):8.2f} ms")
+        print(f"  {'total':<28} {total:8.2f} ms")
+        print(f"  pin operations per pin: {max(operations.values())}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request_ms(db_path):
+    """Milliseconds from launching gunicorn to the first 200 from /devices"""
+    port = free_port()
+    env = dict(
+        os.environ, DEWHOME_DB_PATH=db_path, DEWHOME_GPIO_BACKEND="simulated"
+    )
+    env.pop("DEWHOME_GPIO_SOCKET", None)
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [GUNICORN, "--workers", "1", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/devices")
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.005)
+            if time.perf_counter() - start > 30:
+                raise RuntimeError("gunicorn did not answer within 30 s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def time_to_first_request(args, workdir):
+    if not os.path.exists(GUNICORN):
+        print("\ngunicorn not installed; skipping time to first request")
+        return
+
+    db_path = os.path.join(workdir, "ttfr.db")
+    cold = first_request_ms(db_path)
+    warm = [first_request_ms(db_path) for _ in range(args.runs)]
+    print("\ntime to first request (gunicorn, 1 worker)")
+    print(f"  {'cold (new database)':<28} {cold:8.1f} ms")
+    print(f"  {'warm (median)':<28} {statistics.median(warm):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=12)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-bench-")
+    try:
+        in_process(args, workdir)
+        time_to_first_request(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""End-to-end load test with per-route latency and a baseline check.
+
+Boots the hub the way the service runs it (gunicorn gthread, optionally
+several workers behind gpio_daemon.py, or uvicorn) on a throwaway database
+with the simulated GPIO backend, creates N devices, opens D dashboards
+(each loads GET / and keeps a GET /events stream open), then drives a mixed
+workload from C keep-alive clients for each concurrency level:
+
+    toggle       POST /device on a random device
+    devices      GET /devices
+    pins_usable  GET /pins/usable
+    add_delete   POST /devices on a spare pin, then DELETE /devices/<id>
+    page         GET / (the dashboard)
+
+Reports throughput and p50/p95/p99 per route and writes them as JSON. Given
+a baseline JSON, it compares route by route and exits with status 1 when a
+percentile grew, or throughput fell, by more than the threshold.
+
+    python benchmarks/loadtest.py --concurrency 1,8,32 --dashboards 10 \\
+        --output results.json [--baseline baseline.json --threshold 0.25]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+BIN = os.path.dirname(sys.executable)
+
+from modules import pin_catalog  # noqa: E402  (after the sys.path change)
+
+DEFAULT_MIX = "toggle=70,devices=20,pins_usable=5,add_delete=3,page=2"
+PERCENTILES = (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(value):
+    """{"toggle": 70, ...} from "toggle=70,devices=20" """
+    mix = {}
+    for entry in value.split(","):
+        name, _, weight = entry.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"unknown operation '{name}' (choose from {', '.join(OPERATIONS)})"
+            )
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """One keep-alive HTTP client that times every request"""
+
+    def __init__(self, port, context):
+        self.port = port
+        self.context = context
+        self.conn = None
+        self.samples = {}  # route -> [ms]
+        self.errors = {}  # route -> count
+        self.rng = random.Random()
+        self.action = "high"
+
+    def request(self, route, method, path, body=None):
+        """Issue a request; returns (status, decoded JSON or None)"""
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return None, None
+        elapsed = (time.perf_counter() - start) * 1000
+
+        self.samples.setdefault(route, []).append(elapsed)
+        if response.status >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        if response.getheader("Content-Type", "").startswith("application/json"):
+            return response.status, json.loads(data)
+        return response.status, None
+
+    def toggle(self):
+        self.action = "low" if self.action == "high" else "high"
+        device_id = self.rng.choice(self.context["device_ids"])
+        self.request("POST /device", "POST", "/device", {"device_id": device_id, "action": self.action})
+
+    def devices(self):
+        self.request("GET /devices", "GET", "/devices")
+
+    def pins_usable(self):
+        self.request("GET /pins/usable", "GET", "/pins/usable")
+
+    def add_delete(self):
+        try:
+            pin_number = self.context["spare_pins"].get_nowait()
+        except queue.Empty:
+            return self.toggle()  # Every spare pin is busy with another client
+        try:
+            status, data = self.request(
+                "POST /devices", "POST", "/devices",
+                {"name": f"Load {pin_number}", "icon": "fa-plug", "pin_number": pin_number},
+            )
+            if status == 201 or (status == 200 and data and "device_id" in data):
+                self.request("DELETE /devices/<id>", "DELETE", f"/devices/{data['device_id']}")
+        finally:
+            self.context["spare_pins"].put(pin_number)
+
+    def page(self):
+        self.request("GET /", "GET", "/")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+OPERATIONS = {
+    "toggle": Client.toggle,
+    "devices": Client.devices,
+    "pins_usable": Client.pins_usable,
+    "add_delete": Client.add_delete,
+    "page": Client.page,
+}
+
+
+def run_client(client, mix, deadline):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        OPERATIONS[client.rng.choices(names, weights)[0]](client)
+    client.close()
+
+
+class Dashboard(threading.Thread):
+    """An open dashboard: loads the page, then follows GET /events"""
+
+    def __init__(self, port, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stop = stop
+        self.events = 0
+
+    def run(self):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+
+            sock = socket.create_connection(("127.0.0.1", self.port), timeout=0.5)
+            sock.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n")
+            while not self.stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                self.events += chunk.count(b"event: device_state")
+            sock.close()
+        except OSError as e:
+            print(f"dashboard: {e}")
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(clients, duration):
+    """Per-route throughput, percentiles and errors for one concurrency level"""
+    samples = {}
+    errors = {}
+    for client in clients:
+        for route, values in client.samples.items():
+            samples.setdefault(route, []).extend(values)
+        for route, count in client.errors.items():
+            errors[route] = errors.get(route, 0) + count
+
+    routes = {}
+    everything = []
+    for route in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(route, []))
+        everything.extend(values)
+        routes[route] = {"requests": len(values), "rps": round(len(values) / duration, 1),
+                         "errors": errors.get(route, 0)}
+        for name, fraction in PERCENTILES:
+            routes[route][name] = round(percentile(values, fraction), 3) if values else None
+
+    everything.sort()
+    routes["all"] = {"requests": len(everything), "rps": round(len(everything) / duration, 1),
+                     "errors": sum(errors.values())}
+    for name, fraction in PERCENTILES:
+        routes["all"][name] = round(percentile(everything, fraction), 3) if everything else None
+    return routes
+
+
+def print_level(level, routes):
+    print(f"\nconcurrency {level}")
+    print(f"  {'route':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for route, row in routes.items():
+        cells = [f"{row[name]:9.2f}" if row[name] is not None else f"{'-':>9}" for name, _ in PERCENTILES]
+        print(f"  {route:<22} {row['rps']:9.1f} {' '.join(cells)} {row['errors']:7d}")
+
+
+def compare(results, baseline, threshold, min_delta_ms, min_requests):
+    """Regressions against a baseline: list of messages (empty if none)"""
+    regressions = []
+    print(f"\ncompared with baseline (threshold {threshold:.0%}, noise floor {min_delta_ms} ms)")
+    for key in ("server", "workers", "devices", "dashboards", "mix", "latency_ms", "env", "machine"):
+        if baseline.get("meta", {}).get(key) != results["meta"].get(key):
+            print(f"  note: {key} differs: baseline {baseline.get('meta', {}).get(key)!r}, "
+                  f"this run {results['meta'].get(key)!r}")
+    for level, routes in results["levels"].items():
+        for route, now in routes.items():
+            before = baseline.get("levels", {}).get(level, {}).get(route)
+            if not before or min(before["requests"], now["requests"]) < min_requests:
+                continue  # Too few samples for percentiles to mean anything
+            for name, _ in PERCENTILES:
+                if now[name] is None or before[name] is None:
+                    continue
+                if now[name] > before[name] * (1 + threshold) and now[name] - before[name] > min_delta_ms:
+                    regressions.append(
+                        f"c={level} {route} {name} {before[name]:.2f} -> {now[name]:.2f} ms"
+                    )
+            if before["rps"] and now["rps"] < before["rps"] * (1 - threshold):
+                regressions.append(f"c={level} {route} req/s {before['rps']:.1f} -> {now['rps']:.1f}")
+            if now["errors"] > before["errors"]:
+                regressions.append(f"c={level} {route} errors {before['errors']} -> {now['errors']}")
+
+    for message in regressions:
+        print(f"  REGRESSION {message}")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+def start_hub(args, workdir):
+    """Launch the hub; returns (processes, port)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        DEWHOME_DB_PATH=os.path.join(workdir, "device_states.db"),
+        DEWHOME_GPIO_BACKEND="simulated",
+        DEWHOME_SIM_WRITE_LATENCY_MS=str(args.latency_ms),
+        DEWHOME_EVENTS_MAX_SUBSCRIBERS=str(max(48, args.dashboards + 8)),
+        # One client sending on purpose: measure the server, not the rate limiter
+        DEWHOME_RATE_WRITE_PER_SECOND="0",
+        DEWHOME_RATE_READ_PER_SECOND="0",
+        DEWHOME_MAX_IN_FLIGHT="0",
+    )
+    env.pop("DEWHOME_GPIO_SOCKET", None)
+    env.pop("DEWHOME_MQTT_HOST", None)
+    env.pop("DEWHOME_PEERS", None)
+    env.update(args.env)
+    processes = []
+
+    if args.workers > 1:
+        env["DEWHOME_GPIO_SOCKET"] = os.path.join(workdir, "gpio.sock")
+        processes.append(subprocess.Popen(
+            [sys.executable, "gpio_daemon.py"], cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        deadline = time.monotonic() + 15
+        while not os.path.exists(env["DEWHOME_GPIO_SOCKET"]):
+            if time.monotonic() > deadline:
+                raise RuntimeError("gpio_daemon.py did not start")
+            time.sleep(0.05)
+
+    if args.server == "uvicorn":
+        command = [os.path.join(BIN, "uvicorn"), "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning", "asgi:app"]
+    else:
+        command = [os.path.join(BIN, "gunicorn"), "--workers", str(args.workers),
+                   "--worker-class", "gthread", "--threads", str(args.threads),
+                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    if not os.path.exists(command[0]):
+        raise RuntimeError(f"{os.path.basename(command[0])} is not installed")
+    processes.append(subprocess.Popen(
+        command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    ))
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/devices")
+            if conn.getresponse().status == 200:
+                return processes, port
+        except OSError:
+            time.sleep(0.05)
+        if time.monotonic() > deadline:
+            raise RuntimeError("the hub did not answer within 30 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=("gunicorn", "uvicorn"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="web workers; more than 1 runs gpio_daemon.py as well")
+    parser.add_argument("--threads", type=int, default=64, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        type=lambda value: [int(level) for level in value.split(",")])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--dashboards", type=int, default=10, help="open /events streams")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated GPIO write latency")
+    parser.add_argument("--env", action="append", default=[], metavar="DEWHOME_X=VALUE",
+                        type=lambda value: tuple(value.split("=", 1)),
+                        help="hub setting for this run, e.g. DEWHOME_COMMAND_COALESCE_MS=0")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative change before a regression fails the run")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="latency changes smaller than this never count as regressions")
+    parser.add_argument("--min-requests", type=int, default=50,
+                        help="routes with fewer requests than this are not compared")
+    args = parser.parse_args()
+    args.env = [pair for pair in args.env if len(pair) == 2]
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+    if args.server == "uvicorn":
+        args.mix.pop("page", None)  # The dashboard page is only served by app.py
+
+    workdir = tempfile.mkdtemp(prefix="dewhome-load-")
+    processes = []
+    stop = threading.Event()
+    dashboards = []
+    try:
+        processes, port = start_hub(args, workdir)
+        setup = Client(port, {})
+        pins = list(pin_catalog.USABLE_PINS[1:])
+        for pin_number in pins[: args.devices - 1]:
+            setup.request("setup", "POST", "/devices",
+                          {"name": f"Device {pin_number}", "icon": "fa-plug", "pin_number": pin_number})
+        _, devices = setup.request("setup", "GET", "/devices")
+        setup.close()
+        spare_pins = queue.Queue()
+        for pin_number in pins[args.devices - 1 :]:
+            spare_pins.put(pin_number)
+        context = {"device_ids": [device["id"] for device in devices], "spare_pins": spare_pins}
+
+        for _ in range(args.dashboards):
+            dashboard = Dashboard(port, stop)
+            dashboard.start()
+            dashboards.append(dashboard)
+
+        print(
+            f"{args.server}, {args.workers} worker(s), {len(context['device_ids'])} devices, "
+            f"{args.dashboards} dashboards, mix {args.mix}"
+        )
+        if args.env:
+            print("settings: " + " ".join(f"{name}={value}" for name, value in args.env))
+        results = {
+            "meta": {
+                "server": args.server,
+                "workers": args.workers,
+                "devices": len(context["device_ids"]),
+                "dashboards": args.dashboards,
+                "mix": args.mix,
+                "duration": args.duration,
+                "latency_ms": args.latency_ms,
+                "env": dict(args.env),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            },
+            "levels": {},
+        }
+
+        for level in args.concurrency:
+            for duration, record in ((args.warmup, False), (args.duration, True)):
+                clients = [Client(port, context) for _ in range(level)]
+                deadline = time.monotonic() + duration
+                threads = [
+                    threading.Thread(target=run_client, args=(client, args.mix, deadline))
+                    for client in clients
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            routes = summarize(clients, args.duration)
+            results["levels"][str(level)] = routes
+            print_level(level, routes)
+
+        stop.set()
+        for dashboard in dashboards:
+            dashboard.join(timeout=2)
+        delivered = [dashboard.events for dashboard in dashboards]
+        if delivered:
+            print(f"\ndevice_state events per dashboard: min {min(delivered)}, max {max(delivered)}")
+            results["meta"]["dashboard_events"] = {"min": min(delivered), "max": max(delivered)}
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print(f"\nresults written to {args.output}")
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if compare(results, baseline, args.threshold, args.min_delta_ms, args.min_requests):
+                sys.exit(1)
+    finally:
+        stop.set()
+        for process in reversed(processes):
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
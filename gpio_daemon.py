@@ -0,0 +1,153 @@
+"""DEWHOME GPIO daemon.
+
+Owns the GPIO pins and the in-memory device state (modules.controller) so
+that the web tier can run any number of gunicorn workers. Workers connect over
+a Unix socket using the line-delimited JSON protocol described in
+modules/gpio_client.py and point at it with DEWHOME_GPIO_SOCKET.
+
+    python gpio_daemon.py [--socket /run/dewhome/gpio.sock]
+"""
+
+import argparse
+import os
+import signal
+import socketserver
+import threading
+
+from modules import config
+from modules import controller
+from modules import events
+from modules.gpio_client import read_message, send_message
+
+DEFAULT_SOCKET = "/run/dewhome/gpio.sock"
+
+# Every state-changing operation runs under this lock, so pin writes from
+# different workers are applied one at a time, in arrival order.
+_write_lock = threading.Lock()
+
+
+def _control_many(pairs):
+    errors = controller.control_devices({device_id: action for device_id, action in pairs})
+    return [[device_id, error] for device_id, error in errors.items()]
+
+
+# op -> (handler, serialized)
+OPERATIONS = {
+    "ping": (lambda: "pong", False),
+    "metrics": (controller.get_metrics, False),
+    "version": (controller.version, False),
+    "devices": (controller.get_all_devices, False),
+    "device": (controller.get_device, False),
+    "pins": (controller.get_available_pins, False),
+    "usable_pins": (controller.get_usable_pins, False),
+    "history": (controller.get_device_history, False),
+    # Not under _write_lock: callers wait out the coalescing window, and the
+    # controller orders the writes itself
+    "control": (controller.control_device, False),
+    "control_many": (_control_many, True),
+    "brightness": (controller.set_brightness, True),
+    "add_device": (controller.add_device, True),
+    "remove_device": (controller.remove_device, True),
+    "groups": (controller.get_groups, False),
+    "add_group": (controller.add_group, True),
+    "update_group": (controller.update_group, True),
+    "remove_group": (controller.remove_group, True),
+    "control_group": (controller.control_group, True),
+    "schedules": (controller.get_schedules, False),
+    "add_schedule": (controller.add_schedule, True),
+    "remove_schedule": (controller.remove_schedule, True),
+    "rules": (controller.get_rules, False),
+    "add_rule": (controller.add_rule, True),
+    "remove_rule": (controller.remove_rule, True),
+}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Serve one worker connection until it hangs up"""
+
+    def handle(self):
+        while True:
+            try:
+                request = read_message(self.rfile)
+            except (EOFError, OSError, ValueError):
+                return
+
+            op = request.get("op")
+            if op == "subscribe":
+                send_message(self.wfile, {"ok": True, "result": None})
+                self.stream_events()
+                return
+
+            send_message(self.wfile, self.dispatch(op, request.get("args") or []))
+
+    def dispatch(self, op, args):
+        if op not in OPERATIONS:
+            return {"ok": False, "error": f"Unknown operation '{op}'", "type": "ValueError"}
+
+        handler, serialized = OPERATIONS[op]
+        try:
+            if serialized:
+                with _write_lock:
+                    result = handler(*args)
+            else:
+                result = handler(*args)
+            return {"ok": True, "result": result}
+        except Exception as e:
+            return {"ok": False, "error": str(e), "type": type(e).__name__}
+
+    def stream_events(self):
+        """Forward every published device event to this connection"""
+        try:
+            subscriber = events.subscribe()
+        except events.TooManySubscribers:
+            return
+
+        try:
+            while True:
+                event = subscriber.get(config.EVENTS_KEEPALIVE_SECONDS)
+                if event is None:
+                    event = {"type": "keepalive", "data": None}
+                send_message(self.wfile, {"type": event["type"], "data": event["data"]})
+        except OSError:
+            pass
+        finally:
+            events.unsubscribe(subscriber)
+
+
+class GPIODaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DEWHOME GPIO daemon")
+    parser.add_argument(
+        "--socket",
+        default=config.GPIO_SOCKET or DEFAULT_SOCKET,
+        help=f"Unix socket path (default: $DEWHOME_GPIO_SOCKET or {DEFAULT_SOCKET})",
+    )
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # Left over from a previous run
+
+    controller.start()
+    server = GPIODaemon(args.socket, RequestHandler)
+    os.chmod(args.socket, 0o660)  # Owner and the gpio group only
+
+    def shutdown(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"GPIO daemon listening on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import collections
+import hmac
+import math
+import os
+import threading
+import time
+
+from modules import config
+from modules import metrics
+
+# Admission control for the HTTP API, shared by app.py and asgi.py.
+#
+# Each request is checked before it is handled, in constant time and without
+# touching the database or the GPIO daemon:
+#
+# - Per-client rate limits. A client is the name of its API token (sent as
+#   "Authorization: Bearer <token>" or X-API-Token) or else its address; the
+#   X-Real-IP set by the local nginx is used for requests that come through
+#   it. Every client has a token bucket for writes (POST, PUT, DELETE) and
+#   one for reads, refilled on access. An empty bucket answers 429 with a
+#   Retry-After.
+# - A global cap on requests in flight. Interactive requests (the dashboard,
+#   whose requests carry the cookie GET / issues, and clients listed in
+#   INTERACTIVE_CLIENTS) may use every slot; everything else leaves the last
+#   INTERACTIVE_RESERVED slots free, so a bulk script cannot starve the wall
+#   switch UI. A full server answers 503 at once rather than queueing the
+#   request behind the others. The cookie holds a random key kept in
+#   DASHBOARD_KEY_PATH, shared by every worker, so it cannot be made up.
+#
+# The state is per process. The in-flight cap is for the whole hub, so with
+# WEB_WORKERS web workers each one takes its share of it. Rate limits are
+# not split: a client on one keep-alive connection stays on one worker, and
+# must get its full budget there, so across workers a client may get up to
+# WEB_WORKERS times its rate. /events (capped by EVENTS_MAX_SUBSCRIBERS),
+# /metrics and static files are not limited.
+
+DASHBOARD_COOKIE = "dewhome_dashboard"
+EXEMPT_PATHS = ("/events", "/metrics", "/favicon.ico")
+EXEMPT_PREFIXES = ("/assets/", "/static/")
+WRITE_METHODS = ("POST", "PUT", "DELETE", "PATCH")
+TRUSTED_PROXIES = ("127.0.0.1", "::1")
+
+REJECTED = metrics.counter(
+    "dewhome_admission_rejected",
+    "Requests turned away by admission control (rate_write, rate_read, busy)",
+    ["reason", "priority"],
+)
+
+_lock = threading.Lock()
+_buckets = collections.OrderedDict()  # (client, kind) -> [tokens, refilled at]
+_in_flight = 0
+_stats = {"admitted": 0, "rate_write": 0, "rate_read": 0, "busy": 0}
+
+
+def parse_tokens(spec):
+    """API tokens from "name=token,name=token"; returns token -> name"""
+    tokens = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, separator, token = entry.partition("=")
+        if not separator or not name.strip() or not token.strip():
+            raise ValueError(f"API token '{entry}' must be name=token")
+        tokens[token.strip()] = name.strip()
+    return tokens
+
+
+TOKENS = {}
+try:
+    TOKENS = parse_tokens(config.API_TOKENS)
+except ValueError as e:
+    print(f"Warning: ignoring DEWHOME_API_TOKENS: {e}")
+
+INTERACTIVE = {name.strip() for name in config.INTERACTIVE_CLIENTS.split(",") if name.strip()}
+
+
+def _load_dashboard_key():
+    """The dashboard cookie's value, created on first use"""
+    path = config.DASHBOARD_KEY_PATH
+    try:
+        if not os.path.exists(path):
+            # Written aside and linked into place, so workers starting
+            # together all end up reading the one complete key
+            temporary = f"{path}.{os.getpid()}"
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(os.urandom(16).hex())
+            try:
+                os.link(temporary, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temporary)
+        with open(path) as f:
+            return f.read().strip()
+    except OSError as e:
+        print(f"Warning: dashboard key not saved, it only holds for this process: {e}")
+        return os.urandom(16).hex()
+
+
+_dashboard_key = None
+
+
+def dashboard_key():
+    """Value of the cookie that marks the dashboard's requests as interactive"""
+    global _dashboard_key
+
+    if _dashboard_key is None:
+        _dashboard_key = _load_dashboard_key()
+    return _dashboard_key
+
+
+def _from_dashboard(headers):
+    """True if the request carries the dashboard cookie"""
+    prefix = DASHBOARD_COOKIE + "="
+    for cookie in headers.get("cookie", "").split(";"):
+        cookie = cookie.strip()
+        if cookie.startswith(prefix):
+            return hmac.compare_digest(cookie[len(prefix):], dashboard_key())
+    return False
+
+
+def exempt(path):
+    """True for routes admission control leaves alone"""
+    return path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES)
+
+
+def client_key(headers, remote_addr):
+    """Name of the client's API token, or its address"""
+    authorization = headers.get("authorization", "")
+    token = authorization[7:].strip() if authorization[:7].lower() == "bearer " else ""
+    token = token or headers.get("x-api-token", "")
+    if token in TOKENS:
+        return TOKENS[token]
+    if remote_addr in TRUSTED_PROXIES and headers.get("x-real-ip"):
+        return headers.get("x-real-ip")
+    return remote_addr or "unknown"
+
+
+def _take(client, kind, rate, burst, now):
+    """Take a token from a client's bucket; returns 0, or seconds until one is free"""
+    key = (client, kind)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = [float(burst), now]
+        if len(_buckets) > config.RATE_MAX_CLIENTS * 2:
+            _buckets.popitem(last=False)  # Least recently seen client
+    else:
+        _buckets.move_to_end(key)
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    if bucket[0] >= 1:
+        bucket[0] -= 1
+        return 0
+    return (1 - bucket[0]) / rate
+
+
+def _share(limit):
+    """This worker's part of a hub-wide limit; 0 (off) stays 0"""
+    return limit and max(1, limit // config.WEB_WORKERS)
+
+
+def admit(method, headers, remote_addr):
+    """Admit a request, or turn it away
+
+    headers is a mapping with case-insensitive get() (lowercase names are
+    used). Returns None when the request may go ahead, and release() must be
+    called once it has been handled; otherwise (payload, status, retry after
+    seconds) of the response to send instead.
+    """
+    global _in_flight
+
+    client = client_key(headers, remote_addr)
+    interactive = client in INTERACTIVE or _from_dashboard(headers)
+    priority = "interactive" if interactive else "bulk"
+    if method in WRITE_METHODS:
+        kind, rate, burst = "write", config.RATE_WRITE_PER_SECOND, config.RATE_WRITE_BURST
+    else:
+        kind, rate, burst = "read", config.RATE_READ_PER_SECOND, config.RATE_READ_BURST
+    limit = _share(config.MAX_IN_FLIGHT)
+    if limit and not interactive:
+        limit = max(1, limit - _share(config.INTERACTIVE_RESERVED))
+
+    with _lock:
+        wait = _take(client, kind, rate, burst, time.monotonic()) if rate else 0
+        if wait:
+            reason = f"rate_{kind}"
+        elif limit and _in_flight >= limit:
+            reason = "busy"
+        else:
+            _in_flight += 1
+            _stats["admitted"] += 1
+            return None
+        _stats[reason] += 1
+
+    REJECTED.inc(reason, priority)
+    if reason == "busy":
+        return {"error": "Server busy, try again shortly"}, 503, 1
+    return (
+        {"error": f"Rate limit exceeded for {kind}s, retry in {wait:.1f} s"},
+        429,
+        max(1, math.ceil(wait)),
+    )
+
+
+def release():
+    """Free the in-flight slot of an admitted request"""
+    global _in_flight
+
+    with _lock:
+        _in_flight -= 1
+
+
+def in_flight():
+    """Admitted requests not yet released"""
+    return _in_flight
+
+
+def stats():
+    """Request counts: admitted, and rejected by reason"""
+    with _lock:
+        return dict(_stats)
+
+
+metrics.gauge(
+    "dewhome_admission_in_flight", "API requests being handled", in_flight
+)
@@ -0,0 +1,457 @@
+import json
+import os
+import re
+import threading
+
+from modules import config
+from modules import federation
+from modules import metrics
+
+# Framework-independent request handling shared by the Flask app (app.py) and
+# the ASGI app (asgi.py). Handlers take decoded JSON and return
+# (payload, status); the web layer only does the HTTP plumbing.
+
+if config.GPIO_SOCKET:
+    # GPIO and device state are owned by gpio_daemon.py; this process only
+    # serves HTTP, so any number of workers can run side by side
+    from modules import gpio_client as controller
+else:
+    from modules import controller
+
+# Serialized JSON bodies of read-only routes, keyed by route and state version.
+_response_cache = {}  # cache key -> (version, body)
+_response_cache_lock = threading.Lock()
+
+
+REQUEST_SECONDS = metrics.histogram(
+    "dewhome_http_request_seconds",
+    "HTTP request handling time by route",
+    ["route", "method"],
+)
+REQUESTS = metrics.counter(
+    "dewhome_http_requests",
+    "HTTP requests by route and status; 4xx/5xx are the error rate",
+    ["route", "method", "status"],
+)
+
+
+def route_label(rule):
+    """Metric label for a route, e.g. /devices/<int:device_id> -> /devices/<id>"""
+    return re.sub(r"<[^>]+>", "<id>", rule) if rule else "unmatched"
+
+
+def record_request(route, method, status, seconds):
+    """Count a finished request and record its duration"""
+    REQUEST_SECONDS.observe(seconds, route, method)
+    REQUESTS.inc(route, method, str(status))
+
+
+def metrics_text():
+    """GET /metrics body: this process, plus the GPIO daemon when there is one
+
+    Each web worker counts only the requests it served, and a scrape reaches
+    any one of them, so their samples carry the worker's pid to keep every
+    series monotonic.
+    """
+    if not config.GPIO_SOCKET:
+        return metrics.render([(None, metrics.collect())])
+
+    sources = [({"process": "web", "worker": str(os.getpid())}, metrics.collect())]
+    try:
+        sources.append(({"process": "daemon"}, controller.get_metrics()))
+    except Exception as e:
+        print(f"Error reading GPIO daemon metrics: {e}")
+    return metrics.render(sources)
+
+
+def current_etag():
+    """(version, strong ETag value) for the current device state
+
+    Both carry the controller's boot tag with its state version, so every web
+    worker gives the same state the same ETag, and a restarted controller
+    never matches a body cached before it.
+    """
+    boot_tag, version = controller.version()
+    tagged = f"{boot_tag}-{version}"
+    return tagged, tagged
+
+
+def cached_body(cache_key, version, build):
+    """Response body returned by build(), computed at most once per state version"""
+    with _response_cache_lock:
+        cached = _response_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    body = build()
+    with _response_cache_lock:
+        _response_cache[cache_key] = (version, body)
+    return body
+
+
+def cached_json(cache_key, version, build):
+    """Serialized build() result, computed at most once per state version"""
+
+    def serialize():
+        data = build()
+        with metrics.stage("json"):
+            return json.dumps(data, sort_keys=True)
+
+    return cached_body(cache_key, version, serialize)
+
+
+def parse_command(data):
+    """Validate a {device_id, action} command; returns (device_id, action)"""
+    if not isinstance(data, dict):
+        raise ValueError("Invalid command")
+
+    try:
+        device_id = int(data.get("device_id"))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid device ID")
+
+    action = data.get("action")  # 'high' or 'low'
+    if action not in ["high", "low"]:
+        raise ValueError("Invalid action")
+
+    return device_id, action
+
+
+def parse_brightness(data):
+    """Validate a {device_id, brightness, fade_ms?} command
+
+    Returns (device_id, brightness, fade_ms); fade_ms is None when omitted.
+    """
+    try:
+        device_id = int(data.get("device_id"))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid device ID")
+
+    brightness = data.get("brightness")
+    if isinstance(brightness, bool) or not isinstance(brightness, (int, float)):
+        raise ValueError("Brightness must be a number from 0 to 100")
+    if not 0 <= brightness <= 100:
+        raise ValueError("Brightness must be a number from 0 to 100")
+
+    fade_ms = data.get("fade_ms")
+    if fade_ms is not None:
+        if isinstance(fade_ms, bool) or not isinstance(fade_ms, (int, float)):
+            raise ValueError("fade_ms must be a number of milliseconds")
+        if not 0 <= fade_ms <= 60000:
+            raise ValueError("fade_ms must be between 0 and 60000")
+
+    return device_id, round(brightness), fade_ms
+
+
+def control_device(data):
+    """POST /device"""
+    if isinstance(data, dict) and "brightness" in data:
+        return set_brightness(data)
+
+    try:
+        device_id, action = parse_command(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        # May carry later commands for the same device (see modules/coalescer.py)
+        result = controller.control_device(device_id, action)
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+    return {
+        "message": f"Device {device_id} turned {result['state']}",
+        "state": result["state"],
+        "changed": result["changed"],
+        "coalesced": result["coalesced"],
+    }, 200
+
+
+def set_brightness(data):
+    """POST /device with a brightness (dimmers only)"""
+    try:
+        device_id, brightness, fade_ms = parse_brightness(data)
+        controller.set_brightness(device_id, brightness, fade_ms)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+    return {
+        "message": f"Device {device_id} brightness set to {brightness}%",
+        "brightness": brightness,
+    }, 200
+
+
+def federation_devices():
+    """GET /federation/devices"""
+    try:
+        return federation.get_devices(controller.get_all_devices()), 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def federation_control(data):
+    """POST /federation/device: a command for a device on any hub"""
+    hub = data.get("hub") if isinstance(data, dict) else None
+    if hub is None or hub == config.HUB_NAME:
+        return control_device(data)
+
+    try:
+        device_id, action = parse_command(data)
+        return federation.send_command(hub, device_id, action)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+
+def control_devices_batch(data):
+    """POST /devices/batch"""
+    commands = data.get("commands") if isinstance(data, dict) else data
+
+    if not isinstance(commands, list) or not commands:
+        return {"error": "A non-empty list of commands is required"}, 400
+
+    # Validate everything up front; only valid commands reach the GPIO pins
+    results = []
+    actions = {}
+    latest = {}  # device_id -> result of its last command
+    for command in commands:
+        try:
+            device_id, action = parse_command(command)
+        except ValueError as e:
+            device_id = command.get("device_id") if isinstance(command, dict) else None
+            results.append({"device_id": device_id, "success": False, "error": str(e)})
+            continue
+
+        # Last command for a device wins; earlier ones are never applied
+        if device_id in latest:
+            latest[device_id].update(success=False, error="superseded")
+        actions[device_id] = action
+        latest[device_id] = {"device_id": device_id, "action": action}
+        results.append(latest[device_id])
+
+    errors = {}
+    if actions:
+        try:
+            # One GPIO pass, and one state update persisted in a single transaction
+            errors = controller.control_devices(actions)
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    for result in latest.values():
+        error = errors.get(result["device_id"])
+        result["success"] = error is None
+        if error:
+            result["error"] = error
+
+    succeeded = sum(1 for result in results if result["success"])
+    status = 200 if succeeded == len(results) else 207
+    return (
+        {
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+        },
+        status,
+    )
+
+
+def add_device(data):
+    """POST /devices"""
+    data = data if isinstance(data, dict) else {}
+    name = data.get("name")
+    icon = data.get("icon", "fa-plug")
+    pin_number = data.get("pin_number")
+    kind = data.get("kind", "switch")
+
+    if not name or not pin_number:
+        return {"error": "Name and pin number are required"}, 400
+
+    try:
+        pin_number = int(pin_number)
+        device_id = controller.add_device(name, icon, pin_number, kind)
+
+        return (
+            {
+                "message": f"Device '{name}' added successfully",
+                "device_id": device_id,
+            },
+            201,
+        )
+    except Exception as e:
+        return {"error": str(e)}, 400
+
+
+def device_history(device_id, args):
+    """GET /devices/<id>/history?start=&end=&resolution=hour|day"""
+    try:
+        history = controller.get_device_history(
+            device_id,
+            args.get("start"),
+            args.get("end"),
+            args.get("resolution", "hour"),
+        )
+        return history, 200
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def delete_device(device_id):
+    """DELETE /devices/<id>"""
+    try:
+        controller.remove_device(device_id)
+
+        return {"message": f"Device {device_id} deleted successfully"}, 200
+    except Exception as e:
+        return {"error": str(e)}, 400
+
+
+def _group_fields(data, partial=False):
+    """Validated name, icon and device_ids of a group body (None when absent)"""
+    if not isinstance(data, dict):
+        raise ValueError("Invalid group")
+
+    name = data.get("name")
+    if name is not None and (not isinstance(name, str) or not name.strip()):
+        raise ValueError("Name must be a non-empty string")
+    if name is None and not partial:
+        raise ValueError("Name is required")
+
+    device_ids = data.get("device_ids")
+    if device_ids is not None and not isinstance(device_ids, list):
+        raise ValueError("device_ids must be a list of device IDs")
+
+    return (name.strip() if name else None), data.get("icon"), device_ids
+
+
+def add_group(data):
+    """POST /groups"""
+    try:
+        name, icon, device_ids = _group_fields(data)
+        group = controller.add_group(name, icon or "fa-layer-group", device_ids or [])
+        return group, 201
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def update_group(group_id, data):
+    """PUT /groups/<id>"""
+    try:
+        name, icon, device_ids = _group_fields(data, partial=True)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        return controller.update_group(group_id, name, icon, device_ids), 200
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def delete_group(group_id):
+    """DELETE /groups/<id>"""
+    try:
+        controller.remove_group(group_id)
+        return {"message": f"Group {group_id} deleted successfully"}, 200
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def group_action(group_id, data):
+    """POST /groups/<id>/action"""
+    action = data.get("action") if isinstance(data, dict) else None
+    if action not in ["high", "low"]:
+        return {"error": "Invalid action"}, 400
+
+    try:
+        # One GPIO pass and one state update for every member
+        result = controller.control_group(group_id, action)
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+    return result, 207 if result["errors"] else 200
+
+
+def get_schedules(args):
+    """GET /schedules?device_id="""
+    try:
+        device_id = args.get("device_id")
+        device_id = int(device_id) if device_id is not None else None
+    except ValueError:
+        return {"error": "Invalid device ID"}, 400
+
+    try:
+        return controller.get_schedules(device_id), 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def add_schedule(data):
+    """POST /schedules"""
+    if not isinstance(data, dict) or data.get("at") is None:
+        return {"error": "device_id, action and at are required"}, 400
+
+    try:
+        device_id, action = parse_command(data)
+        schedule = controller.add_schedule(device_id, action, data["at"], data.get("every"))
+        return schedule, 201
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def delete_schedule(schedule_id):
+    """DELETE /schedules/<id>"""
+    try:
+        controller.remove_schedule(schedule_id)
+        return {"message": f"Schedule {schedule_id} deleted successfully"}, 200
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def get_rules():
+    """GET /rules"""
+    try:
+        return controller.get_rules(), 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def add_rule(data):
+    """POST /rules"""
+    if not isinstance(data, dict) or data.get("trigger") is None:
+        return {"error": "trigger, device_id and action are required"}, 400
+
+    try:
+        device_id, action = parse_command(data)
+        rule = controller.add_rule(
+            data["trigger"], device_id, action, data.get("delay", 0), data.get("name", "")
+        )
+        return rule, 201
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def delete_rule(rule_id):
+    """DELETE /rules/<id>"""
+    try:
+        controller.remove_rule(rule_id)
+        return {"message": f"Rule {rule_id} deleted successfully"}, 200
+    except ValueError as e:
+        return {"error": str(e)}, 404
+    except Exception as e:
+        return {"error": str(e)}, 500
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+# Content-hashed, precompressed static assets.
+#
+# build() copies every file under static/ to static/build/ with a hash of its
+# contents in the name (css/style.css -> css/style.1a2b3c4d5e6f.css), next to
+# .gz and, when the brotli package is installed, .br variants. The dashboard
+# links to those names through url(), so a hashed URL never changes content:
+# browsers may cache it for a year without revalidating, and a new release
+# is picked up because its URLs differ. nginx serves static/build/ directly
+# (gzip_static); app.py serves it from memory at /assets/ otherwise.
+#
+# Files are only written when missing, so concurrent workers building at the
+# same time (or running `python -m modules.assets` at install time) agree.
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static")
+BUILD_DIR = os.path.join(STATIC_DIR, "build")
+URL_PREFIX = "/assets/"
+MAX_AGE = 365 * 24 * 3600
+
+# Only worth compressing text; images such as PNG are compressed already
+COMPRESSIBLE = (".css", ".js", ".html", ".svg", ".json", ".txt", ".ico")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_lock = threading.Lock()
+_manifest = {}  # source name -> hashed name
+_files = {}  # hashed name -> {"body", "gzip", "br", "mimetype", "etag"}
+
+
+def _hashed_name(name, digest):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def _write(path, data):
+    """Write a build file unless it is already there (same name, same content)"""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def _variants(name, data):
+    """Precompressed encodings of data that are actually smaller"""
+    variants = {}
+    if not name.endswith(COMPRESSIBLE):
+        return variants
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        variants["gzip"] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            variants["br"] = compressed
+    return variants
+
+
+def _sources():
+    for directory, subdirectories, filenames in os.walk(STATIC_DIR):
+        if os.path.abspath(directory) == os.path.abspath(STATIC_DIR):
+            subdirectories[:] = [d for d in subdirectories if d != "build"]
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            yield os.path.relpath(path, STATIC_DIR).replace(os.sep, "/"), path
+
+
+def build():
+    """Hash, compress and write every static asset; returns the manifest
+
+    The assets are also kept in memory for app.py's /assets/ route, so they
+    are still served hashed if static/build/ cannot be written.
+    """
+    manifest = {}
+    files = {}
+    writable = True
+    for name, path in _sources():
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = _hashed_name(name, digest)
+        variants = _variants(name, data)
+        manifest[name] = hashed
+        files[hashed] = {
+            "body": data,
+            "gzip": variants.get("gzip"),
+            "br": variants.get("br"),
+            "mimetype": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "etag": digest,
+        }
+
+        if not writable:
+            continue
+        try:
+            target = os.path.join(BUILD_DIR, hashed)
+            _write(target, data)
+            if "gzip" in variants:
+                _write(target + ".gz", variants["gzip"])
+            if "br" in variants:
+                _write(target + ".br", variants["br"])
+        except OSError as e:
+            print(f"Warning: cannot write {BUILD_DIR} ({e}); assets are served from memory only")
+            writable = False
+
+    with _lock:
+        _manifest.clear()
+        _manifest.update(manifest)
+        _files.clear()
+        _files.update(files)
+    if writable:
+        _prune(files)
+    return manifest
+
+
+def _prune(files):
+    """Remove build files of assets that no longer exist in this version"""
+    keep = set()
+    for hashed in files:
+        keep.update((hashed, hashed + ".gz", hashed + ".br"))
+    for directory, _, filenames in os.walk(BUILD_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, BUILD_DIR).replace(os.sep, "/")
+            if name not in keep and not name.endswith(".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def url(name):
+    """URL of a static asset: hashed under /assets/, or plain under /static/"""
+    with _lock:
+        hashed = _manifest.get(name)
+    if hashed is None:
+        return f"/static/{name}"
+    return URL_PREFIX + hashed
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings an Accept-Encoding header allows (q=0 refuses one)"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            weight = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weight = 1.0
+        if weight > 0:
+            accepted.add(coding.strip())
+    return accepted
+
+
+def lookup(hashed, accept_encoding=""):
+    """(body, content encoding or None, mimetype, etag) of a hashed asset, or None"""
+    with _lock:
+        asset = _files.get(hashed)
+    if asset is None:
+        return None
+
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ("br", "gzip"):
+        if asset[encoding] is not None and encoding in accepted:
+            return asset[encoding], encoding, asset["mimetype"], f"{asset['etag']}-{encoding}"
+    return asset["body"], None, asset["mimetype"], asset["etag"]
+
+
+if __name__ == "__main__":
+    # Install-time build: python -m modules.assets
+    for source, hashed in sorted(build().items()):
+        print(f"{source} -> static/build/{hashed}")
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from modules import config
+from modules import metrics
+
+# Per-device command coalescing for single-device commands (POST /device).
+#
+# The first command for a quiet device is applied at once and opens a window
+# of config.COMMAND_COALESCE_MS. Commands for that device arriving while the
+# window is open are merged, last write wins, and applied once when it closes
+# (which opens the next window). Every caller waits for the write that carries
+# its command and gets the device's resulting state back. A double-click or a
+# chattering automation therefore costs at most two relay writes per window
+# instead of one per request; state_store's write-behind already collapses
+# the matching SQLite updates.
+
+COMMANDS = metrics.counter(
+    "dewhome_commands",
+    "Single-device commands by outcome (applied, redundant, coalesced)",
+    ["result"],
+)
+
+_lock = threading.Lock()
+_windows = {}  # device id -> time.monotonic() at which its window closes
+_batches = {}  # device id -> _Batch waiting for the window to close
+_stats = {"commands": 0, "applied": 0, "redundant": 0, "coalesced": 0}
+
+
+class _Batch:
+    """Commands for one device waiting for its window to close"""
+
+    def __init__(self, action):
+        self.action = action
+        self.size = 1
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _apply(device_id, action, apply, size):
+    changed = apply(device_id, action)
+    outcome = "applied" if changed else "redundant"
+    with _lock:
+        _stats[outcome] += 1
+        _stats["coalesced"] += size - 1
+    COMMANDS.inc(outcome)
+    if size > 1:
+        COMMANDS.inc("coalesced", amount=size - 1)
+    return {"state": action, "changed": changed, "coalesced": size - 1}
+
+
+def submit(device_id, action, apply):
+    """Run a command through the device's coalescing window
+
+    apply(device_id, action) writes the device and returns False if the
+    command was redundant (the device was already in that state). Returns
+    {"state", "changed", "coalesced"} for the write that carried the command;
+    state may come from a later command merged into the same write.
+    """
+    window = config.COMMAND_COALESCE_MS / 1000.0
+    with _lock:
+        _stats["commands"] += 1
+        now = time.monotonic()
+        batch = _batches.get(device_id)
+        if batch is not None:
+            batch.action = action  # Last write wins
+            batch.size += 1
+            flusher = False
+        elif _windows.get(device_id, 0) > now:
+            batch = _batches[device_id] = _Batch(action)
+            flusher = True  # This caller writes the batch when the window closes
+        else:
+            _windows[device_id] = now + window
+
+    if batch is None:
+        return _apply(device_id, action, apply, 1)
+
+    if not flusher:
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    with _lock:
+        closes = _windows.get(device_id, 0)
+    delay = closes - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+    with _lock:
+        _batches.pop(device_id, None)
+        _windows[device_id] = time.monotonic() + window
+        action, size = batch.action, batch.size
+    try:
+        batch.result = _apply(device_id, action, apply, size)
+    except Exception as e:
+        batch.error = e
+    batch.done.set()
+    if batch.error is not None:
+        raise batch.error
+    return batch.result
+
+
+def forget(device_id):
+    """Drop a deleted device's window"""
+    with _lock:
+        _windows.pop(device_id, None)
+
+
+def stats():
+    """Command counts: received, applied, redundant (dropped) and coalesced"""
+    with _lock:
+        return dict(_stats)
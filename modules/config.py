@@ -0,0 +1,177 @@
+import os
+import socket
+
+# Runtime settings, read once from the environment at import time.
+# Every setting has a default that matches a stock single-hub install.
+
+
+def _env_float(name, default):
+    """Read a float setting, falling back to the default when unset or invalid"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"Warning: {name} must be a number, using {default}")
+        return float(default)
+
+
+def _env_int(name, default):
+    """Read an integer setting, falling back to the default when unset or invalid"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"Warning: {name} must be an integer, using {default}")
+        return int(default)
+
+
+def _env_bool(name, default):
+    """Read a boolean setting ("1", "true", "yes", "on" are true)"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+DB_PATH = os.environ.get(
+    "DEWHOME_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device_states.db"),
+)
+
+# Maximum time (seconds) a device state change may live only in memory before
+# it is written to SQLite. This is the most that can be lost on a crash or
+# power cut. 0 writes every change through synchronously.
+STATE_MAX_LOSS_SECONDS = max(0.0, _env_float("DEWHOME_STATE_MAX_LOSS_SECONDS", 2.0))
+
+# Server-sent event streams (GET /events). Each open stream holds one gunicorn
+# thread, so the subscriber limit must stay below the worker's thread count.
+EVENTS_MAX_SUBSCRIBERS = _env_int("DEWHOME_EVENTS_MAX_SUBSCRIBERS", 48)
+EVENTS_QUEUE_SIZE = _env_int("DEWHOME_EVENTS_QUEUE_SIZE", 64)
+EVENTS_KEEPALIVE_SECONDS = _env_float("DEWHOME_EVENTS_KEEPALIVE_SECONDS", 15.0)
+
+# GPIO driver: "rpi" (RPi.GPIO), "lgpio" or "simulated" (no hardware needed)
+GPIO_BACKEND = os.environ.get("DEWHOME_GPIO_BACKEND", "rpi")
+
+# Simulated backend only: added latency per write, random failure probability
+# (0-1) and a comma-separated list of BCM pins whose writes always fail
+SIM_WRITE_LATENCY_MS = _env_float("DEWHOME_SIM_WRITE_LATENCY_MS", 0.0)
+SIM_FAILURE_RATE = _env_float("DEWHOME_SIM_FAILURE_RATE", 0.0)
+SIM_FAIL_PINS = [
+    int(pin) for pin in os.environ.get("DEWHOME_SIM_FAIL_PINS", "").split(",") if pin.strip()
+]
+
+# Unix socket of the GPIO daemon (gpio_daemon.py). When set, web workers do not
+# touch the pins or the database themselves but send every device operation to
+# the daemon, so gunicorn can run several workers.
+GPIO_SOCKET = os.environ.get("DEWHOME_GPIO_SOCKET", "")
+GPIO_CLIENT_POOL_SIZE = _env_int("DEWHOME_GPIO_CLIENT_POOL_SIZE", 8)
+GPIO_CLIENT_TIMEOUT = _env_float("DEWHOME_GPIO_CLIENT_TIMEOUT", 5.0)
+
+# ASGI serving mode (asgi.py). Blocking device and database calls run on a
+# bounded thread pool; requests beyond the concurrency limit wait for a slot,
+# and event streams do not count against it.
+ASGI_EXECUTOR_THREADS = max(1, _env_int("DEWHOME_ASGI_EXECUTOR_THREADS", 8))
+ASGI_MAX_CONCURRENCY = max(1, _env_int("DEWHOME_ASGI_MAX_CONCURRENCY", 64))
+
+# Device history (modules/history.py): raw state transitions are kept this many
+# days, and compacted into hourly/daily on-time rollups (kept indefinitely)
+# every HISTORY_COMPACT_SECONDS.
+HISTORY_RETENTION_DAYS = max(1, _env_int("DEWHOME_HISTORY_RETENTION_DAYS", 30))
+HISTORY_COMPACT_SECONDS = max(10.0, _env_float("DEWHOME_HISTORY_COMPACT_SECONDS", 300.0))
+
+# Scheduled actions missed while the hub was down are run once at startup if
+# they are at most this many seconds late; older ones are skipped.
+SCHEDULER_MISFIRE_GRACE_SECONDS = max(
+    0.0, _env_float("DEWHOME_SCHEDULER_MISFIRE_GRACE_SECONDS", 3600.0)
+)
+
+# Stage timings and counters served on GET /metrics (Prometheus text format).
+# Disabling it reduces instrumentation to a no-op call per stage.
+METRICS_ENABLED = _env_bool("DEWHOME_METRICS", True)
+
+# Dimmable devices (modules/pwm.py). Hardware PWM uses the kernel PWM chip
+# below; software PWM runs at a lower frequency to limit its CPU cost.
+# DIMMER_FADE_MS is the fade used when a dimmer is switched on or off.
+PWM_CHIP = os.environ.get("DEWHOME_PWM_CHIP", "/sys/class/pwm/pwmchip0")
+PWM_FREQUENCY = max(1, _env_int("DEWHOME_PWM_FREQUENCY", 1000))
+SOFT_PWM_FREQUENCY = max(1, _env_int("DEWHOME_SOFT_PWM_FREQUENCY", 100))
+DIMMER_FADE_MS = max(0, _env_int("DEWHOME_DIMMER_FADE_MS", 300))
+
+# Input devices (modules/inputs.py). With the default pull-up, wire the
+# switch or sensor between the pin and ground: a low pin reads as active
+# ("high" state). With "down" or "off" a high pin is active. A change is
+# reported once the pin has been stable for INPUT_DEBOUNCE_MS; at most
+# INPUT_QUEUE_SIZE edges wait for the dispatcher before inputs are re-read.
+INPUT_PULL = os.environ.get("DEWHOME_INPUT_PULL", "up").strip().lower()
+if INPUT_PULL not in ("up", "down", "off"):
+    print("Warning: DEWHOME_INPUT_PULL must be up, down or off, using up")
+    INPUT_PULL = "up"
+INPUT_DEBOUNCE_MS = max(0, _env_int("DEWHOME_INPUT_DEBOUNCE_MS", 50))
+INPUT_QUEUE_SIZE = max(1, _env_int("DEWHOME_INPUT_QUEUE_SIZE", 1024))
+
+# Commands for one device arriving within this many milliseconds of its last
+# write are merged (last write wins) into a single write at the end of the
+# window (modules/coalescer.py). 0 applies every command as it arrives.
+COMMAND_COALESCE_MS = max(0, _env_int("DEWHOME_COMMAND_COALESCE_MS", 50))
+
+# Federation (modules/federation.py): other DEWHOME hubs shown on this one's
+# dashboard, as "name=http://host:port" pairs separated by commas. A peer
+# that does not answer within PEER_TIMEOUT_SECONDS is shown from its last
+# known state. PEER_POOL_SIZE keep-alive connections are kept per peer.
+HUB_NAME = os.environ.get("DEWHOME_HUB_NAME", socket.gethostname())
+PEERS = os.environ.get("DEWHOME_PEERS", "")
+PEER_TIMEOUT_SECONDS = max(0.05, _env_float("DEWHOME_PEER_TIMEOUT_SECONDS", 1.0))
+PEER_POOL_SIZE = max(1, _env_int("DEWHOME_PEER_POOL_SIZE", 4))
+
+# MQTT bridge (modules/mqtt_bridge.py, needs paho-mqtt). Off unless MQTT_HOST
+# is set. Topics live under MQTT_PREFIX. State changes published within
+# MQTT_BATCH_MS of the previous batch wait and go out together, latest value
+# per topic. A lost broker is retried with a backoff of up to
+# MQTT_RECONNECT_MAX_SECONDS.
+MQTT_HOST = os.environ.get("DEWHOME_MQTT_HOST", "")
+MQTT_PORT = _env_int("DEWHOME_MQTT_PORT", 1883)
+MQTT_USERNAME = os.environ.get("DEWHOME_MQTT_USERNAME", "")
+MQTT_PASSWORD = os.environ.get("DEWHOME_MQTT_PASSWORD", "")
+MQTT_CLIENT_ID = os.environ.get("DEWHOME_MQTT_CLIENT_ID", f"dewhome-{HUB_NAME}")
+MQTT_PREFIX = os.environ.get("DEWHOME_MQTT_PREFIX", f"dewhome/{HUB_NAME}").strip("/")
+MQTT_QOS = min(2, max(0, _env_int("DEWHOME_MQTT_QOS", 1)))
+MQTT_BATCH_MS = max(0, _env_int("DEWHOME_MQTT_BATCH_MS", 20))
+MQTT_RECONNECT_MAX_SECONDS = max(1, _env_int("DEWHOME_MQTT_RECONNECT_MAX_SECONDS", 60))
+
+# Pin snapshot (modules/snapshot.py): the level of every relay output,
+# rewritten through an mmap'd file on each change so restore_pins.py can
+# put the relays back within milliseconds of power-up, before the app loads.
+# An empty path disables it. SNAPSHOT_SYNC msyncs every write; without it a
+# power cut may lose the last changes, as with the SQLite write-behind.
+SNAPSHOT_PATH = os.environ.get(
+    "DEWHOME_SNAPSHOT_PATH", os.path.splitext(DB_PATH)[0] + ".pins"
+)
+SNAPSHOT_SYNC = _env_bool("DEWHOME_SNAPSHOT_SYNC", True)
+
+# Admission control for the HTTP API (modules/admission.py). Every client
+# (an API token from API_TOKENS, "name=token" pairs, or else its address)
+# has a token bucket for writes and one for reads: RATE_*_PER_SECOND
+# requests per second with bursts of RATE_*_BURST; 0 turns a limit off.
+# At most MAX_IN_FLIGHT requests are handled at once, the last
+# INTERACTIVE_RESERVED of them only for interactive clients (the dashboard,
+# or clients named in INTERACTIVE_CLIENTS). Over a limit, requests are
+# turned away with 429 or 503 at once instead of queueing. The dashboard is
+# recognised by a cookie holding the key in DASHBOARD_KEY_PATH. The
+# in-flight cap is for the whole hub: each of WEB_WORKERS web workers
+# (gunicorn's --workers) takes its share. Rate limits apply per worker.
+API_TOKENS = os.environ.get("DEWHOME_API_TOKENS", "")
+WEB_WORKERS = max(1, _env_int("DEWHOME_WEB_WORKERS", 1))
+INTERACTIVE_CLIENTS = os.environ.get("DEWHOME_INTERACTIVE_CLIENTS", "")
+RATE_WRITE_PER_SECOND = max(0.0, _env_float("DEWHOME_RATE_WRITE_PER_SECOND", 10.0))
+RATE_WRITE_BURST = max(1, _env_int("DEWHOME_RATE_WRITE_BURST", 20))
+RATE_READ_PER_SECOND = max(0.0, _env_float("DEWHOME_RATE_READ_PER_SECOND", 20.0))
+RATE_READ_BURST = max(1, _env_int("DEWHOME_RATE_READ_BURST", 40))
+RATE_MAX_CLIENTS = max(1, _env_int("DEWHOME_RATE_MAX_CLIENTS", 1024))
+MAX_IN_FLIGHT = max(0, _env_int("DEWHOME_MAX_IN_FLIGHT", 16))
+INTERACTIVE_RESERVED = max(0, _env_int("DEWHOME_INTERACTIVE_RESERVED", 4))
+DASHBOARD_KEY_PATH = os.environ.get(
+    "DEWHOME_DASHBOARD_KEY_PATH", os.path.splitext(DB_PATH)[0] + ".key"
+)
+
+# Automation rules (modules/rules.py). A rule's action can trigger further
+# rules; a chain of more than RULES_MAX_DEPTH rules set off by one change is
+# cut there, so rules that trigger each other cannot loop forever.
+RULES_MAX_DEPTH = max(1, _env_int("DEWHOME_RULES_MAX_DEPTH", 8))
@@ -0,0 +1,270 @@
+import os
+import threading
+
+from modules import coalescer
+from modules import db_operations
+from modules import db_pool
+from modules import gpio_control
+from modules import groups
+from modules import history
+from modules import inputs
+from modules import metrics
+from modules import mqtt_bridge
+from modules import pin_catalog
+from modules import rules
+from modules import scheduler
+from modules import state_store
+
+# The device controller: the single owner of the GPIO pins and of the
+# in-memory device state.
+#
+# In a single-process install app.py uses this module directly. When
+# DEWHOME_GPIO_SOCKET is set, gpio_daemon.py runs it instead and every web
+# worker talks to the daemon through modules.gpio_client, which exposes the
+# same functions.
+
+# Pin writes and the state updates that record them happen under this lock,
+# so concurrent commands are applied (and recorded) in the same order.
+_write_lock = threading.RLock()
+
+# Tags this process's state versions, which restart from zero with it. The
+# web workers take it from here, so they all give a state the same ETag.
+BOOT_TAG = os.urandom(4).hex()
+
+
+def start():
+    """Bring up the database, device states and pins in a single pass
+
+    The schema is only touched when its version is out of date, devices are
+    read once, and every pin is configured once, directly at its stored level.
+    """
+    db_operations.init_db()  # No-op when the schema is current
+
+    devices = db_operations.get_all_devices()
+    if not devices:
+        db_operations.create_default_device()
+        devices = db_operations.get_all_devices()
+
+    pin_catalog.load_used(device["pin_number"] for device in devices)
+    state_store.load(devices)
+    # Relay changes the write-behind had not saved before a power cut
+    restored = gpio_control.snapshot_states(state_store.get_device_states())
+    if restored:
+        state_store.set_states(restored)
+        print(f"Took {len(restored)} device state(s) from the pin snapshot")
+    groups.load()
+    # Input changes become state changes, published and persisted like any other
+    inputs.start(state_store.set_state, gpio_control.read_inputs)
+    gpio_control.reconcile(state_store.get_device_states())
+
+    state_store.start()  # Persist state changes in the background
+    history.start()  # Roll the transition log up into on-time totals
+    scheduler.start(control_devices)  # Run timed actions, catching up first
+    rules.start(control_devices, state_store.get_states)  # Automation rules
+    # Take commands from MQTT and publish states there, if a broker is configured
+    mqtt_bridge.start(control_device, set_brightness, get_all_devices)
+
+
+def stop():
+    """Persist pending state and release the hardware"""
+    mqtt_bridge.stop()
+    rules.stop()
+    scheduler.stop()
+    inputs.stop()
+    history.stop()
+    state_store.stop()
+    gpio_control.cleanup()
+    db_pool.close_all()
+
+
+def watch_events():
+    """Make sure device changes reach modules.events (always true in-process)"""
+
+
+def version():
+    """(boot tag, state version); changes with any device, state or group change"""
+    return BOOT_TAG, state_store.version() + groups.version()
+
+
+def get_all_devices():
+    """All devices, served from memory"""
+    return state_store.get_all_devices()
+
+
+def get_device(device_id):
+    """A single device, or None"""
+    return state_store.get_device(device_id)
+
+
+def get_available_pins():
+    """All header pins with their usage"""
+    return db_operations.get_available_pins()
+
+
+def get_usable_pins():
+    """Free pins that can drive devices"""
+    return db_operations.get_usable_pins()
+
+
+def get_device_history(device_id, start=None, end=None, resolution="hour"):
+    """On-time totals of a device per hour or day (see history.get_device_history)"""
+    return history.get_device_history(device_id, start, end, resolution)
+
+
+def _switch(device_id, action):
+    """Write one device unless it is already in that state; returns whether it was"""
+    with _write_lock:
+        device = state_store.get_device(device_id)
+        if device is not None and device["state"] == action and device["kind"] != "input":
+            return False  # Redundant: no relay write, no database write
+        gpio_control.control_device(device_id, action)
+        state_store.set_state(device_id, action)
+    return True
+
+
+def control_device(device_id, action):
+    """Switch a device and record its new state
+
+    Commands for the same device are coalesced (see modules/coalescer.py).
+    Returns {"state", "changed", "coalesced"} for the write that carried it.
+    """
+    return coalescer.submit(device_id, action, _switch)
+
+
+def control_devices(actions):
+    """Switch several devices in one GPIO pass and one state update
+
+    actions maps device id -> action. Returns device id -> error message for
+    every device that could not be switched.
+    """
+    with _write_lock:
+        errors = gpio_control.control_devices(actions)
+        state_store.set_states(
+            {
+                device_id: action
+                for device_id, action in actions.items()
+                if device_id not in errors
+            }
+        )
+    return errors
+
+
+def set_brightness(device_id, brightness, fade_ms=None):
+    """Fade a dimmer to a brightness (0-100, 0 is off) and record it"""
+    with _write_lock:
+        gpio_control.set_brightness(device_id, brightness, fade_ms)
+        state_store.set_brightness(device_id, brightness)
+
+
+def add_device(name, icon, pin_number, kind="switch"):
+    """Create a device and configure its pin; returns the new device id"""
+    device_id = db_operations.add_device(name, icon, pin_number, kind)
+
+    # Configure only the new device's pin; running devices are untouched
+    try:
+        gpio_control.add_device_pin(device_id, pin_number, kind=kind)
+    except Exception:
+        db_operations.remove_device(device_id)  # Don't keep a dead device
+        raise
+
+    state_store.load_device(device_id)
+    if kind == "input":
+        inputs.resync()  # Its first level may have been read before it was loaded
+    return device_id
+
+
+def remove_device(device_id):
+    """Delete a device and release its pin"""
+    db_operations.remove_device(device_id)
+    state_store.remove_device(device_id)
+    scheduler.remove_device_schedules(device_id)
+    rules.remove_device_rules(device_id)
+    groups.remove_device(device_id)
+    coalescer.forget(device_id)
+
+    # Switch off and release only the deleted device's pin
+    gpio_control.remove_device_pin(device_id)
+
+
+def get_groups():
+    """All groups with their derived state (on, off, mixed or empty)"""
+    return groups.get_groups()
+
+
+def add_group(name, icon="fa-layer-group", device_ids=()):
+    """Create a group of devices; returns it"""
+    return groups.add_group(name, icon, device_ids)
+
+
+def update_group(group_id, name=None, icon=None, device_ids=None):
+    """Rename a group and/or replace its members; returns it"""
+    return groups.update_group(group_id, name, icon, device_ids)
+
+
+def remove_group(group_id):
+    """Delete a group; its devices are untouched"""
+    groups.remove_group(group_id)
+
+
+def control_group(group_id, action):
+    """Switch every device in a group in one GPIO pass and one state update
+
+    Returns the group (with its new state) and a list of
+    {"device_id", "error"} for members that could not be switched.
+    """
+    if action not in ["high", "low"]:
+        raise ValueError("Invalid action")
+
+    errors = control_devices({device_id: action for device_id in groups.members(group_id)})
+    return {
+        "group": groups.get_group(group_id),
+        "errors": [
+            {"device_id": device_id, "error": error}
+            for device_id, error in sorted(errors.items())
+        ],
+    }
+
+
+def get_schedules(device_id=None):
+    """Timed actions ordered by next run, optionally for one device"""
+    return scheduler.get_schedules(device_id)
+
+
+def add_schedule(device_id, action, at, every=None):
+    """Switch a device at a time, optionally repeating every N seconds"""
+    if state_store.get_device(device_id) is None:
+        raise ValueError(f"Device {device_id} not found")
+    return scheduler.add_schedule(device_id, action, at, every)
+
+
+def remove_schedule(schedule_id):
+    """Delete a timed action"""
+    scheduler.remove_schedule(schedule_id)
+
+
+def get_rules():
+    """Automation rules, ordered by id"""
+    return rules.get_rules()
+
+
+def add_rule(trigger, device_id, action, delay=0, name=""):
+    """When trigger happens, switch a device after delay seconds; returns the rule"""
+    devices = [device_id]
+    if isinstance(trigger, dict) and trigger.get("at") is None:
+        devices.append(rules.parse_trigger(trigger)[0])
+    for checked_id in devices:
+        if state_store.get_device(checked_id) is None:
+            raise ValueError(f"Device {checked_id} not found")
+    if state_store.get_device(device_id)["kind"] == "input":
+        raise ValueError(f"Device {device_id} is an input and cannot be switched")
+    return rules.add_rule(trigger, device_id, action, delay, name)
+
+
+def remove_rule(rule_id):
+    """Delete an automation rule"""
+    rules.remove_rule(rule_id)
+
+
+def get_metrics():
+    """This process's metrics (see metrics.collect)"""
+    return metrics.collect()
@@ -1,423 +1,283 @@
 import sqlite3
-import os
-from datetime import datetime
-
-DB_PATH = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), "..", "device_states.db"
-)
-
-# GPIO Pin definitions with categories
-GPIO_PINS = {
-    1: {
-        "type": "3.3V",
-        "category": "power",
-        "capabilities": ["power"],
-        "description": "3.3V Power",
-    },
-    2: {
-        "type": "5V",
-        "category": "power",
-        "capabilities": ["power"],
-        "description": "5V Power",
-    },
-    3: {
-        "type": "GPIO2",
-        "category": "i2c",
-        "capabilities": ["input", "output", "i2c"],
-        "description": "GPIO2 (SDA1)",
-    },
-    4: {
-        "type": "5V",
-        "category": "power",
-        "capabilities": ["power"],
-        "description": "5V Power",
-    },
-    5: {
-        "type": "GPIO3",
-        "category": "i2c",
-        "capabilities": ["input", "output", "i2c"],
-        "description": "GPIO3 (SCL1)",
-    },
-    6: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    7: {
-        "type": "GPIO4",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO4",
-    },
-    8: {
-        "type": "GPIO14",
-        "category": "uart",
-        "capabilities": ["input", "output", "uart"],
-        "description": "GPIO14 (TXD0)",
-    },
-    9: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    10: {
-        "type": "GPIO15",
-        "category": "uart",
-        "capabilities": ["input", "output", "uart"],
-        "description": "GPIO15 (RXD0)",
-    },
-    11: {
-        "type": "GPIO17",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO17",
-    },
-    12: {
-        "type": "GPIO18",
-        "category": "gpio",
-        "capabilities": ["input", "output", "pwm"],
-        "description": "GPIO18 (PWM0)",
-    },
-    13: {
-        "type": "GPIO27",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO27",
-    },
-    14: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    15: {
-        "type": "GPIO22",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO22",
-    },
-    16: {
-        "type": "GPIO23",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO23",
-    },
-    17: {
-        "type": "3.3V",
-        "category": "power",
-        "capabilities": ["power"],
-        "description": "3.3V Power",
-    },
-    18: {
-        "type": "GPIO24",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO24",
-    },
-    19: {
-        "type": "GPIO10",
-        "category": "spi",
-        "capabilities": ["input", "output", "spi"],
-        "description": "GPIO10 (MOSI)",
-    },
-    20: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    21: {
-        "type": "GPIO9",
-        "category": "spi",
-        "capabilities": ["input", "output", "spi"],
-        "description": "GPIO9 (MISO)",
-    },
-    22: {
-        "type": "GPIO25",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO25",
-    },
-    23: {
-        "type": "GPIO11",
-        "category": "spi",
-        "capabilities": ["input", "output", "spi"],
-        "description": "GPIO11 (SCLK)",
-    },
-    24: {
-        "type": "GPIO8",
-        "category": "spi",
-        "capabilities": ["input", "output", "spi"],
-        "description": "GPIO8 (CE0)",
-    },
-    25: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    26: {
-        "type": "GPIO7",
-        "category": "spi",
-        "capabilities": ["input", "output", "spi"],
-        "description": "GPIO7 (CE1)",
-    },
-    27: {
-        "type": "ID_SD",
-        "category": "special",
-        "capabilities": ["i2c"],
-        "description": "ID_SD (EEPROM)",
-    },
-    28: {
-        "type": "ID_SC",
-        "category": "special",
-        "capabilities": ["i2c"],
-        "description": "ID_SC (EEPROM)",
-    },
-    29: {
-        "type": "GPIO5",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO5",
-    },
-    30: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    31: {
-        "type": "GPIO6",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO6",
-    },
-    32: {
-        "type": "GPIO12",
-        "category": "gpio",
-        "capabilities": ["input", "output", "pwm"],
-        "description": "GPIO12 (PWM0)",
-    },
-    33: {
-        "type": "GPIO13",
-        "category": "gpio",
-        "capabilities": ["input", "output", "pwm"],
-        "description": "GPIO13 (PWM1)",
-    },
-    34: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    35: {
-        "type": "GPIO19",
-        "category": "gpio",
-        "capabilities": ["input", "output", "pwm"],
-        "description": "GPIO19 (PWM1)",
-    },
-    36: {
-        "type": "GPIO16",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO16",
-    },
-    37: {
-        "type": "GPIO26",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO26",
-    },
-    38: {
-        "type": "GPIO20",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO20",
-    },
-    39: {
-        "type": "GND",
-        "category": "ground",
-        "capabilities": ["ground"],
-        "description": "Ground",
-    },
-    40: {
-        "type": "GPIO21",
-        "category": "gpio",
-        "capabilities": ["input", "output"],
-        "description": "GPIO21",
-    },
-}
+import time
 
+from modules import metrics
+from modules import pin_catalog
+from modules.db_pool import get_connection
+from modules.pin_catalog import GPIO_PINS
 
-def init_db():
-    """Initialize the database with required tables"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
 
-        # Create GPIO pins table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS gpio_pins (
-                pin_number INTEGER PRIMARY KEY,
-                type TEXT NOT NULL,
-                category TEXT NOT NULL,
-                capabilities TEXT NOT NULL,
-                description TEXT NOT NULL,
-                is_used BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+# Bump SCHEMA_VERSION whenever the schema or the seeded pin rows change, and
+# add the upgrade step to MIGRATIONS. Databases created before versioning
+# report version 0; step 1 only uses IF NOT EXISTS / OR IGNORE, so it is safe
+# to run over them.
+SCHEMA_VERSION = 4
+
+
+def _create_tables(cursor):
+    """Version 1: all tables and the GPIO pin rows"""
+    # Create GPIO pins table
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS gpio_pins (
+            pin_number INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            capabilities TEXT NOT NULL,
+            description TEXT NOT NULL,
+            is_used BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
+    """
+    )
 
-        # Create devices table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS devices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                icon TEXT NOT NULL DEFAULT 'fa-plug',
-                pin_number INTEGER NOT NULL,
-                state TEXT NOT NULL DEFAULT 'low',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (pin_number) REFERENCES gpio_pins (pin_number)
-            )
+    # Create devices table
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS devices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            icon TEXT NOT NULL DEFAULT 'fa-plug',
+            pin_number INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'low',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (pin_number) REFERENCES gpio_pins (pin_number)
         )
+    """
+    )
 
-        # Insert GPIO pins data
-        for pin_number, pin_data in GPIO_PINS.items():
-            cursor.execute(
-                """
-                INSERT OR IGNORE INTO gpio_pins 
-                (pin_number, type, category, capabilities, description) 
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (
-                    pin_number,
-                    pin_data["type"],
-                    pin_data["category"],
-                    ",".join(pin_data["capabilities"]),
-                    pin_data["description"],
-                ),
+    # Append-only log of device state transitions (unix timestamps),
+    # compacted into per-device on-time rollups by modules.history
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS device_events (
+            id INTEGER PRIMARY KEY,
+            device_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_device_events_device_ts
+        ON device_events (device_id, ts)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_device_events_ts ON device_events (ts)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS device_rollups (
+            device_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            on_seconds REAL NOT NULL,
+            transitions INTEGER NOT NULL,
+            PRIMARY KEY (device_id, period, bucket)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_state (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+    """
+    )
+
+    # Timed device actions (modules.scheduler); every is the repeat
+    # interval in seconds, NULL for one-shot actions
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            next_run REAL NOT NULL,
+            every INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+
+    # Insert GPIO pins data
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO gpio_pins 
+        (pin_number, type, category, capabilities, description) 
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        [
+            (
+                pin_number,
+                pin_data["type"],
+                pin_data["category"],
+                ",".join(pin_data["capabilities"]),
+                pin_data["description"],
             )
+            for pin_number, pin_data in GPIO_PINS.items()
+        ],
+    )
 
-        conn.commit()
 
-    except sqlite3.Error as e:
-        print(f"An error occurred while initializing the database: {e}")
-    finally:
-        if conn:
-            conn.close()
+def _add_dimmer_columns(cursor):
+    """Version 2: device kind (switch / dimmer / soft_dimmer) and brightness"""
+    cursor.execute(
+        "ALTER TABLE devices ADD COLUMN kind TEXT NOT NULL DEFAULT 'switch'"
+    )
+    cursor.execute(
+        "ALTER TABLE devices ADD COLUMN brightness INTEGER NOT NULL DEFAULT 100"
+    )
 
 
-def get_available_pins():
-    """Get all available GPIO pins with their information"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _create_group_tables(cursor):
+    """Version 3: device groups (rooms) and their many-to-many membership"""
     cursor.execute(
         """
-        SELECT pin_number, type, category, capabilities, description, is_used 
-        FROM gpio_pins 
-        ORDER BY pin_number
+        CREATE TABLE IF NOT EXISTS device_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            icon TEXT NOT NULL DEFAULT 'fa-layer-group',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
     """
     )
-    pins = cursor.fetchall()
-    conn.close()
-
-    return [
-        {
-            "pin_number": pin[0],
-            "type": pin[1],
-            "category": pin[2],
-            "capabilities": pin[3].split(","),
-            "description": pin[4],
-            "is_used": bool(pin[5]),
-        }
-        for pin in pins
-    ]
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER NOT NULL,
+            device_id INTEGER NOT NULL,
+            PRIMARY KEY (group_id, device_id),
+            FOREIGN KEY (group_id) REFERENCES device_groups (id),
+            FOREIGN KEY (device_id) REFERENCES devices (id)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_group_members_device ON group_members (device_id)"
+    )
 
 
-def get_usable_pins():
-    """Get pins that can be used for devices"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _create_rules_table(cursor):
+    """Version 4: automation rules (modules.rules)
+
+    A rule has either a device trigger (trigger_device_id reaching
+    trigger_state) or a daily time trigger (trigger_at, "HH:MM" local time).
+    """
     cursor.execute(
         """
-        SELECT pin_number, type, category, capabilities, description 
-        FROM gpio_pins 
-        WHERE (category = 'gpio' OR category = 'spi' OR category = 'uart' OR category = 'i2c') 
-        AND is_used = FALSE
-        AND capabilities LIKE '%output%'
-        ORDER BY 
-            CASE category 
-                WHEN 'gpio' THEN 1 
-                WHEN 'spi' THEN 2 
-                WHEN 'uart' THEN 3 
-                WHEN 'i2c' THEN 4 
-            END, pin_number
+        CREATE TABLE IF NOT EXISTS rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL DEFAULT '',
+            trigger_device_id INTEGER,
+            trigger_state TEXT,
+            trigger_at TEXT,
+            device_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            delay INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
     """
     )
-    pins = cursor.fetchall()
-    conn.close()
-
-    return [
-        {
-            "pin_number": pin[0],
-            "type": pin[1],
-            "category": pin[2],
-            "capabilities": pin[3].split(","),
-            "description": pin[4],
-        }
-        for pin in pins
-    ]
 
 
-def add_device(name, icon, pin_number):
-    """Add a new device"""
+MIGRATIONS = {
+    1: _create_tables,
+    2: _add_dimmer_columns,
+    3: _create_group_tables,
+    4: _create_rules_table,
+}
+
+
+def schema_version():
+    """Schema version recorded in the database, 0 if it predates versioning"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        row = get_connection().execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # No schema_version table yet
+    return row[0] if row else 0
 
-        # Check if pin is available
-        cursor.execute(
-            "SELECT is_used FROM gpio_pins WHERE pin_number = ?", (pin_number,)
-        )
-        pin_status = cursor.fetchone()
 
-        if not pin_status:
-            raise ValueError(f"Pin {pin_number} does not exist")
+def init_db():
+    """Create or upgrade the database schema; does nothing if it is current"""
+    try:
+        current = schema_version()
+        if current >= SCHEMA_VERSION:
+            return
 
-        if pin_status[0]:
-            raise ValueError(f"Pin {pin_number} is already in use")
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                MIGRATIONS[version](cursor)
 
-        # Insert device
-        cursor.execute(
-            """
-            INSERT INTO devices (name, icon, pin_number, state) 
-            VALUES (?, ?, ?, 'low')
-        """,
-            (name, icon, pin_number),
-        )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+            )
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute(
+                "INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,)
+            )
+        print(f"Database schema upgraded from version {current} to {SCHEMA_VERSION}")
 
-        # Mark pin as used
-        cursor.execute(
-            """
-            UPDATE gpio_pins SET is_used = TRUE WHERE pin_number = ?
-        """,
-            (pin_number,),
-        )
+    except sqlite3.Error as e:
+        print(f"An error occurred while initializing the database: {e}")
+
+
+def load_used_pins():
+    """Sync the in-memory pin catalog with the pins assigned to devices"""
+    cursor = get_connection().execute("SELECT pin_number FROM devices")
+    pin_catalog.load_used(row[0] for row in cursor.fetchall())
+
+
+def get_available_pins():
+    """Get all available GPIO pins with their information"""
+    return pin_catalog.available_pins()
 
-        device_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+
+def get_usable_pins():
+    """Get pins that can be used for devices"""
+    return pin_catalog.usable_pins()
+
+
+def add_device(name, icon, pin_number, kind="switch"):
+    """Add a new device"""
+    # Validates the pin and claims it in memory; raises ValueError
+    pin_catalog.reserve(pin_number, kind)
+
+    try:
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+
+            # Insert device
+            cursor.execute(
+                """
+                INSERT INTO devices (name, icon, pin_number, state, kind) 
+                VALUES (?, ?, ?, 'low', ?)
+            """,
+                (name, icon, pin_number, kind),
+            )
+            device_id = cursor.lastrowid
+
+            # Mark pin as used
+            cursor.execute(
+                """
+                UPDATE gpio_pins SET is_used = TRUE WHERE pin_number = ?
+            """,
+                (pin_number,),
+            )
 
         return device_id
 
     except sqlite3.Error as e:
+        pin_catalog.release(pin_number)
         print(f"Database error: {e}")
         raise
 
@@ -425,134 +285,162 @@ def add_device(name, icon, pin_number):
 def remove_device(device_id):
     """Remove a device and free its pin"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
 
-        # Get the pin number before deleting
-        cursor.execute("SELECT pin_number FROM devices WHERE id = ?", (device_id,))
-        result = cursor.fetchone()
+            # Get the pin number before deleting
+            cursor.execute("SELECT pin_number FROM devices WHERE id = ?", (device_id,))
+            result = cursor.fetchone()
 
-        if not result:
-            raise ValueError(f"Device {device_id} does not exist")
+            if not result:
+                raise ValueError(f"Device {device_id} does not exist")
 
-        pin_number = result[0]
+            pin_number = result[0]
 
-        # Delete device
-        cursor.execute("DELETE FROM devices WHERE id = ?", (device_id,))
+            # Delete device
+            cursor.execute("DELETE FROM devices WHERE id = ?", (device_id,))
 
-        # Mark pin as unused
-        cursor.execute(
-            """
-            UPDATE gpio_pins SET is_used = FALSE WHERE pin_number = ?
-        """,
-            (pin_number,),
-        )
+            # Mark pin as unused
+            cursor.execute(
+                """
+                UPDATE gpio_pins SET is_used = FALSE WHERE pin_number = ?
+            """,
+                (pin_number,),
+            )
 
-        conn.commit()
-        conn.close()
+        pin_catalog.release(pin_number)
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         raise
 
 
+DEVICE_QUERY = """
+    SELECT d.id, d.name, d.icon, d.pin_number, d.state, d.created_at,
+           p.type, p.category, p.description, d.kind, d.brightness
+    FROM devices d
+    JOIN gpio_pins p ON d.pin_number = p.pin_number
+"""
+
+
+def _device_from_row(device):
+    """Build a device dictionary from a DEVICE_QUERY row"""
+    return {
+        "id": device[0],
+        "name": device[1],
+        "icon": device[2],
+        "pin_number": device[3],
+        "state": device[4],
+        "created_at": device[5],
+        "pin_type": device[6],
+        "pin_category": device[7],
+        "pin_description": device[8],
+        "kind": device[9],
+        "brightness": device[10],
+    }
+
+
 def get_all_devices():
     """Get all devices with their pin information"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT d.id, d.name, d.icon, d.pin_number, d.state, d.created_at,
-               p.type, p.category, p.description
-        FROM devices d
-        JOIN gpio_pins p ON d.pin_number = p.pin_number
-        ORDER BY d.id
-    """
-    )
-    devices = cursor.fetchall()
-    conn.close()
-
-    return [
-        {
-            "id": device[0],
-            "name": device[1],
-            "icon": device[2],
-            "pin_number": device[3],
-            "state": device[4],
-            "created_at": device[5],
-            "pin_type": device[6],
-            "pin_category": device[7],
-            "pin_description": device[8],
-        }
-        for device in devices
-    ]
+    with metrics.stage("db_query"):
+        cursor = get_connection().execute(DEVICE_QUERY + " ORDER BY d.id")
+        devices = cursor.fetchall()
+
+    return [_device_from_row(device) for device in devices]
+
+
+def get_device(device_id):
+    """Get a single device with its pin information, or None"""
+    with metrics.stage("db_query"):
+        cursor = get_connection().execute(DEVICE_QUERY + " WHERE d.id = ?", (device_id,))
+        device = cursor.fetchone()
+
+    return _device_from_row(device) if device else None
 
 
 def get_device_states():
     """Get device states for GPIO control"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, pin_number, state FROM devices")
-    devices = cursor.fetchall()
-    conn.close()
-
-    return {device[0]: {"pin": device[1], "state": device[2]} for device in devices}
+    with metrics.stage("db_query"):
+        cursor = get_connection().execute(
+            "SELECT id, pin_number, state, kind, brightness FROM devices"
+        )
+        devices = cursor.fetchall()
+
+    return {
+        device[0]: {
+            "pin": device[1],
+            "state": device[2],
+            "kind": device[3],
+            "brightness": device[4],
+        }
+        for device in devices
+    }
 
 
 def update_device_state(device_id, state):
-    """Update device state"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        UPDATE devices 
-        SET state = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    """,
-        (state, device_id),
-    )
-    conn.commit()
-    conn.close()
-
+    """Update device state, logging the transition if it changed"""
+    conn = get_connection()
+    with metrics.stage("db_commit"), conn:
+        row = conn.execute(
+            "SELECT state FROM devices WHERE id = ?", (device_id,)
+        ).fetchone()
+        conn.execute(
+            """
+            UPDATE devices 
+            SET state = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        """,
+            (state, device_id),
+        )
+        if row and row[0] != state:
+            conn.execute(
+                "INSERT INTO device_events (device_id, state, ts) VALUES (?, ?, ?)",
+                (device_id, state, time.time()),
+            )
 
-def create_default_device():
-    """Create a default device if no devices exist"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    # Check if any devices exist
-    cursor.execute("SELECT COUNT(*) FROM devices")
-    device_count = cursor.fetchone()[0]
+def update_device_states(updates, transitions=()):
+    """Update many device states in a single transaction
 
-    if device_count == 0:
-        # Find first available GPIO pin
-        cursor.execute(
+    updates is an iterable of (device_id, state, brightness, updated_at)
+    tuples; a brightness of None leaves it unchanged and an updated_at of None
+    stamps the row with the current time. transitions is an
+    iterable of (device_id, state, unix_ts) tuples appended to device_events in
+    the same transaction.
+    """
+    conn = get_connection()
+    with metrics.stage("db_commit"), conn:
+        conn.executemany(
             """
-            SELECT pin_number FROM gpio_pins 
-            WHERE category = 'gpio' AND is_used = FALSE 
-            ORDER BY pin_number LIMIT 1
-        """
+            UPDATE devices 
+            SET state = ?, brightness = COALESCE(?, brightness),
+                updated_at = COALESCE(?, CURRENT_TIMESTAMP) 
+            WHERE id = ?
+        """,
+            [
+                (state, brightness, updated_at, device_id)
+                for device_id, state, brightness, updated_at in updates
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO device_events (device_id, state, ts) VALUES (?, ?, ?)",
+            transitions,
         )
-        available_pin = cursor.fetchone()
-
-        if available_pin:
-            pin_number = available_pin[0]
-            cursor.execute(
-                """
-                INSERT INTO devices (name, icon, pin_number, state) 
-                VALUES (?, ?, ?, 'low')
-            """,
-                ("Default Device", "fa-plug", pin_number),
-            )
 
-            cursor.execute(
-                """
-                UPDATE gpio_pins SET is_used = TRUE WHERE pin_number = ?
-            """,
-                (pin_number,),
-            )
 
-            conn.commit()
+def create_default_device():
+    """Create a default device if no devices exist"""
+    conn = get_connection()
+    device_count = conn.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+    if device_count:
+        return
+
+    # Find first available GPIO pin
+    for pin_number in pin_catalog.PINS_BY_CATEGORY["gpio"]:
+        if not pin_catalog.is_used(pin_number) and pin_catalog.has_capability(
+            pin_number, "output"
+        ):
+            add_device("Default Device", "fa-plug", pin_number)
             print(f"Created default device on pin {pin_number}")
-
-    conn.close()
+            return
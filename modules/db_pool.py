@@ -0,0 +1,114 @@
+import atexit
+import os
+import sqlite3
+import threading
+
+from modules import metrics
+from modules.config import DB_PATH
+
+# Pragmas applied once to every new connection.
+# WAL lets readers run alongside the writer and replaces the rollback journal's
+# fsync-per-commit with sequential appends; synchronous=NORMAL only syncs the WAL
+# at checkpoints, which is durable across application crashes (a power cut can
+# lose the last few commits but never corrupts the database).
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-2048",  # 2 MiB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Size of sqlite3's per-connection prepared statement cache. Every query in
+# db_operations is a constant string, so they are compiled once per connection.
+STATEMENT_CACHE_SIZE = 64
+
+_local = threading.local()
+_connections = {}  # thread ident -> connection, used for pruning and shutdown
+_inherited = []  # connections from a parent process, kept alive but never used
+_lock = threading.Lock()
+_owner_pid = os.getpid()
+
+
+def _open_connection():
+    """Open a new SQLite connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=5.0,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _reset_after_fork():
+    """Drop connections inherited from a parent process"""
+    global _local, _owner_pid
+
+    # SQLite connections must not be shared across fork(); park (but do not
+    # close) whatever the parent opened and start over in this process.
+    _inherited.extend(_connections.values())
+    _local = threading.local()
+    _connections.clear()
+    _owner_pid = os.getpid()
+
+
+def _prune_dead_threads():
+    """Close connections owned by threads that have exited"""
+    alive = {thread.ident for thread in threading.enumerate()}
+    for ident in list(_connections):
+        if ident not in alive:
+            conn = _connections.pop(ident)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+def get_connection():
+    """Return the calling thread's persistent database connection"""
+    if os.getpid() != _owner_pid:
+        with _lock:
+            if os.getpid() != _owner_pid:
+                _reset_after_fork()
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _open_connection()
+        with _lock:
+            _prune_dead_threads()
+            _connections[threading.get_ident()] = conn
+        _local.conn = conn
+    return conn
+
+
+def connection_count():
+    """Number of connections currently held open by this process"""
+    with _lock:
+        return len(_connections)
+
+
+metrics.gauge(
+    "dewhome_db_connections",
+    "SQLite connections held open by this process",
+    connection_count,
+)
+
+
+def close_all():
+    """Close every pooled connection; registered as a shutdown hook"""
+    global _local
+
+    with _lock:
+        for conn in _connections.values():
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+        _local = threading.local()
+
+
+atexit.register(close_all)
@@ -0,0 +1,137 @@
+import itertools
+import json
+import queue
+import threading
+
+from modules import config
+from modules import metrics
+
+# Device change fan-out: one publisher, many subscribers.
+#
+# Every state change goes through publish(). Each subscriber (an open
+# GET /events stream) owns a bounded queue. A client that stops reading is
+# never allowed to block the publisher: when its queue is full the backlog is
+# dropped and replaced by a single "resync" event, telling the client to
+# re-fetch /devices instead of replaying diffs it missed.
+
+_lock = threading.Lock()
+_subscribers = set()
+_listeners = []  # in-process callbacks, called synchronously on publish
+_sequence = itertools.count(1)
+_publish_lock = threading.Lock()  # keeps event ids and delivery order in step
+
+
+class Subscriber:
+    """A single event stream consumer with its own bounded queue"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def deliver(self, event):
+        """Queue an event without ever blocking the publisher"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            # Throw away the backlog and ask the client to resynchronise
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(
+                {"id": event["id"], "type": "resync", "data": {}}
+            )
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class TooManySubscribers(Exception):
+    """Raised when the subscriber limit has been reached"""
+
+
+def subscribe():
+    """Register a new subscriber"""
+    subscriber = Subscriber(config.EVENTS_QUEUE_SIZE)
+    with _lock:
+        if len(_subscribers) >= config.EVENTS_MAX_SUBSCRIBERS:
+            raise TooManySubscribers(
+                f"Too many event subscribers (limit {config.EVENTS_MAX_SUBSCRIBERS})"
+            )
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    """Remove a subscriber"""
+    with _lock:
+        _subscribers.discard(subscriber)
+
+
+def subscriber_count():
+    """Number of connected event streams"""
+    with _lock:
+        return len(_subscribers)
+
+
+def add_listener(callback):
+    """Call callback(event) for every published event
+
+    Listeners run synchronously in the publishing thread, so they must be quick
+    and must not block (hand anything slow to a queue or worker thread).
+    """
+    with _lock:
+        _listeners.append(callback)
+
+
+def publish(event_type, data):
+    """Send an event to every subscriber and listener"""
+    with _lock:
+        subscribers = list(_subscribers)
+        listeners = list(_listeners)
+
+    with _publish_lock:
+        event = {"id": next(_sequence), "type": event_type, "data": data}
+        for subscriber in subscribers:
+            subscriber.deliver(event)
+
+    for callback in listeners:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Error in event listener {callback!r}: {e}")
+
+
+def format_sse(event):
+    """Encode an event in text/event-stream wire format"""
+    return (
+        f"id: {event['id']}\n"
+        f"event: {event['type']}\n"
+        f"data: {json.dumps(event['data'], separators=(',', ':'))}\n\n"
+    )
+
+
+def stream(subscriber):
+    """Yield a subscriber's events as SSE text, with keep-alive comments"""
+    try:
+        # Ask browsers to wait a few seconds before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            event = subscriber.get(config.EVENTS_KEEPALIVE_SECONDS)
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(event)
+    finally:
+        unsubscribe(subscriber)
+
+
+metrics.gauge(
+    "dewhome_event_subscribers", "Open /events streams", subscriber_count
+)
@@ -0,0 +1,258 @@
+import concurrent.futures
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+
+from modules import config
+from modules import metrics
+
+# Federation: one dashboard for several DEWHOME hubs.
+#
+# Each hub lists its peers in DEWHOME_PEERS. GET /federation/devices asks
+# every peer for GET /devices concurrently and merges the answers with the
+# local devices, tagging each device with its hub. Peers are reached over
+# small pools of keep-alive connections and asked with If-None-Match, so an
+# unchanged peer costs one 304 on an already open socket.
+#
+# A peer that has not answered within config.PEER_TIMEOUT_SECONDS is shown
+# from its last known device list and marked stale. Its request carries on
+# in the background and refreshes the cache when it completes; at most one
+# request per peer is in flight, so a hung peer cannot pile up threads.
+#
+# Commands for a remote device (POST /federation/device) are forwarded to the
+# owning hub's POST /device.
+
+# How a pooled connection the peer has closed fails before any reply arrives
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+PEER_SECONDS = metrics.histogram(
+    "dewhome_peer_request_seconds",
+    "Requests to peer hubs",
+    ["peer"],
+)
+PEER_ERRORS = metrics.counter(
+    "dewhome_peer_errors",
+    "Failed requests to peer hubs",
+    ["peer"],
+)
+
+
+class Peer:
+    """A remote hub with a pool of keep-alive connections and a cached device list"""
+
+    def __init__(self, name, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Invalid peer URL '{url}'")
+
+        self.name = name
+        self.url = url.rstrip("/")
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self._idle = queue.LifoQueue(maxsize=config.PEER_POOL_SIZE)
+
+        self._lock = threading.Lock()
+        self.devices = None  # Last device list received, or None
+        self.etag = None
+        self.updated = None  # time.time() of the last successful fetch
+        self.error = None  # Error of the last fetch, None if it succeeded
+        self._pending = None  # Future of the fetch in flight
+
+    def _connection(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            factory = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            return factory(self.host, self.port, timeout=config.PEER_TIMEOUT_SECONDS)
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, ETag, body bytes) of a request to the peer
+
+        A pooled connection the peer has closed in the meantime is replaced
+        and the request sent once more. A timeout is never retried: the peer
+        may have acted on the request, and a retry would double the wait.
+        """
+        start = time.perf_counter()
+        try:
+            for attempt in range(2):
+                conn = self._connection()
+                reused = conn.sock is not None
+                try:
+                    conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    if reused and attempt == 0 and isinstance(e, STALE_CONNECTION_ERRORS):
+                        continue
+                    raise
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._release(conn)
+                return response.status, response.getheader("ETag"), data
+        except Exception:
+            PEER_ERRORS.inc(self.name)
+            raise
+        finally:
+            PEER_SECONDS.observe(time.perf_counter() - start, self.name)
+
+    def fetch(self):
+        """Refresh the cached device list"""
+        headers = {"If-None-Match": self.etag} if self.etag and self.devices is not None else {}
+        try:
+            status, etag, body = self.request("GET", "/devices", headers=headers)
+            if status == 200:
+                devices = json.loads(body)
+            elif status != 304:
+                raise OSError(f"HTTP {status}")
+        except Exception as e:
+            with self._lock:
+                self.error = str(e) or type(e).__name__
+            return
+
+        with self._lock:
+            if status == 200:
+                self.devices = devices
+                self.etag = etag
+            self.updated = time.time()
+            self.error = None
+
+    def refresh(self):
+        """Future of a fetch, reusing the one in flight if there is one"""
+        with self._lock:
+            if self._pending is None or self._pending.done():
+                self._pending = _executor().submit(self.fetch)
+            return self._pending
+
+    def snapshot(self):
+        """(devices, updated, error) as last seen"""
+        with self._lock:
+            return self.devices, self.updated, self.error
+
+
+def parse_peers(spec):
+    """Peers from "name=url,name=url" (a bare URL is named after its host:port)"""
+    peers = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, separator, url = entry.partition("=")
+        if not separator or "://" in name:
+            name, url = "", entry
+        name = name.strip() or urllib.parse.urlsplit(url.strip()).netloc
+        url = url.strip()
+        if name == config.HUB_NAME:
+            raise ValueError(f"Peer '{name}' has the same name as this hub")
+        peers[name] = Peer(name, url)
+    return peers
+
+
+PEERS = {}
+try:
+    PEERS = parse_peers(config.PEERS)
+except ValueError as e:
+    print(f"Warning: ignoring DEWHOME_PEERS: {e}")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(2, len(PEERS) * 2),
+                    thread_name_prefix="dewhome-peer",
+                )
+    return _pool
+
+
+def enabled():
+    """Whether any peer hubs are configured"""
+    return bool(PEERS)
+
+
+def _tag(devices, hub):
+    return [dict(device, hub=hub, uid=f"{hub}:{device['id']}") for device in devices]
+
+
+def get_devices(local_devices):
+    """Devices of this hub and every peer, and the status of each hub
+
+    Waits at most PEER_TIMEOUT_SECONDS for the peers as a whole; peers that
+    have not answered by then are served from their last known state.
+    """
+    futures = {name: peer.refresh() for name, peer in PEERS.items()}
+    if futures:
+        concurrent.futures.wait(futures.values(), timeout=config.PEER_TIMEOUT_SECONDS)
+
+    now = time.time()
+    hubs = [{"name": config.HUB_NAME, "status": "local"}]
+    devices = _tag(local_devices, config.HUB_NAME)
+    for name, peer in PEERS.items():
+        peer_devices, updated, error = peer.snapshot()
+        if futures[name].done() and error is None:
+            status = "ok"
+        elif peer_devices is not None:
+            status = "stale"
+        else:
+            status = "unreachable"
+
+        hub = {"name": name, "url": peer.url, "status": status}
+        if updated is not None:
+            hub["age_seconds"] = round(now - updated, 3)
+        if error is not None:
+            hub["error"] = error
+        hubs.append(hub)
+        devices.extend(_tag(peer_devices or [], name))
+
+    return {"hubs": hubs, "devices": devices}
+
+
+def send_command(hub, device_id, action):
+    """Forward a device command to the hub that owns the device
+
+    Returns (payload, status) as answered by the peer.
+    """
+    peer = PEERS.get(hub)
+    if peer is None:
+        raise ValueError(f"Unknown hub '{hub}'")
+
+    body = json.dumps({"device_id": device_id, "action": action})
+    try:
+        status, _, data = peer.request(
+            "POST", "/device", body=body, headers={"Content-Type": "application/json"}
+        )
+    except TimeoutError:
+        return {"error": f"Hub '{hub}' did not answer in time"}, 504
+    except (OSError, http.client.HTTPException) as e:
+        return {"error": f"Hub '{hub}' is unreachable: {e}"}, 502
+
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return {"error": f"Hub '{hub}' sent an invalid response"}, 502
+    if status < 400:
+        peer.refresh()  # Pick up the new state without waiting for the next view
+    return payload, status
@@ -0,0 +1,483 @@
+import collections
+import random
+import threading
+import time
+
+from modules import config
+from modules import pwm
+
+# Hardware access layer.
+#
+# gpio_control talks to a backend object instead of importing RPi.GPIO
+# directly, so the whole control path can run (and be profiled) off a Pi.
+# Pins are always BCM numbers and levels are the integers LOW/HIGH.
+# The backend is picked with DEWHOME_GPIO_BACKEND:
+#
+#   rpi        RPi.GPIO (default)
+#   lgpio      lgpio, via the /dev/gpiochip character device
+#   simulated  in-memory simulator with optional latency and fault injection
+#
+# PWM outputs (dimmers) take a duty cycle in percent. Hardware PWM goes
+# through the kernel's PWM chip on every backend (see modules/pwm.py);
+# software PWM uses the driver's own implementation where it has one.
+#
+# Inputs use the driver's edge detection: the callback passed to
+# setup_input() runs on the driver's thread for every level change, so no
+# polling loop is needed. Debouncing is left to modules/inputs.py, which
+# (unlike RPi.GPIO's bouncetime) never drops the edge that settles the level.
+
+LOW = 0
+HIGH = 1
+
+
+class GPIOBackendError(Exception):
+    """Raised when a pin cannot be driven"""
+
+
+class GPIOBackend:
+    """Interface every backend implements"""
+
+    name = "base"
+
+    def __init__(self):
+        self.pwm_outputs = {}  # pin -> object with set_duty(percent) and stop()
+
+    def setup_output(self, pin, level):
+        """Configure a pin as an output, starting at level"""
+        raise NotImplementedError
+
+    def write(self, pin, level):
+        """Drive one output pin"""
+        raise NotImplementedError
+
+    def write_many(self, levels):
+        """Drive several output pins; levels maps pin -> level"""
+        for pin, level in levels.items():
+            self.write(pin, level)
+
+    def read(self, pin):
+        """Current level of a pin"""
+        raise NotImplementedError
+
+    def setup_input(self, pin, pull, callback):
+        """Configure a pin as an input and call callback(pin, level) on every edge
+
+        pull is "up", "down" or "off". The callback runs on the driver's own
+        thread and must return quickly. Returns the current level.
+        """
+        raise NotImplementedError
+
+    def remove_input(self, pin):
+        """Stop watching an input pin"""
+        raise NotImplementedError
+
+    def setup_pwm(self, pin, frequency, duty, hardware=False):
+        """Start a PWM output at duty percent (0-100)
+
+        hardware selects the SoC PWM peripheral; otherwise the duty cycle is
+        generated in software.
+        """
+        if pin in self.pwm_outputs:
+            self.stop_pwm(pin)
+        if hardware:
+            channel = pwm.hardware_channel(pin)
+            if channel is None:
+                raise GPIOBackendError(f"BCM GPIO {pin} has no hardware PWM channel")
+            output = self._hardware_pwm(pin, channel, frequency, duty)
+        else:
+            output = self._software_pwm(pin, frequency, duty)
+        self.pwm_outputs[pin] = output
+
+    def set_duty(self, pin, duty):
+        """Change the duty cycle (percent) of a PWM output"""
+        self.pwm_outputs[pin].set_duty(duty)
+
+    def stop_pwm(self, pin):
+        """Stop a PWM output"""
+        output = self.pwm_outputs.pop(pin, None)
+        if output is not None:
+            output.stop()
+
+    def _hardware_pwm(self, pin, channel, frequency, duty):
+        try:
+            return pwm.SysfsPWM(channel, frequency, duty)
+        except OSError as e:
+            raise GPIOBackendError(str(e))
+
+    def _software_pwm(self, pin, frequency, duty):
+        self.setup_output(pin, LOW)
+        return pwm.SoftwarePWM(lambda level: self.write(pin, level), frequency, duty)
+
+    def _stop_all_pwm(self):
+        for pin in list(self.pwm_outputs):
+            self.stop_pwm(pin)
+
+    def cleanup(self):
+        """Release every pin"""
+
+
+class _RPiSoftwarePWM:
+    """RPi.GPIO's software PWM (a C thread per pin)"""
+
+    def __init__(self, GPIO, pin, frequency, duty):
+        GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+        self.output = GPIO.PWM(pin, frequency)
+        self.output.start(duty)
+
+    def set_duty(self, duty):
+        self.output.ChangeDutyCycle(duty)
+
+    def stop(self):
+        self.output.stop()
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """RPi.GPIO, the classic /dev/gpiomem driver"""
+
+    name = "rpi"
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+
+        super().__init__()
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup_output(self, pin, level):
+        self.GPIO.setup(pin, self.GPIO.OUT, initial=level)
+
+    def write(self, pin, level):
+        self.GPIO.output(pin, level)
+
+    def write_many(self, levels):
+        # RPi.GPIO accepts a list of channels sharing one level
+        by_level = {}
+        for pin, level in levels.items():
+            by_level.setdefault(level, []).append(pin)
+        for level, pins in by_level.items():
+            self.GPIO.output(pins, level)
+
+    def read(self, pin):
+        return self.GPIO.input(pin)
+
+    def setup_input(self, pin, pull, callback):
+        GPIO = self.GPIO
+        pulls = {"up": GPIO.PUD_UP, "down": GPIO.PUD_DOWN, "off": GPIO.PUD_OFF}
+        GPIO.setup(pin, GPIO.IN, pull_up_down=pulls[pull])
+        GPIO.add_event_detect(
+            pin, GPIO.BOTH, callback=lambda channel: callback(channel, GPIO.input(channel))
+        )
+        return GPIO.input(pin)
+
+    def remove_input(self, pin):
+        self.GPIO.remove_event_detect(pin)
+        self.GPIO.cleanup(pin)
+
+    def _software_pwm(self, pin, frequency, duty):
+        return _RPiSoftwarePWM(self.GPIO, pin, frequency, duty)
+
+    def cleanup(self):
+        self._stop_all_pwm()
+        self.GPIO.cleanup()
+
+
+class LgpioBackend(GPIOBackend):
+    """lgpio on the GPIO character device (also works on the Pi 5)"""
+
+    name = "lgpio"
+
+    def __init__(self, chip=0):
+        import lgpio
+
+        super().__init__()
+        self.lgpio = lgpio
+        self.handle = lgpio.gpiochip_open(chip)
+        self.claimed = set()
+        self.alerts = {}  # pin -> lgpio callback of an input pin
+        # Output pins claimed together, so write_many() is one group_write
+        # per group; lgpio addresses a group by its first pin. Groups are
+        # only ever formed from single outputs, never by freeing a live one.
+        self.groups = {}  # first pin -> pins of the group
+        self.group_of = {}  # pin -> first pin of its group
+        self.outputs = set()  # Pins claimed as plain outputs, which may be grouped
+
+    def _claim_singly(self, levels):
+        for pin, level in levels.items():
+            self.lgpio.gpio_claim_output(self.handle, pin, level)
+
+    def _free(self, pin):
+        """Release a pin, handing the rest of its group back as single outputs"""
+        first = self.group_of.get(pin)
+        if first is not None:
+            pins = self.groups.pop(first)
+            others = {p: self.lgpio.gpio_read(self.handle, p) for p in pins if p != pin}
+            self.lgpio.group_free(self.handle, first)
+            for p in pins:
+                del self.group_of[p]
+            self._claim_singly(others)
+        elif pin in self.claimed:
+            self.lgpio.gpio_free(self.handle, pin)
+        self.claimed.discard(pin)
+        self.outputs.discard(pin)
+
+    def _group(self, levels):
+        """Claim single outputs as one group, driving them to levels"""
+        pins = sorted(levels)
+        for pin in pins:
+            self.lgpio.gpio_free(self.handle, pin)
+        try:
+            self.lgpio.group_claim_output(self.handle, pins, [levels[p] for p in pins])
+        except self.lgpio.error as e:
+            # Drive them one at a time, as before, and stop trying to group them
+            print(f"Warning: could not claim BCM GPIO {pins} as a group: {e}")
+            self._claim_singly(levels)
+            self.outputs.difference_update(pins)
+            return
+        self.groups[pins[0]] = tuple(pins)
+        for pin in pins:
+            self.group_of[pin] = pins[0]
+
+    def setup_output(self, pin, level):
+        self._free(pin)
+        self.lgpio.gpio_claim_output(self.handle, pin, level)
+        self.claimed.add(pin)
+        self.outputs.add(pin)
+
+    def write(self, pin, level):
+        first = self.group_of.get(pin)
+        if first is None:
+            self.lgpio.gpio_write(self.handle, pin, level)
+        else:
+            bit = 1 << self.groups[first].index(pin)
+            self.lgpio.group_write(self.handle, first, bit if level else 0, bit)
+
+    def write_many(self, levels):
+        if len(levels) < 2 or not self.outputs.issuperset(levels):
+            return super().write_many(levels)
+        single = {pin: level for pin, level in levels.items() if pin not in self.group_of}
+        if len(single) > 1:
+            # Claiming them as a group also drives them to these levels
+            self._group(single)
+        else:
+            single = {}
+        writes = {}  # first pin of a group -> [bits, mask]
+        for pin, level in levels.items():
+            if pin in single:
+                continue
+            first = self.group_of.get(pin)
+            if first is None:
+                self.lgpio.gpio_write(self.handle, pin, level)
+                continue
+            bit = 1 << self.groups[first].index(pin)
+            write = writes.setdefault(first, [0, 0])
+            write[1] |= bit
+            if level:
+                write[0] |= bit
+        for first, (bits, mask) in writes.items():
+            self.lgpio.group_write(self.handle, first, bits, mask)
+
+    def read(self, pin):
+        return self.lgpio.gpio_read(self.handle, pin)
+
+    def setup_input(self, pin, pull, callback):
+        lgpio = self.lgpio
+        flags = {
+            "up": lgpio.SET_PULL_UP,
+            "down": lgpio.SET_PULL_DOWN,
+            "off": lgpio.SET_PULL_NONE,
+        }[pull]
+        self._free(pin)
+        lgpio.gpio_claim_alert(self.handle, pin, lgpio.BOTH_EDGES, flags)
+        self.claimed.add(pin)
+
+        def alert(chip, gpio, level, tick):
+            if level in (LOW, HIGH):  # 2 is a watchdog timeout, not an edge
+                callback(gpio, level)
+
+        self.alerts[pin] = lgpio.callback(self.handle, pin, lgpio.BOTH_EDGES, alert)
+        return lgpio.gpio_read(self.handle, pin)
+
+    def remove_input(self, pin):
+        alert = self.alerts.pop(pin, None)
+        if alert is not None:
+            alert.cancel()
+        self._free(pin)
+
+    def _software_pwm(self, pin, frequency, duty):
+        self.setup_output(pin, LOW)
+        self.outputs.discard(pin)  # tx_pwm drives it on its own
+        return _LgpioSoftwarePWM(self.lgpio, self.handle, pin, frequency, duty)
+
+    def cleanup(self):
+        self._stop_all_pwm()
+        for alert in self.alerts.values():
+            alert.cancel()
+        self.alerts.clear()
+        for first in self.groups:
+            self.lgpio.group_free(self.handle, first)
+        for pin in self.claimed.difference(self.group_of):
+            self.lgpio.gpio_free(self.handle, pin)
+        self.groups.clear()
+        self.group_of.clear()
+        self.claimed.clear()
+        self.outputs.clear()
+        self.lgpio.gpiochip_close(self.handle)
+
+
+class _LgpioSoftwarePWM:
+    """lgpio's tx_pwm, timed by the library's own thread"""
+
+    def __init__(self, lgpio, handle, pin, frequency, duty):
+        self.lgpio = lgpio
+        self.handle = handle
+        self.pin = pin
+        self.frequency = frequency
+        self.set_duty(duty)
+
+    def set_duty(self, duty):
+        self.lgpio.tx_pwm(self.handle, self.pin, self.frequency, duty)
+
+    def stop(self):
+        self.lgpio.tx_pwm(self.handle, self.pin, 0, 0)
+
+
+class _SimulatedPWM:
+    """Stands in for a hardware PWM channel; records the duty cycle"""
+
+    def __init__(self, backend, pin, duty):
+        self.backend = backend
+        self.pin = pin
+        self.set_duty(duty)
+
+    def set_duty(self, duty):
+        with self.backend._lock:
+            self.backend.duties[self.pin] = duty
+
+    def stop(self):
+        with self.backend._lock:
+            self.backend.duties.pop(self.pin, None)
+
+
+class SimulatedBackend(GPIOBackend):
+    """In-memory GPIO for development, CI and load tests
+
+    Records every pin level and write (with timestamps), and can add a fixed
+    write latency or fail writes at random or on chosen pins.
+    """
+
+    name = "simulated"
+
+    def __init__(self, write_latency=0.0, failure_rate=0.0, fail_pins=(), history=1024):
+        super().__init__()
+        self.write_latency = write_latency
+        self.failure_rate = failure_rate
+        self.fail_pins = set(fail_pins)
+        self.levels = {}  # pin -> level
+        self.modes = {}  # pin -> "out", "in" or "pwm"
+        self.inputs = {}  # pin -> edge callback of an input pin
+        self.duties = {}  # pin -> duty cycle of simulated hardware PWM outputs
+        self.history = collections.deque(maxlen=history)  # (time, pin, level)
+        self.writes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _check(self, pin):
+        if pin in self.fail_pins or (
+            self.failure_rate and random.random() < self.failure_rate
+        ):
+            with self._lock:
+                self.failures += 1
+            raise GPIOBackendError(f"Simulated failure writing BCM GPIO {pin}")
+
+    def _record(self, levels):
+        now = time.perf_counter()
+        with self._lock:
+            for pin, level in levels.items():
+                self.levels[pin] = level
+                self.history.append((now, pin, level))
+            self.writes += 1
+
+    def setup_output(self, pin, level):
+        self._check(pin)
+        with self._lock:
+            self.modes[pin] = "out"
+        self._record({pin: level})
+
+    def write(self, pin, level):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        self._check(pin)
+        self._record({pin: level})
+
+    def write_many(self, levels):
+        # One simulated bus transaction for the whole set
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        for pin in levels:
+            self._check(pin)
+        self._record(levels)
+
+    def read(self, pin):
+        return self.levels.get(pin, LOW)
+
+    def setup_input(self, pin, pull, callback):
+        self._check(pin)
+        with self._lock:
+            self.modes[pin] = "in"
+            self.inputs[pin] = callback
+            # An unconnected input rests at its pull level
+            return self.levels.setdefault(pin, HIGH if pull == "up" else LOW)
+
+    def remove_input(self, pin):
+        with self._lock:
+            self.inputs.pop(pin, None)
+            self.modes.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """Drive a simulated input, firing its edge callback if the level changed"""
+        with self._lock:
+            changed = self.levels.get(pin) != level
+            self.levels[pin] = level
+            callback = self.inputs.get(pin)
+        if changed and callback is not None:
+            callback(pin, level)
+
+    def _hardware_pwm(self, pin, channel, frequency, duty):
+        self._check(pin)
+        with self._lock:
+            self.modes[pin] = "pwm"
+        return _SimulatedPWM(self, pin, duty)
+
+    def cleanup(self):
+        self._stop_all_pwm()
+        with self._lock:
+            self.levels.clear()
+            self.modes.clear()
+            self.inputs.clear()
+
+
+BACKENDS = {
+    "rpi": RPiGPIOBackend,
+    "lgpio": LgpioBackend,
+    "simulated": SimulatedBackend,
+}
+
+
+def create_backend(name=None):
+    """Instantiate a backend by name (default: DEWHOME_GPIO_BACKEND)"""
+    name = (name or config.GPIO_BACKEND).lower()
+    if name == "sim":
+        name = "simulated"
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown GPIO backend '{name}' (choose from {', '.join(BACKENDS)})"
+        )
+
+    if name == "simulated":
+        return SimulatedBackend(
+            write_latency=config.SIM_WRITE_LATENCY_MS / 1000.0,
+            failure_rate=config.SIM_FAILURE_RATE,
+            fail_pins=config.SIM_FAIL_PINS,
+        )
+    return BACKENDS[name]()
@@ -0,0 +1,339 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+from modules import config
+from modules import events
+
+# Client side of the GPIO daemon protocol.
+#
+# Exposes the same functions as modules.controller, but forwards each call to
+# gpio_daemon.py over a Unix socket. The protocol is one JSON object per line:
+#
+#   request   {"op": "control", "args": [3, "high"]}
+#   response  {"ok": true, "result": null}
+#             {"ok": false, "error": "Device 3 not found", "type": "ValueError"}
+#
+# Connections are pooled per process and reused across requests. The
+# "subscribe" op turns a connection into a stream of {"type", "data"} events,
+# which a relay thread republishes through modules.events.
+
+
+class GPIODaemonError(Exception):
+    """Raised when the daemon cannot be reached or reports a hardware error"""
+
+
+def send_message(stream, message):
+    """Write one protocol message"""
+    stream.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+    stream.flush()
+
+
+def read_message(stream):
+    """Read one protocol message; raises EOFError if the peer hung up"""
+    line = stream.readline()
+    if not line:
+        raise EOFError("GPIO daemon closed the connection")
+    return json.loads(line)
+
+
+class _Connection:
+    """A socket to the daemon plus its buffered stream"""
+
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile("rwb")
+
+    def send(self, message):
+        send_message(self.stream, message)
+
+    def receive(self):
+        return read_message(self.stream)
+
+    def call(self, message):
+        self.send(message)
+        return self.receive()
+
+    def close(self):
+        try:
+            self.stream.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# Operations that are safe to repeat if the reply was lost. Deletes are not:
+# a repeat of one that went through fails with "does not exist".
+IDEMPOTENT_OPS = {
+    "version",
+    "devices",
+    "device",
+    "pins",
+    "usable_pins",
+    "history",
+    "control",
+    "control_many",
+    "brightness",
+    "groups",
+    "update_group",
+    "control_group",
+    "schedules",
+    "rules",
+    "metrics",
+}
+
+_pool = queue.LifoQueue()
+_pool_pid = os.getpid()
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def _connect(retry_for=2.0):
+    """Open a connection, waiting briefly for a daemon that is still starting"""
+    deadline = time.monotonic() + retry_for
+    while True:
+        try:
+            return _Connection(config.GPIO_SOCKET, config.GPIO_CLIENT_TIMEOUT)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            if time.monotonic() >= deadline:
+                raise GPIODaemonError(
+                    f"GPIO daemon not reachable at {config.GPIO_SOCKET}: {e}"
+                )
+            time.sleep(0.1)
+
+
+def _acquire():
+    """A pooled connection, or a new one"""
+    global _pool, _pool_pid
+
+    if os.getpid() != _pool_pid:
+        # Never share sockets with a parent process
+        _pool = queue.LifoQueue()
+        _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _release(conn):
+    """Return a healthy connection to the pool"""
+    if _pool.qsize() < config.GPIO_CLIENT_POOL_SIZE:
+        _pool.put(conn)
+    else:
+        conn.close()
+
+
+def call(op, *args):
+    """Run an operation in the daemon and return its result"""
+    message = {"op": op, "args": list(args)}
+
+    # A pooled connection may have gone stale (daemon restarted). Requests that
+    # could not be sent are retried once on a fresh connection; requests whose
+    # reply was lost only if repeating them is harmless.
+    for attempt in range(2):
+        conn = _acquire()
+        try:
+            conn.send(message)
+        except OSError as e:
+            conn.close()
+            if attempt:
+                raise GPIODaemonError(f"GPIO daemon request failed: {e}")
+            continue
+
+        try:
+            response = conn.receive()
+        except (OSError, EOFError, ValueError) as e:
+            conn.close()
+            if attempt or op not in IDEMPOTENT_OPS:
+                raise GPIODaemonError(f"GPIO daemon request failed: {e}")
+            continue
+
+        _release(conn)
+        break
+
+    if response.get("ok"):
+        return response.get("result")
+    if response.get("type") == "ValueError":
+        raise ValueError(response.get("error"))
+    raise GPIODaemonError(response.get("error"))
+
+
+def start():
+    """Nothing to initialize; the daemon owns the hardware"""
+
+
+def stop():
+    """Close pooled connections"""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def _relay_events():
+    """Republish the daemon's event stream in this process, reconnecting on error"""
+    backoff = 0.5
+    resync = False
+    while True:
+        conn = None
+        try:
+            conn = _connect(retry_for=0)
+            conn.sock.settimeout(None)
+            response = conn.call({"op": "subscribe", "args": []})
+            if not response.get("ok"):
+                raise GPIODaemonError(response.get("error"))
+            backoff = 0.5
+            if resync:
+                # Changes may have been missed while disconnected
+                events.publish("resync", {})
+            while True:
+                event = read_message(conn.stream)
+                if event["type"] != "keepalive":
+                    events.publish(event["type"], event["data"])
+        except Exception as e:
+            print(f"GPIO daemon event stream lost: {e}")
+            resync = True
+        finally:
+            if conn is not None:
+                conn.close()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 5.0)
+
+
+def watch_events():
+    """Start relaying daemon events into modules.events (once per process)"""
+    global _relay
+
+    with _relay_lock:
+        if _relay is None or not _relay.is_alive():
+            _relay = threading.Thread(
+                target=_relay_events, name="dewhome-event-relay", daemon=True
+            )
+            _relay.start()
+
+
+def version():
+    """(boot tag, state version) of the daemon"""
+    return call("version")
+
+
+def get_all_devices():
+    """All devices"""
+    return call("devices")
+
+
+def get_device(device_id):
+    """A single device, or None"""
+    return call("device", device_id)
+
+
+def get_available_pins():
+    """All header pins with their usage"""
+    return call("pins")
+
+
+def get_usable_pins():
+    """Free pins that can drive devices"""
+    return call("usable_pins")
+
+
+def get_device_history(device_id, start=None, end=None, resolution="hour"):
+    """On-time totals of a device per hour or day"""
+    return call("history", device_id, start, end, resolution)
+
+
+def control_device(device_id, action):
+    """Switch a device; returns {"state", "changed", "coalesced"}"""
+    return call("control", device_id, action)
+
+
+def control_devices(actions):
+    """Switch several devices; returns device id -> error for failures"""
+    errors = call(
+        "control_many", [[device_id, action] for device_id, action in actions.items()]
+    )
+    return {device_id: error for device_id, error in errors}
+
+
+def set_brightness(device_id, brightness, fade_ms=None):
+    """Fade a dimmer to a brightness (0-100, 0 is off)"""
+    call("brightness", device_id, brightness, fade_ms)
+
+
+def add_device(name, icon, pin_number, kind="switch"):
+    """Create a device; returns its id"""
+    return call("add_device", name, icon, pin_number, kind)
+
+
+def remove_device(device_id):
+    """Delete a device"""
+    call("remove_device", device_id)
+
+
+def get_groups():
+    """All groups with their derived state"""
+    return call("groups")
+
+
+def add_group(name, icon="fa-layer-group", device_ids=()):
+    """Create a group of devices; returns it"""
+    return call("add_group", name, icon, list(device_ids))
+
+
+def update_group(group_id, name=None, icon=None, device_ids=None):
+    """Rename a group and/or replace its members; returns it"""
+    if device_ids is not None:
+        device_ids = list(device_ids)
+    return call("update_group", group_id, name, icon, device_ids)
+
+
+def remove_group(group_id):
+    """Delete a group"""
+    call("remove_group", group_id)
+
+
+def control_group(group_id, action):
+    """Switch every device in a group; returns the group and per-device errors"""
+    return call("control_group", group_id, action)
+
+
+def get_schedules(device_id=None):
+    """Timed actions ordered by next run, optionally for one device"""
+    return call("schedules", device_id)
+
+
+def add_schedule(device_id, action, at, every=None):
+    """Switch a device at a time, optionally repeating; returns the schedule"""
+    return call("add_schedule", device_id, action, at, every)
+
+
+def remove_schedule(schedule_id):
+    """Delete a timed action"""
+    call("remove_schedule", schedule_id)
+
+
+def get_rules():
+    """Automation rules, ordered by id"""
+    return call("rules")
+
+
+def add_rule(trigger, device_id, action, delay=0, name=""):
+    """When trigger happens, switch a device after delay seconds; returns the rule"""
+    return call("add_rule", trigger, device_id, action, delay, name)
+
+
+def remove_rule(rule_id):
+    """Delete an automation rule"""
+    call("remove_rule", rule_id)
+
+
+def get_metrics():
+    """The daemon's metrics (see metrics.collect)"""
+    return call("metrics")
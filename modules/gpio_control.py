@@ -1,42 +1,38 @@
-import RPi.GPIO as GPIO
+import threading
 
-# GPIO setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+from modules import config
+from modules import gpio_backend
+from modules import inputs
+from modules import metrics
+from modules import pin_catalog
+from modules import pwm
+from modules import snapshot
+from modules.gpio_backend import HIGH, LOW
 
 # Dynamic device pins - will be populated from database
 DEVICE_PINS = {}
 
-# Physical pin to BCM GPIO mapping
-PHYSICAL_TO_BCM = {
-    # Physical pin -> BCM GPIO number
-    3: 2,  # GPIO2 (SDA1)
-    5: 3,  # GPIO3 (SCL1)
-    7: 4,  # GPIO4
-    8: 14,  # GPIO14 (TXD0)
-    10: 15,  # GPIO15 (RXD0)
-    11: 17,  # GPIO17
-    12: 18,  # GPIO18 (PWM0)
-    13: 27,  # GPIO27
-    15: 22,  # GPIO22
-    16: 23,  # GPIO23
-    18: 24,  # GPIO24
-    19: 10,  # GPIO10 (MOSI)
-    21: 9,  # GPIO9 (MISO)
-    22: 25,  # GPIO25
-    23: 11,  # GPIO11 (SCLK)
-    24: 8,  # GPIO8 (CE0)
-    26: 7,  # GPIO7 (CE1)
-    29: 5,  # GPIO5
-    31: 6,  # GPIO6
-    32: 12,  # GPIO12 (PWM0)
-    33: 13,  # GPIO13 (PWM1)
-    35: 19,  # GPIO19 (PWM1)
-    36: 16,  # GPIO16
-    37: 26,  # GPIO26
-    38: 20,  # GPIO20
-    40: 21,  # GPIO21
-}
+# Dimmable devices: device id -> {"hardware": bool, "brightness": 1-100,
+# "on": bool}. Dimmers are driven active-high: duty cycle = brightness.
+DIMMERS = {}
+
+# Input devices (switches and sensors), read through edge detection
+INPUTS = set()
+
+# GPIO driver, created on first use (see modules/gpio_backend.py)
+_backend = None
+
+# Guards DEVICE_PINS and serializes pin reconfiguration
+_lock = threading.RLock()
+
+# Physical pin to BCM GPIO mapping (built by the pin catalog)
+PHYSICAL_TO_BCM = pin_catalog.PHYSICAL_TO_BCM
+
+RECONFIGURATIONS = metrics.counter(
+    "dewhome_gpio_reconfigurations",
+    "GPIO pins set up or released",
+    ["kind"],
+)
 
 
 def physical_to_bcm(physical_pin):
@@ -44,17 +40,131 @@ def physical_to_bcm(physical_pin):
     return PHYSICAL_TO_BCM.get(physical_pin)
 
 
-def setup_pins():
-    """Setup GPIO pins for all devices from database"""
-    from modules.db_operations import get_device_states
+def get_backend():
+    """The active GPIO backend"""
+    global _backend
+
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = gpio_backend.create_backend()
+                print(f"Using {_backend.name} GPIO backend")
+    return _backend
+
+
+def set_backend(backend):
+    """Use a specific backend instance (tools, benchmarks)"""
+    global _backend
+
+    with _lock:
+        _backend = backend
+
+
+def _output_level(action):
+    """GPIO level for an action (inverted logic for relay compatibility)"""
+    if action == "high":
+        return LOW  # Device ON
+    elif action == "low":
+        return HIGH  # Device OFF
+    else:
+        raise ValueError("Invalid action")
+
+
+def _output_state(level):
+    """Device state of a relay output level (inverse of _output_level)"""
+    return "high" if level == LOW else "low"
+
+
+def _input_state(level):
+    """Device state of an input level ("high" = active)"""
+    active = LOW if config.INPUT_PULL == "up" else HIGH
+    return "high" if level == active else "low"
 
-    global DEVICE_PINS
-    device_states = get_device_states()
 
-    # Clear existing pin mapping
-    DEVICE_PINS.clear()
+def _set_duty(bcm_pin, duty):
+    with metrics.stage("gpio_write"):
+        get_backend().set_duty(bcm_pin, duty)
 
-    # Setup pins for each device
+
+# Runs brightness fades on its own thread, keyed by BCM pin
+_fader = pwm.Fader(_set_duty)
+
+
+def _configure_pin(device_id, bcm_pin, state, kind="switch", brightness=100):
+    """Set up a newly assigned pin directly at the device's current level"""
+    if kind == "switch":
+        level = _output_level(state)
+        get_backend().setup_output(bcm_pin, level)
+        snapshot.record({bcm_pin: level})
+    elif kind == "input":
+        snapshot.record({bcm_pin: None})
+        inputs.watch(device_id, state)
+        level = get_backend().setup_input(
+            bcm_pin,
+            config.INPUT_PULL,
+            lambda pin, level: inputs.edge(device_id, _input_state(level)),
+        )
+        INPUTS.add(device_id)
+        inputs.edge(device_id, _input_state(level))  # Catch up with the stored state
+    else:
+        hardware = kind == "dimmer"
+        if hardware:
+            channel = pwm.hardware_channel(bcm_pin)
+            for other_id, dimmer in DIMMERS.items():
+                other_pin = DEVICE_PINS.get(other_id)
+                if (
+                    dimmer["hardware"]
+                    and other_id != device_id
+                    and pwm.hardware_channel(other_pin) == channel
+                ):
+                    raise ValueError(
+                        f"PWM channel {channel} is already used by device {other_id}"
+                    )
+
+        snapshot.record({bcm_pin: None})  # Left to the app to bring back
+        duty = brightness if state == "high" else 0
+        get_backend().setup_pwm(
+            bcm_pin,
+            config.PWM_FREQUENCY if hardware else config.SOFT_PWM_FREQUENCY,
+            duty,
+            hardware,
+        )
+        _fader.reset(bcm_pin, duty)
+        DIMMERS[device_id] = {
+            "hardware": hardware,
+            "brightness": brightness,
+            "on": state == "high",
+        }
+    DEVICE_PINS[device_id] = bcm_pin
+    RECONFIGURATIONS.inc("setup")
+
+
+def _release_pin(device_id):
+    """Switch a device's pin off and forget it"""
+    bcm_pin = DEVICE_PINS.pop(device_id)
+    if device_id in INPUTS:
+        INPUTS.discard(device_id)
+        inputs.forget(device_id)
+        get_backend().remove_input(bcm_pin)
+    elif DIMMERS.pop(device_id, None) is not None:
+        _fader.forget(bcm_pin)
+        get_backend().stop_pwm(bcm_pin)
+    else:
+        get_backend().write(bcm_pin, _output_level("low"))
+    snapshot.record({bcm_pin: None})  # Not to be restored at boot any more
+    RECONFIGURATIONS.inc("release")
+    return bcm_pin
+
+
+def reconcile(device_states):
+    """Bring the configured pins in line with the desired device states
+
+    device_states has the shape returned by db_operations.get_device_states.
+    Only pins that were added, removed or moved are touched; devices already
+    configured on the right pin keep their output level untouched.
+    Returns (added, removed) lists of device ids.
+    """
+    desired = {}
     for device_id, device_info in device_states.items():
         physical_pin = device_info["pin"]
         bcm_pin = physical_to_bcm(physical_pin)
@@ -63,60 +173,198 @@ def setup_pins():
             print(f"Warning: Physical pin {physical_pin} cannot be mapped to BCM GPIO")
             continue
 
-        DEVICE_PINS[device_id] = bcm_pin
-        GPIO.setup(bcm_pin, GPIO.OUT)
-        GPIO.output(bcm_pin, GPIO.HIGH)  # Default to OFF (inverted logic)
-        print(
-            f"Setup device {device_id}: Physical pin {physical_pin} -> BCM GPIO {bcm_pin}"
-        )
+        desired[device_id] = (bcm_pin, device_info)
+
+    with _lock:
+        removed = [
+            device_id
+            for device_id, bcm_pin in DEVICE_PINS.items()
+            if desired.get(device_id, (None,))[0] != bcm_pin
+        ]
+        for device_id in removed:
+            bcm_pin = _release_pin(device_id)
+            print(f"Released device {device_id} from BCM GPIO {bcm_pin}")
+
+        added = [device_id for device_id in desired if device_id not in DEVICE_PINS]
+        for device_id in added:
+            bcm_pin, device_info = desired[device_id]
+            state = device_info["state"]
+            try:
+                _configure_pin(
+                    device_id,
+                    bcm_pin,
+                    state,
+                    device_info.get("kind", "switch"),
+                    device_info.get("brightness", 100),
+                )
+                print(f"Setup device {device_id}: BCM GPIO {bcm_pin} ({state})")
+            except Exception as e:
+                print(f"Error setting up BCM GPIO {bcm_pin} for device {device_id}: {e}")
+
+    return added, removed
+
+
+def add_device_pin(device_id, physical_pin, state="low", kind="switch", brightness=100):
+    """Configure the pin of a newly added device without touching other pins"""
+    bcm_pin = physical_to_bcm(physical_pin)
+    if bcm_pin is None:
+        raise ValueError(f"Physical pin {physical_pin} cannot be mapped to BCM GPIO")
+
+    with _lock:
+        if DEVICE_PINS.get(device_id) == bcm_pin:
+            return
+        if device_id in DEVICE_PINS:
+            _release_pin(device_id)
+        _configure_pin(device_id, bcm_pin, state, kind, brightness)
+
+    print(f"Setup device {device_id}: Physical pin {physical_pin} -> BCM GPIO {bcm_pin}")
+
+
+def remove_device_pin(device_id):
+    """Switch off and release the pin of a deleted device"""
+    with _lock:
+        if device_id not in DEVICE_PINS:
+            return
+        bcm_pin = _release_pin(device_id)
+
+    print(f"Released device {device_id} from BCM GPIO {bcm_pin}")
+
+
+def setup_pins():
+    """Setup GPIO pins for all devices from database"""
+    from modules.db_operations import get_device_states
+
+    reconcile(get_device_states())
 
 
 def control_device(device_id, action):
     """Control a device by its ID"""
-    if device_id not in DEVICE_PINS:
-        # Try to refresh pin mapping in case new device was added
-        setup_pins()
+    bcm_pin = DEVICE_PINS.get(device_id)
+    if bcm_pin is None:
+        raise ValueError(f"Device {device_id} not found")
+
+    if device_id in INPUTS:
+        raise ValueError(f"Device {device_id} is an input and cannot be switched")
 
+    print(f"Controlling device {device_id} on BCM GPIO {bcm_pin}: {action}")
+
+    if device_id in DIMMERS:
+        _output_level(action)  # Validates the action
+        _switch_dimmer(device_id, action == "high")
+        return
+
+    level = _output_level(action)
+    with metrics.stage("gpio_write"):
+        get_backend().write(bcm_pin, level)
+    snapshot.record({bcm_pin: level})
+
+
+def _switch_dimmer(device_id, on, fade_ms=None):
+    """Fade a dimmer to its brightness or to off (call with the device configured)"""
+    dimmer = DIMMERS[device_id]
+    dimmer["on"] = on
+    fade_ms = config.DIMMER_FADE_MS if fade_ms is None else fade_ms
+    _fader.fade(
+        DEVICE_PINS[device_id], dimmer["brightness"] if on else 0, fade_ms / 1000.0
+    )
+
+
+def set_brightness(device_id, brightness, fade_ms=None):
+    """Set a dimmer's brightness (1-100), fading over fade_ms; 0 switches it off
+
+    Returns immediately; the fade runs on the fader thread.
+    """
+    with _lock:
         if device_id not in DEVICE_PINS:
             raise ValueError(f"Device {device_id} not found")
+        if device_id not in DIMMERS:
+            raise ValueError(f"Device {device_id} is not dimmable")
+        if brightness > 0:
+            DIMMERS[device_id]["brightness"] = brightness
+        _switch_dimmer(device_id, brightness > 0, fade_ms)
 
-    bcm_pin = DEVICE_PINS[device_id]
-    print(f"Controlling device {device_id} on BCM GPIO {bcm_pin}: {action}")
 
-    if action == "high":
-        GPIO.output(
-            bcm_pin, GPIO.LOW
-        )  # Device ON (inverted logic for relay compatibility)
-    elif action == "low":
-        GPIO.output(
-            bcm_pin, GPIO.HIGH
-        )  # Device OFF (inverted logic for relay compatibility)
-    else:
-        raise ValueError("Invalid action")
+def control_devices(actions):
+    """Control several devices in one pass
+
+    actions maps device id -> 'high' or 'low'. Returns a dict of
+    device id -> error message for the devices that could not be switched;
+    every other device has been written.
+    """
+    errors = {}
+    levels = {}
+    for device_id, action in actions.items():
+        bcm_pin = DEVICE_PINS.get(device_id)
+        if bcm_pin is None:
+            errors[device_id] = f"Device {device_id} not found"
+            continue
+        if device_id in DIMMERS or device_id in INPUTS:
+            try:
+                control_device(device_id, action)
+            except Exception as e:
+                errors[device_id] = str(e)
+            continue
+        levels[device_id] = (bcm_pin, _output_level(action))
+
+    backend = get_backend()
+    with metrics.stage("gpio_write"):
+        try:
+            # A single backend call for the whole batch
+            backend.write_many({bcm_pin: level for bcm_pin, level in levels.values()})
+        except Exception:
+            # Retry pin by pin so one bad pin does not fail the rest
+            for device_id, (bcm_pin, level) in levels.items():
+                try:
+                    backend.write(bcm_pin, level)
+                except Exception as e:
+                    errors[device_id] = str(e)
+    snapshot.record(
+        {bcm_pin: level for device_id, (bcm_pin, level) in levels.items() if device_id not in errors}
+    )
+
+    print(f"Controlled {len(actions) - len(errors)} devices in batch")
+    return errors
 
 
 def set_device_states(device_states):
     """Set GPIO pins based on the device states dictionary"""
-    global DEVICE_PINS
+    # Configure any pins that are not set up yet at their stored level
+    added, _ = reconcile(device_states)
 
-    # Update device pins mapping
+    # Drive the pins that were already configured
     for device_id, device_info in device_states.items():
-        physical_pin = device_info["pin"]
-        state = device_info["state"]
-        bcm_pin = physical_to_bcm(physical_pin)
+        if device_id in added or device_id not in DEVICE_PINS:
+            continue
+        try:
+            control_device(device_id, device_info["state"])
+        except Exception as e:
+            print(f"Error setting state for device {device_id}: {e}")
 
-        if bcm_pin is None:
-            print(f"Warning: Physical pin {physical_pin} cannot be mapped to BCM GPIO")
+
+def snapshot_states(device_states):
+    """Switch states in the pin snapshot that differ from device_states
+
+    The snapshot is written with every relay write, while the database may
+    trail it by up to STATE_MAX_LOSS_SECONDS, so after a power cut it has
+    the newer state. Returns device id -> state.
+    """
+    levels = snapshot.read()
+    changed = {}
+    for device_id, device_info in device_states.items():
+        if device_info.get("kind", "switch") != "switch":
             continue
+        level = levels.get(physical_to_bcm(device_info["pin"]))
+        if level is not None and _output_state(level) != device_info["state"]:
+            changed[device_id] = _output_state(level)
+    return changed
 
-        DEVICE_PINS[device_id] = bcm_pin
 
-        # Setup pin if not already done
-        try:
-            GPIO.setup(bcm_pin, GPIO.OUT)
-            control_device(device_id, state)
-        except Exception as e:
-            print(f"Error setting up BCM GPIO {bcm_pin} for device {device_id}: {e}")
+def read_inputs():
+    """Current state of every input device, read from the pins"""
+    with _lock:
+        pins = {device_id: DEVICE_PINS[device_id] for device_id in INPUTS}
+    backend = get_backend()
+    return {device_id: _input_state(backend.read(pin)) for device_id, pin in pins.items()}
 
 
 def get_pin_for_device(device_id):
@@ -126,4 +374,8 @@ def get_pin_for_device(device_id):
 
 def cleanup():
     """Cleanup GPIO resources"""
-    GPIO.cleanup()
+    snapshot.close()
+    if _backend is not None:
+        DIMMERS.clear()
+        INPUTS.clear()
+        _backend.cleanup()
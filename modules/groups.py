@@ -0,0 +1,213 @@
+import sqlite3
+import threading
+
+from modules import state_store
+from modules.db_pool import get_connection
+
+# Device groups (rooms), stored in the device_groups and group_members tables.
+#
+# Membership is held in memory as group id -> tuple of device ids, so
+# switching a group is a single controller.control_devices call (one backend
+# write for every member pin, one state update and one transaction) with no
+# SQL on the request path. A group's state is derived on read from
+# state_store's cached device states: "on" when every member is on, "off"
+# when every member is off, otherwise "mixed" ("empty" without members).
+
+_lock = threading.Lock()
+_groups = {}  # group id -> {"id", "name", "icon", "created_at", "device_ids": tuple}
+_version = 0
+
+
+def _bump_version():
+    """Mark the groups as changed; call with _lock held"""
+    global _version
+    _version += 1
+
+
+def version():
+    """Current groups version; changes whenever a group or its members change"""
+    return _version
+
+
+def load():
+    """(Re)load every group and its members from the database"""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, name, icon, created_at FROM device_groups"
+    ).fetchall()
+    members = conn.execute(
+        "SELECT group_id, device_id FROM group_members ORDER BY group_id, device_id"
+    ).fetchall()
+
+    device_ids = {}
+    for group_id, device_id in members:
+        device_ids.setdefault(group_id, []).append(device_id)
+
+    with _lock:
+        _bump_version()
+        _groups.clear()
+        for row in rows:
+            _groups[row[0]] = {
+                "id": row[0],
+                "name": row[1],
+                "icon": row[2],
+                "created_at": row[3],
+                "device_ids": tuple(device_ids.get(row[0], ())),
+            }
+
+
+def _state(device_ids, states):
+    """Derived group state from device id -> state"""
+    if not device_ids:
+        return "empty"
+    on = sum(1 for device_id in device_ids if states.get(device_id) == "high")
+    if on == len(device_ids):
+        return "on"
+    return "off" if on == 0 else "mixed"
+
+
+def _public(group, states):
+    """API representation of a group"""
+    return dict(
+        group,
+        device_ids=list(group["device_ids"]),
+        state=_state(group["device_ids"], states),
+    )
+
+
+def get_groups():
+    """All groups ordered by name, with their derived state"""
+    states = state_store.get_states()
+    with _lock:
+        groups = [_public(group, states) for group in _groups.values()]
+    return sorted(groups, key=lambda group: (group["name"].lower(), group["id"]))
+
+
+def get_group(group_id):
+    """A single group with its derived state, or None"""
+    states = state_store.get_states()
+    with _lock:
+        group = _groups.get(group_id)
+        return _public(group, states) if group else None
+
+
+def members(group_id):
+    """Device ids of a group; raises ValueError if it does not exist"""
+    with _lock:
+        group = _groups.get(group_id)
+        if group is None:
+            raise ValueError(f"Group {group_id} not found")
+        return group["device_ids"]
+
+
+def _check_devices(device_ids):
+    """Validated, de-duplicated tuple of existing device ids"""
+    try:
+        device_ids = tuple(sorted(set(int(device_id) for device_id in device_ids)))
+    except (TypeError, ValueError):
+        raise ValueError("device_ids must be a list of device IDs")
+
+    known = state_store.get_states()
+    for device_id in device_ids:
+        if device_id not in known:
+            raise ValueError(f"Device {device_id} not found")
+    return device_ids
+
+
+def add_group(name, icon="fa-layer-group", device_ids=()):
+    """Create a group; returns it"""
+    device_ids = _check_devices(device_ids)
+
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO device_groups (name, icon) VALUES (?, ?)", (name, icon)
+            )
+            group_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO group_members (group_id, device_id) VALUES (?, ?)",
+                [(group_id, device_id) for device_id in device_ids],
+            )
+            created_at = conn.execute(
+                "SELECT created_at FROM device_groups WHERE id = ?", (group_id,)
+            ).fetchone()[0]
+    except sqlite3.IntegrityError:
+        raise ValueError(f"A group named '{name}' already exists")
+
+    with _lock:
+        _bump_version()
+        _groups[group_id] = {
+            "id": group_id,
+            "name": name,
+            "icon": icon,
+            "created_at": created_at,
+            "device_ids": device_ids,
+        }
+    return get_group(group_id)
+
+
+def update_group(group_id, name=None, icon=None, device_ids=None):
+    """Rename a group, change its icon and/or replace its members; returns it"""
+    with _lock:
+        group = _groups.get(group_id)
+    if group is None:
+        raise ValueError(f"Group {group_id} not found")
+    if device_ids is not None:
+        device_ids = _check_devices(device_ids)
+
+    name = group["name"] if name is None else name
+    icon = group["icon"] if icon is None else icon
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE device_groups SET name = ?, icon = ? WHERE id = ?",
+                (name, icon, group_id),
+            )
+            if device_ids is not None:
+                conn.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
+                conn.executemany(
+                    "INSERT INTO group_members (group_id, device_id) VALUES (?, ?)",
+                    [(group_id, device_id) for device_id in device_ids],
+                )
+    except sqlite3.IntegrityError:
+        raise ValueError(f"A group named '{name}' already exists")
+
+    with _lock:
+        _bump_version()
+        group = _groups.get(group_id)
+        if group is not None:
+            group.update(name=name, icon=icon)
+            if device_ids is not None:
+                group["device_ids"] = device_ids
+    return get_group(group_id)
+
+
+def remove_group(group_id):
+    """Delete a group (its devices are untouched)"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
+        cursor = conn.execute("DELETE FROM device_groups WHERE id = ?", (group_id,))
+    if cursor.rowcount == 0:
+        raise ValueError(f"Group {group_id} not found")
+
+    with _lock:
+        _bump_version()
+        _groups.pop(group_id, None)
+
+
+def remove_device(device_id):
+    """Take a deleted device out of every group"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM group_members WHERE device_id = ?", (device_id,))
+
+    with _lock:
+        _bump_version()
+        for group in _groups.values():
+            if device_id in group["device_ids"]:
+                group["device_ids"] = tuple(
+                    member for member in group["device_ids"] if member != device_id
+                )
@@ -0,0 +1,347 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from modules import config
+from modules.db_pool import get_connection
+
+# Device on-time history.
+#
+# Every state transition is appended to device_events (see
+# state_store.flush). A background compactor turns complete hours of raw
+# events into per-device rollups in device_rollups:
+#
+#   period 'hour' / 'day', bucket = UTC start of the period (unix seconds),
+#   on_seconds = time spent "high", transitions = state changes in the period
+#
+# Range queries read the rollups, and only the hour or so not yet compacted
+# is computed from raw events. Raw events older than the retention period are
+# pruned; rollups are kept.
+
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = {"hour": HOUR, "day": DAY}
+MAX_BUCKETS = 2000  # per query
+COMPACT_CHUNK_SECONDS = DAY  # raw events compacted per transaction
+
+_compactor = None
+_stop_event = threading.Event()
+
+
+def _floor(ts, size):
+    return int(ts // size) * size
+
+
+def _format_time(ts):
+    """UTC timestamp in SQLite's CURRENT_TIMESTAMP format"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def parse_time(value):
+    """Unix seconds or an ISO 8601 string (UTC unless it has an offset)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}'")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def compacted_until():
+    """Raw events before this time (unix seconds) are reflected in the rollups"""
+    row = get_connection().execute(
+        "SELECT value FROM history_state WHERE name = 'compacted_until'"
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _initial_states(conn, at, device_id=None):
+    """device id -> state in effect at time at, from the last earlier event"""
+    if device_id is not None:
+        row = conn.execute(
+            """
+            SELECT state FROM device_events
+            WHERE device_id = ? AND ts < ?
+            ORDER BY ts DESC, id DESC LIMIT 1
+        """,
+            (device_id, at),
+        ).fetchone()
+        return {device_id: row[0]} if row else {}
+
+    cursor = conn.execute(
+        """
+        SELECT device_id, state FROM device_events
+        WHERE id IN (
+            SELECT MAX(id) FROM device_events WHERE ts < ? GROUP BY device_id
+        )
+    """,
+        (at,),
+    )
+    return dict(cursor.fetchall())
+
+
+def _add_on_time(buckets, start, end, size):
+    """Spread the interval [start, end) over buckets of the given size"""
+    while start < end:
+        bucket = _floor(start, size)
+        stop = min(end, bucket + size)
+        buckets.setdefault(bucket, [0.0, 0])[0] += stop - start
+        start = stop
+
+
+def _on_time(conn, start, end, size, device_id=None):
+    """device id -> {bucket: [on_seconds, transitions]} for [start, end) from raw events"""
+    states = _initial_states(conn, start, device_id)
+    since = dict.fromkeys(states, start)
+    result = {}
+
+    query = "SELECT device_id, state, ts FROM device_events WHERE ts >= ? AND ts < ?"
+    params = [start, end]
+    if device_id is not None:
+        query = (
+            "SELECT device_id, state, ts FROM device_events "
+            "WHERE device_id = ? AND ts >= ? AND ts < ?"
+        )
+        params.insert(0, device_id)
+
+    for event_device, state, ts in conn.execute(query + " ORDER BY id", params):
+        buckets = result.setdefault(event_device, {})
+        if states.get(event_device) == "high":
+            _add_on_time(buckets, since[event_device], ts, size)
+        buckets.setdefault(_floor(ts, size), [0.0, 0])[1] += 1
+        states[event_device] = state
+        since[event_device] = ts
+
+    for state_device, state in states.items():
+        if state == "high":
+            _add_on_time(
+                result.setdefault(state_device, {}), since[state_device], end, size
+            )
+    return result
+
+
+def compact(now=None):
+    """Roll complete hours of raw events up into hourly and daily totals
+
+    Returns the number of hours compacted.
+    """
+    now = time.time() if now is None else now
+    # Leave a margin for transitions still waiting in the write-behind buffer
+    until = _floor(now - config.STATE_MAX_LOSS_SECONDS - 60, HOUR)
+    conn = get_connection()
+
+    start = compacted_until()
+    if start is None:
+        first = conn.execute("SELECT MIN(ts) FROM device_events").fetchone()[0]
+        start = _floor(first, HOUR) if first is not None else until
+    start = int(start)
+
+    compacted = 0
+    while start < until:
+        end = min(until, start + COMPACT_CHUNK_SECONDS)
+        hours = _on_time(conn, start, end, HOUR)
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO device_rollups
+                (device_id, period, bucket, on_seconds, transitions)
+                VALUES (?, 'hour', ?, ?, ?)
+            """,
+                [
+                    (device_id, bucket, on_seconds, transitions)
+                    for device_id, buckets in hours.items()
+                    for bucket, (on_seconds, transitions) in buckets.items()
+                ],
+            )
+
+            # Recompute the daily totals of every day touched by this chunk
+            for day in range(_floor(start, DAY), end, DAY):
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO device_rollups
+                    (device_id, period, bucket, on_seconds, transitions)
+                    SELECT device_id, 'day', ?, SUM(on_seconds), SUM(transitions)
+                    FROM device_rollups
+                    WHERE period = 'hour' AND bucket >= ? AND bucket < ?
+                    GROUP BY device_id
+                """,
+                    (day, day, day + DAY),
+                )
+
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO history_state (name, value)
+                VALUES ('compacted_until', ?)
+            """,
+                (end,),
+            )
+        compacted += (end - start) // HOUR
+        start = end
+
+    return compacted
+
+
+def prune(now=None):
+    """Delete raw events past the retention period that are already compacted
+
+    The newest pruned-range event of each device is kept, since it holds the
+    device's state at the start of the remaining log. Returns rows deleted.
+    """
+    now = time.time() if now is None else now
+    cutoff = now - config.HISTORY_RETENTION_DAYS * DAY
+    watermark = compacted_until()
+    if watermark is None:
+        return 0
+    cutoff = min(cutoff, watermark)
+
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            """
+            DELETE FROM device_events
+            WHERE ts < ? AND id NOT IN (
+                SELECT MAX(id) FROM device_events WHERE ts < ? GROUP BY device_id
+            )
+        """,
+            (cutoff, cutoff),
+        )
+    return cursor.rowcount
+
+
+def get_device_history(device_id, start=None, end=None, resolution="hour"):
+    """On-time of a device per hour or day between start and end
+
+    start and end are unix seconds or ISO 8601 strings and default to the last
+    24 hours (hourly) or 30 days (daily). Complete periods come from the
+    rollups; only the not yet compacted tail is computed from raw events.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Invalid resolution '{resolution}' (use 'hour' or 'day')")
+    size = RESOLUTIONS[resolution]
+
+    now = time.time()
+    end = parse_time(end) if end is not None else now
+    if start is not None:
+        start = parse_time(start)
+    else:
+        start = end - (DAY if resolution == "hour" else 30 * DAY)
+    if start >= end:
+        raise ValueError("start must be before end")
+
+    first_bucket = _floor(start, size)
+    last_bucket = _floor(end, size)
+    if last_bucket == end:
+        last_bucket -= size  # end is exclusive
+    count = (last_bucket - first_bucket) // size + 1
+    if count > MAX_BUCKETS:
+        raise ValueError(f"Range too large ({count} buckets, limit {MAX_BUCKETS})")
+
+    conn = get_connection()
+    buckets = {}
+
+    watermark = compacted_until() or 0
+    boundary = _floor(watermark, size)  # Start of the first incomplete period
+
+    cursor = conn.execute(
+        """
+        SELECT bucket, on_seconds, transitions FROM device_rollups
+        WHERE device_id = ? AND period = ? AND bucket >= ? AND bucket < ?
+    """,
+        (device_id, resolution, first_bucket, min(last_bucket + size, boundary)),
+    )
+    for bucket, on_seconds, transitions in cursor:
+        buckets[bucket] = [on_seconds, transitions]
+
+    tail_start = max(first_bucket, boundary)
+    if last_bucket + size > tail_start:
+        if size > HOUR and watermark > tail_start:
+            # Complete hours of the current day are already rolled up
+            cursor = conn.execute(
+                """
+                SELECT bucket, on_seconds, transitions FROM device_rollups
+                WHERE device_id = ? AND period = 'hour' AND bucket >= ? AND bucket < ?
+            """,
+                (device_id, tail_start, watermark),
+            )
+            for bucket, on_seconds, transitions in cursor:
+                totals = buckets.setdefault(_floor(bucket, size), [0.0, 0])
+                totals[0] += on_seconds
+                totals[1] += transitions
+
+        live_start = max(tail_start, watermark)
+        live_end = min(last_bucket + size, now)
+        if live_end > live_start:
+            live = _on_time(conn, live_start, live_end, HOUR, device_id)
+            for bucket, (on_seconds, transitions) in live.get(device_id, {}).items():
+                totals = buckets.setdefault(_floor(bucket, size), [0.0, 0])
+                totals[0] += on_seconds
+                totals[1] += transitions
+
+    series = []
+    for bucket in range(int(first_bucket), int(last_bucket) + size, size):
+        on_seconds, transitions = buckets.get(bucket, (0.0, 0))
+        series.append(
+            {
+                "start": _format_time(bucket),
+                "on_seconds": round(on_seconds, 1),
+                "transitions": transitions,
+            }
+        )
+
+    return {
+        "device_id": device_id,
+        "resolution": resolution,
+        "start": _format_time(first_bucket),
+        "end": _format_time(last_bucket + size),
+        "on_seconds": round(sum(item["on_seconds"] for item in series), 1),
+        "transitions": sum(item["transitions"] for item in series),
+        "buckets": series,
+    }
+
+
+def _compact_loop():
+    """Background compaction and pruning, starting with the backlog from downtime"""
+    while True:
+        run_maintenance()
+        if _stop_event.wait(config.HISTORY_COMPACT_SECONDS):
+            break
+
+
+def run_maintenance():
+    """Compact and prune once; errors are logged, not raised"""
+    try:
+        compact()
+        prune()
+    except Exception as e:
+        print(f"Error compacting device history: {e}")
+
+
+def start():
+    """Start the background compactor (it first catches up on downtime)"""
+    global _compactor
+
+    if _compactor is not None:
+        return
+
+    _stop_event.clear()
+    _compactor = threading.Thread(
+        target=_compact_loop, name="dewhome-history", daemon=True
+    )
+    _compactor.start()
+
+
+def stop():
+    """Stop the background compactor"""
+    global _compactor
+
+    if _compactor is not None:
+        _stop_event.set()
+        _compactor.join(timeout=5)
+        _compactor = None
@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+
+from modules import config
+from modules import metrics
+
+# Edge events from input devices (wall switches, PIR and door sensors).
+#
+# The GPIO driver calls edge() from its own callback thread on every level
+# change; edge() only timestamps the change and puts it on a bounded queue.
+# A single dispatcher thread blocks on that queue, so nothing runs while the
+# inputs are quiet. A change is reported once the input has held its new
+# level for config.INPUT_DEBOUNCE_MS, so contact bounce is absorbed and the
+# level that ends a burst of bounces is always the one reported.
+#
+# If the queue overflows, further edges are dropped and the dispatcher
+# re-reads every input instead, so the reported states still end up right.
+
+_queue = queue.Queue(maxsize=config.INPUT_QUEUE_SIZE)
+_resync = threading.Event()  # Re-read every input on the next dispatch
+_lock = threading.Lock()
+_reported = {}  # device id -> last reported state ("high" = active)
+_pending = {}  # device id -> (state, edge time, deadline); dispatcher thread only
+_handler = None  # handler(device_id, state), called from the dispatcher
+_read_states = None  # read_states() -> {device id: state}, used by a resync
+_thread = None
+_STOP = object()
+
+EDGES = metrics.counter(
+    "dewhome_input_edges",
+    "Input edges by outcome (reported, bounce, dropped)",
+    ["result"],
+)
+LATENCY = metrics.histogram(
+    "dewhome_input_latency_seconds",
+    "Time from the edge that settled an input to its state being published "
+    "(includes the debounce window)",
+)
+
+
+def edge(device_id, state, ts=None):
+    """Record a level change of an input device (safe from any thread)"""
+    try:
+        _queue.put_nowait((device_id, state, time.perf_counter() if ts is None else ts))
+    except queue.Full:
+        EDGES.inc("dropped")
+        _resync.set()
+
+
+def resync():
+    """Re-read every input and report any state that differs"""
+    _resync.set()
+    try:
+        _queue.put_nowait(None)  # Wake the dispatcher
+    except queue.Full:
+        pass  # It is busy and will see the flag
+
+
+def watch(device_id, state):
+    """Start reporting changes of an input device whose known state is state"""
+    with _lock:
+        _reported[device_id] = state
+
+
+def forget(device_id):
+    """Stop reporting an input device"""
+    with _lock:
+        _reported.pop(device_id, None)
+
+
+def queue_depth():
+    """Edges waiting for the dispatcher"""
+    return _queue.qsize()
+
+
+def _report(device_id, state, ts):
+    with _lock:
+        previous = _reported.get(device_id, state)
+        if previous == state:
+            EDGES.inc("bounce")  # Back where it started, or no longer watched
+            return
+        _reported[device_id] = state
+
+    try:
+        _handler(device_id, state)
+    except Exception as e:
+        print(f"Error handling input device {device_id}: {e}")
+        with _lock:
+            if _reported.get(device_id) == state:
+                _reported[device_id] = previous  # Report it again on resync
+        return
+    LATENCY.observe(time.perf_counter() - ts)
+    EDGES.inc("reported")
+
+
+def _run():
+    debounce = config.INPUT_DEBOUNCE_MS / 1000.0
+    while True:
+        timeout = None
+        if _pending:
+            next_deadline = min(deadline for _, _, deadline in _pending.values())
+            timeout = max(0.0, next_deadline - time.perf_counter())
+
+        try:
+            item = _queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        if item is _STOP:
+            return
+        if item is not None:
+            device_id, state, ts = item
+            # Every edge restarts the device's debounce window
+            _pending[device_id] = (state, ts, ts + debounce)
+
+        now = time.perf_counter()
+        if _resync.is_set():
+            _resync.clear()
+            try:
+                for device_id, state in _read_states().items():
+                    _pending[device_id] = (state, now, now + debounce)
+            except Exception as e:
+                print(f"Error re-reading inputs: {e}")
+
+        for device_id, (state, ts, deadline) in list(_pending.items()):
+            if deadline <= now:
+                del _pending[device_id]
+                _report(device_id, state, ts)
+
+
+def start(handler, read_states):
+    """Start dispatching input changes to handler(device_id, state)"""
+    global _handler, _read_states, _thread
+
+    _handler = handler
+    _read_states = read_states
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_run, name="dewhome-inputs", daemon=True)
+    _thread.start()
+
+
+def stop():
+    """Stop the dispatcher; edges still queued are discarded"""
+    global _thread
+
+    if _thread is None:
+        return
+    while True:
+        try:
+            _queue.put(_STOP, timeout=1)
+            break
+        except queue.Full:
+            if not _thread.is_alive():
+                break
+    _thread.join(timeout=5)
+    _thread = None
+    with _queue.mutex:
+        _queue.queue.clear()
+    _pending.clear()
+
+
+metrics.gauge(
+    "dewhome_input_queue_depth",
+    "Input edges waiting for the dispatcher",
+    queue_depth,
+)
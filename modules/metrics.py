@@ -0,0 +1,231 @@
+import bisect
+import contextlib
+import threading
+import time
+
+from modules import config
+
+# In-process metrics in Prometheus text format (GET /metrics).
+#
+# Hot-path stages are timed with
+#
+#     with metrics.stage("gpio_write"):
+#         ...
+#
+# which records into the dewhome_stage_seconds histogram. Counters and gauges
+# are registered by the modules that own the numbers. With DEWHOME_METRICS=0
+# stage() returns a shared no-op context manager and inc()/observe() return
+# immediately, so instrumented code costs one function call.
+
+ENABLED = config.METRICS_ENABLED
+
+# Seconds; fine-grained at the low end, where GPIO writes and cached reads sit
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+_NOOP = contextlib.nullcontext()
+_lock = threading.Lock()
+_families = {}  # name -> Counter, Histogram or Gauge, in registration order
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    type = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with _lock:
+            values = dict(self._values)
+        return [
+            (self.name + "_total", dict(zip(self.labelnames, labels)), value)
+            for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination"""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with _lock:
+            values = {labels: list(series) for labels, series in self._values.items()}
+
+        samples = []
+        for labels, series in sorted(values.items()):
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((self.name + "_bucket", dict(base, le=le), cumulative))
+            samples.append((self.name + "_sum", base, series[-1]))
+            samples.append((self.name + "_count", base, cumulative))
+        return samples
+
+
+class Gauge:
+    """Value read from a callback at scrape time
+
+    The callback returns a number, or a dict of label tuple -> number.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help_text, callback, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [
+                (self.name, dict(zip(self.labelnames, labels)), number)
+                for labels, number in sorted(value.items())
+            ]
+        return [(self.name, {}, value)]
+
+
+def _register(family):
+    with _lock:
+        return _families.setdefault(family.name, family)
+
+
+def counter(name, help_text, labelnames=()):
+    """Create (or return the existing) counter"""
+    return _register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Create (or return the existing) histogram"""
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name, help_text, callback, labelnames=()):
+    """Register a gauge read from callback() at scrape time"""
+    return _register(Gauge(name, help_text, callback, labelnames))
+
+
+STAGE_SECONDS = histogram(
+    "dewhome_stage_seconds",
+    "Time spent in each hot-path stage",
+    ["stage"],
+)
+
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+        return False
+
+
+def stage(name):
+    """Context manager timing a stage (parse, gpio_write, db_commit, ...)"""
+    if not ENABLED:
+        return _NOOP
+    return _StageTimer(name)
+
+
+def collect():
+    """Every family as a JSON-friendly dict: name -> {type, help, samples}"""
+    with _lock:
+        families = list(_families.values())
+    return {
+        family.name: {
+            "type": family.type,
+            "help": family.help,
+            "samples": family.samples(),
+        }
+        for family in families
+    }
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(sources):
+    """Prometheus text exposition of several collect() results
+
+    sources is a list of (labels, families) pairs. labels (a dict, or None)
+    is added to every sample of the source, so families from the web workers
+    and the GPIO daemon can be served side by side.
+    """
+    merged = {}
+    for extra, families in sources:
+        for name, family in families.items():
+            target = merged.setdefault(
+                name, {"type": family["type"], "help": family["help"], "samples": []}
+            )
+            for sample_name, labels, value in family["samples"]:
+                if extra:
+                    labels = dict(labels, **extra)
+                target["samples"].append((sample_name, labels, value))
+
+    lines = []
+    for name, family in merged.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in family["samples"]:
+            if labels:
+                label_text = ",".join(
+                    f'{key}="{_escape(label)}"' for key, label in labels.items()
+                )
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,277 @@
+import concurrent.futures
+import threading
+import time
+
+from modules import config
+from modules import events
+from modules import metrics
+
+# MQTT bridge: device commands in, retained device states out.
+#
+# Runs in the process that owns the controller (app.py, or gpio_daemon.py in
+# the multi-worker setup) so there is exactly one client per hub. Topics,
+# under config.MQTT_PREFIX (dewhome/<hub name> by default):
+#
+#   <prefix>/status                     "online" / "offline" (retained, last will)
+#   <prefix>/devices/<id>/state         "high" / "low" (retained)
+#   <prefix>/devices/<id>/brightness    0-100, dimmers only (retained)
+#   <prefix>/devices/<id>/set           command: "high", "low", "on" or "off"
+#   <prefix>/devices/<id>/brightness/set   command: 0-100 (dimmers)
+#
+# Commands go through the same controller calls as POST /device, coalescing
+# included, on a small thread pool so a slow write never stalls the network
+# loop. State changes are only recorded by the event listener (latest value
+# per topic); a publisher thread sends them, at once when quiet and at most
+# once per config.MQTT_BATCH_MS under a burst. While the broker is away the
+# changes wait in that same table, so GPIO writes never block on the network;
+# paho reconnects with backoff, and every device state is re-sent on connect.
+
+COMMANDS = metrics.counter(
+    "dewhome_mqtt_commands",
+    "MQTT device commands by outcome (applied, invalid, failed)",
+    ["result"],
+)
+PUBLISHES = metrics.counter(
+    "dewhome_mqtt_publishes",
+    "Retained state messages by outcome (sent, merged into a later value, failed)",
+    ["result"],
+)
+
+_lock = threading.Lock()
+_outbox = {}  # topic -> payload waiting to be published
+_wake = threading.Event()  # _outbox has something
+_connected = threading.Event()
+_stopping = threading.Event()
+_last_flush = 0.0
+_client = None
+_publisher = None
+_commands = None
+_handlers = {}  # "control", "brightness", "devices" -> controller callables
+
+
+def _topic(*parts):
+    return "/".join((config.MQTT_PREFIX,) + tuple(str(part) for part in parts))
+
+
+def _queue(messages, replace=True):
+    """Record topic -> payload messages for the publisher"""
+    with _lock:
+        for topic, payload in messages.items():
+            if topic in _outbox:
+                if not replace:
+                    continue
+                PUBLISHES.inc("merged")
+            _outbox[topic] = payload
+        if _outbox:
+            _wake.set()
+
+
+def _device_messages(device):
+    messages = {_topic("devices", device["id"], "state"): device["state"]}
+    # device_state events carry a brightness (and no kind) only for dimmers
+    if device.get("brightness") is not None and device.get("kind", "dimmer").endswith("dimmer"):
+        messages[_topic("devices", device["id"], "brightness")] = str(device["brightness"])
+    return messages
+
+
+def _on_event(event):
+    """events listener; runs under the state lock, so it only records"""
+    if _client is None:
+        return
+    data = event["data"]
+    if event["type"] in ("device_state", "device_added", "device_updated"):
+        _queue(_device_messages(data))
+    elif event["type"] == "device_removed":
+        # An empty retained message clears the topic on the broker
+        _queue({
+            _topic("devices", data["id"], "state"): "",
+            _topic("devices", data["id"], "brightness"): "",
+        })
+
+
+def _flush(client):
+    global _last_flush
+
+    with _lock:
+        batch = dict(_outbox)
+        _outbox.clear()
+        _wake.clear()
+
+    retry = {}
+    for topic, payload in batch.items():
+        info = client.publish(topic, payload, qos=config.MQTT_QOS, retain=True)
+        if info.rc == 0:
+            PUBLISHES.inc("sent")
+        else:
+            retry[topic] = payload
+            PUBLISHES.inc("failed")
+    _last_flush = time.monotonic()
+
+    if retry:
+        _connected.clear()  # Wait for on_connect, which re-sends every state
+        _queue(retry, replace=False)
+
+
+def _run_publisher(client):
+    window = config.MQTT_BATCH_MS / 1000.0
+    while True:
+        _wake.wait()
+        _connected.wait()
+        if _stopping.is_set():
+            return
+        delay = _last_flush + window - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)  # Let the burst collect in _outbox
+        _flush(client)
+
+
+def _parse(command, payload):
+    """(handler name, args) of a command message; raises ValueError"""
+    text = payload.decode("utf-8", "replace").strip()
+    if command == "brightness/set":
+        try:
+            brightness = float(text)
+        except ValueError:
+            raise ValueError("Brightness must be a number from 0 to 100")
+        if not 0 <= brightness <= 100:
+            raise ValueError("Brightness must be a number from 0 to 100")
+        return "brightness", (round(brightness), None)
+
+    action = {"on": "high", "off": "low"}.get(text.lower(), text.lower())
+    if action not in ("high", "low"):
+        raise ValueError("Invalid action")
+    return "control", (action,)
+
+
+def _handle(device_id, command, payload):
+    try:
+        name, args = _parse(command, payload)
+        _handlers[name](device_id, *args)
+    except ValueError as e:
+        COMMANDS.inc("invalid")
+        print(f"MQTT command for device {device_id} rejected: {e}")
+        return
+    except Exception as e:
+        COMMANDS.inc("failed")
+        print(f"MQTT command for device {device_id} failed: {e}")
+        return
+    COMMANDS.inc("applied")
+
+
+def _on_message(client, userdata, message):
+    # <prefix>/devices/<id>/set or <prefix>/devices/<id>/brightness/set
+    parts = message.topic[len(config.MQTT_PREFIX) + 1 :].split("/", 2)
+    if len(parts) != 3 or parts[2] not in ("set", "brightness/set"):
+        return  # Not a command topic (some brokers echo retained states)
+    try:
+        device_id = int(parts[1])
+    except ValueError:
+        COMMANDS.inc("invalid")
+        return
+    _commands.submit(_handle, device_id, parts[2], message.payload)
+
+
+def _on_connect(client, userdata, flags, reason_code, *args):
+    if getattr(reason_code, "is_failure", reason_code != 0):
+        print(f"MQTT broker refused the connection: {reason_code}")
+        return
+    print(f"Connected to MQTT broker {config.MQTT_HOST}:{config.MQTT_PORT}")
+    client.subscribe(
+        [(_topic("devices", "+", "set"), config.MQTT_QOS),
+         (_topic("devices", "+", "brightness", "set"), config.MQTT_QOS)]
+    )
+    client.publish(_topic("status"), "online", qos=config.MQTT_QOS, retain=True)
+
+    # Re-send every state; changes recorded since the snapshot was read win
+    snapshot = {}
+    for device in _handlers["devices"]():
+        snapshot.update(_device_messages(device))
+    _queue(snapshot, replace=False)
+    _connected.set()
+
+
+def _on_disconnect(client, userdata, *args):
+    _connected.clear()
+    if not _stopping.is_set():
+        print("Lost the MQTT broker; reconnecting in the background")
+
+
+def start(control, set_brightness, get_devices):
+    """Connect to the broker, if one is configured
+
+    control(device_id, action) and set_brightness(device_id, brightness,
+    fade_ms) apply commands; get_devices() lists the devices to publish.
+    Never blocks: the connection is made (and remade) in the background.
+    """
+    global _client, _publisher, _commands
+
+    if not config.MQTT_HOST or _client is not None:
+        return
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        print("Warning: DEWHOME_MQTT_HOST is set but paho-mqtt is not installed")
+        return
+
+    _handlers.update(control=control, brightness=set_brightness, devices=get_devices)
+    if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt 2.x
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=config.MQTT_CLIENT_ID)
+    else:
+        client = mqtt.Client(client_id=config.MQTT_CLIENT_ID)
+    if config.MQTT_USERNAME:
+        client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD or None)
+    client.will_set(_topic("status"), "offline", qos=config.MQTT_QOS, retain=True)
+    client.reconnect_delay_set(min_delay=1, max_delay=config.MQTT_RECONNECT_MAX_SECONDS)
+    client.on_connect = _on_connect
+    client.on_disconnect = _on_disconnect
+    client.on_message = _on_message
+
+    _stopping.clear()
+    _commands = concurrent.futures.ThreadPoolExecutor(
+        max_workers=4, thread_name_prefix="dewhome-mqtt"
+    )
+    _client = client
+    events.add_listener(_on_event)
+    _publisher = threading.Thread(
+        target=_run_publisher, args=(client,), name="dewhome-mqtt-publish", daemon=True
+    )
+    _publisher.start()
+    client.connect_async(config.MQTT_HOST, config.MQTT_PORT, keepalive=60)
+    client.loop_start()
+
+
+def stop():
+    """Publish what is pending, mark the hub offline and disconnect"""
+    global _client, _publisher
+
+    if _client is None:
+        return
+    client, _client = _client, None
+    _stopping.set()
+    _wake.set()
+    was_connected = _connected.is_set()
+    _connected.set()  # Release the publisher if it is waiting for the broker
+    _publisher.join(timeout=5)
+    _publisher = None
+
+    if was_connected:
+        _flush(client)
+        client.publish(_topic("status"), "offline", qos=config.MQTT_QOS, retain=True)
+    client.disconnect()
+    client.loop_stop()
+    _commands.shutdown(wait=True)
+    _connected.clear()
+    with _lock:
+        _outbox.clear()
+
+
+def connected():
+    """Whether the bridge is connected to the broker"""
+    return _connected.is_set() and _client is not None
+
+
+metrics.gauge(
+    "dewhome_mqtt_connected",
+    "1 while the MQTT bridge is connected to its broker",
+    lambda: int(connected()),
+)
@@ -0,0 +1,412 @@
+import re
+import threading
+
+# Single source of truth for the Raspberry Pi 40-pin header.
+#
+# Everything the application needs to know about a pin (category, capability
+# bitmask, BCM number, whether a device uses it) is indexed here once at import
+# time, so pin listings and validation never have to query SQLite or split
+# comma-separated capability strings.
+
+# GPIO Pin definitions with categories
+GPIO_PINS = {
+    1: {
+        "type": "3.3V",
+        "category": "power",
+        "capabilities": ["power"],
+        "description": "3.3V Power",
+    },
+    2: {
+        "type": "5V",
+        "category": "power",
+        "capabilities": ["power"],
+        "description": "5V Power",
+    },
+    3: {
+        "type": "GPIO2",
+        "category": "i2c",
+        "capabilities": ["input", "output", "i2c"],
+        "description": "GPIO2 (SDA1)",
+    },
+    4: {
+        "type": "5V",
+        "category": "power",
+        "capabilities": ["power"],
+        "description": "5V Power",
+    },
+    5: {
+        "type": "GPIO3",
+        "category": "i2c",
+        "capabilities": ["input", "output", "i2c"],
+        "description": "GPIO3 (SCL1)",
+    },
+    6: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    7: {
+        "type": "GPIO4",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO4",
+    },
+    8: {
+        "type": "GPIO14",
+        "category": "uart",
+        "capabilities": ["input", "output", "uart"],
+        "description": "GPIO14 (TXD0)",
+    },
+    9: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    10: {
+        "type": "GPIO15",
+        "category": "uart",
+        "capabilities": ["input", "output", "uart"],
+        "description": "GPIO15 (RXD0)",
+    },
+    11: {
+        "type": "GPIO17",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO17",
+    },
+    12: {
+        "type": "GPIO18",
+        "category": "gpio",
+        "capabilities": ["input", "output", "pwm"],
+        "description": "GPIO18 (PWM0)",
+    },
+    13: {
+        "type": "GPIO27",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO27",
+    },
+    14: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    15: {
+        "type": "GPIO22",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO22",
+    },
+    16: {
+        "type": "GPIO23",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO23",
+    },
+    17: {
+        "type": "3.3V",
+        "category": "power",
+        "capabilities": ["power"],
+        "description": "3.3V Power",
+    },
+    18: {
+        "type": "GPIO24",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO24",
+    },
+    19: {
+        "type": "GPIO10",
+        "category": "spi",
+        "capabilities": ["input", "output", "spi"],
+        "description": "GPIO10 (MOSI)",
+    },
+    20: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    21: {
+        "type": "GPIO9",
+        "category": "spi",
+        "capabilities": ["input", "output", "spi"],
+        "description": "GPIO9 (MISO)",
+    },
+    22: {
+        "type": "GPIO25",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO25",
+    },
+    23: {
+        "type": "GPIO11",
+        "category": "spi",
+        "capabilities": ["input", "output", "spi"],
+        "description": "GPIO11 (SCLK)",
+    },
+    24: {
+        "type": "GPIO8",
+        "category": "spi",
+        "capabilities": ["input", "output", "spi"],
+        "description": "GPIO8 (CE0)",
+    },
+    25: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    26: {
+        "type": "GPIO7",
+        "category": "spi",
+        "capabilities": ["input", "output", "spi"],
+        "description": "GPIO7 (CE1)",
+    },
+    27: {
+        "type": "ID_SD",
+        "category": "special",
+        "capabilities": ["i2c"],
+        "description": "ID_SD (EEPROM)",
+    },
+    28: {
+        "type": "ID_SC",
+        "category": "special",
+        "capabilities": ["i2c"],
+        "description": "ID_SC (EEPROM)",
+    },
+    29: {
+        "type": "GPIO5",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO5",
+    },
+    30: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    31: {
+        "type": "GPIO6",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO6",
+    },
+    32: {
+        "type": "GPIO12",
+        "category": "gpio",
+        "capabilities": ["input", "output", "pwm"],
+        "description": "GPIO12 (PWM0)",
+    },
+    33: {
+        "type": "GPIO13",
+        "category": "gpio",
+        "capabilities": ["input", "output", "pwm"],
+        "description": "GPIO13 (PWM1)",
+    },
+    34: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    35: {
+        "type": "GPIO19",
+        "category": "gpio",
+        "capabilities": ["input", "output", "pwm"],
+        "description": "GPIO19 (PWM1)",
+    },
+    36: {
+        "type": "GPIO16",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO16",
+    },
+    37: {
+        "type": "GPIO26",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO26",
+    },
+    38: {
+        "type": "GPIO20",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO20",
+    },
+    39: {
+        "type": "GND",
+        "category": "ground",
+        "capabilities": ["ground"],
+        "description": "Ground",
+    },
+    40: {
+        "type": "GPIO21",
+        "category": "gpio",
+        "capabilities": ["input", "output"],
+        "description": "GPIO21",
+    },
+}
+
+# Capability bits
+CAP_POWER = 1 << 0
+CAP_GROUND = 1 << 1
+CAP_INPUT = 1 << 2
+CAP_OUTPUT = 1 << 3
+CAP_I2C = 1 << 4
+CAP_UART = 1 << 5
+CAP_SPI = 1 << 6
+CAP_PWM = 1 << 7
+
+CAPABILITY_BITS = {
+    "power": CAP_POWER,
+    "ground": CAP_GROUND,
+    "input": CAP_INPUT,
+    "output": CAP_OUTPUT,
+    "i2c": CAP_I2C,
+    "uart": CAP_UART,
+    "spi": CAP_SPI,
+    "pwm": CAP_PWM,
+}
+
+# Categories whose pins may drive devices, in the order they are offered
+USABLE_CATEGORIES = ("gpio", "spi", "uart", "i2c")
+
+# switch: on/off output. dimmer: hardware PWM (pwm pins only).
+# soft_dimmer: software PWM on any output pin. input: switch or sensor
+# read through edge detection (see modules/inputs.py).
+DEVICE_KINDS = ("switch", "dimmer", "soft_dimmer", "input")
+
+
+def capability_mask(capabilities):
+    """Combine capability names into a bitmask"""
+    mask = 0
+    for capability in capabilities:
+        mask |= CAPABILITY_BITS[capability]
+    return mask
+
+
+def _bcm_number(pin_type):
+    """BCM GPIO number from a pin type such as 'GPIO17', or None"""
+    match = re.fullmatch(r"GPIO(\d+)", pin_type)
+    return int(match.group(1)) if match else None
+
+
+# Indexes, built once
+CAPABILITY_MASKS = {}  # physical pin -> capability bitmask
+PHYSICAL_TO_BCM = {}  # physical pin -> BCM GPIO number
+BCM_TO_PHYSICAL = {}  # BCM GPIO number -> physical pin
+PINS_BY_CATEGORY = {}  # category -> tuple of physical pins
+PINS_BY_CAPABILITY = {}  # capability name -> tuple of physical pins
+
+for _pin, _info in GPIO_PINS.items():
+    CAPABILITY_MASKS[_pin] = capability_mask(_info["capabilities"])
+    _bcm = _bcm_number(_info["type"])
+    if _bcm is not None:
+        PHYSICAL_TO_BCM[_pin] = _bcm
+        BCM_TO_PHYSICAL[_bcm] = _pin
+    PINS_BY_CATEGORY.setdefault(_info["category"], []).append(_pin)
+    for _capability in _info["capabilities"]:
+        PINS_BY_CAPABILITY.setdefault(_capability, []).append(_pin)
+
+PINS_BY_CATEGORY = {key: tuple(pins) for key, pins in PINS_BY_CATEGORY.items()}
+PINS_BY_CAPABILITY = {key: tuple(pins) for key, pins in PINS_BY_CAPABILITY.items()}
+
+# Output-capable pins in the order get_usable_pins lists them
+USABLE_PINS = tuple(
+    pin
+    for category in USABLE_CATEGORIES
+    for pin in PINS_BY_CATEGORY.get(category, ())
+    if CAPABILITY_MASKS[pin] & CAP_OUTPUT
+)
+
+# API representation of every pin, without the is_used flag
+_PIN_RECORDS = {
+    pin: {
+        "pin_number": pin,
+        "type": info["type"],
+        "category": info["category"],
+        "capabilities": list(info["capabilities"]),
+        "description": info["description"],
+    }
+    for pin, info in GPIO_PINS.items()
+}
+
+del _pin, _info, _bcm, _capability
+
+# Pins currently assigned to a device, kept in sync with the devices table
+_used = set()
+_lock = threading.Lock()
+
+
+def has_capability(pin_number, capability):
+    """Whether a physical pin supports a capability"""
+    return bool(CAPABILITY_MASKS.get(pin_number, 0) & CAPABILITY_BITS[capability])
+
+
+def physical_to_bcm(physical_pin):
+    """BCM GPIO number for a physical pin, or None"""
+    return PHYSICAL_TO_BCM.get(physical_pin)
+
+
+def load_used(pin_numbers):
+    """Replace the set of used pins (from the devices table)"""
+    with _lock:
+        _used.clear()
+        _used.update(pin_numbers)
+
+
+def is_used(pin_number):
+    """Whether a device is assigned to the pin"""
+    return pin_number in _used
+
+
+def validate_device_pin(pin_number, kind="switch"):
+    """Raise ValueError unless a new device of this kind may use this pin"""
+    if kind not in DEVICE_KINDS:
+        raise ValueError(f"Invalid device kind '{kind}'")
+    if pin_number not in GPIO_PINS:
+        raise ValueError(f"Pin {pin_number} does not exist")
+    if kind == "input":
+        if not CAPABILITY_MASKS[pin_number] & CAP_INPUT:
+            raise ValueError(f"Pin {pin_number} cannot read an input")
+    elif not CAPABILITY_MASKS[pin_number] & CAP_OUTPUT:
+        raise ValueError(f"Pin {pin_number} cannot drive a device")
+    if kind == "dimmer" and not CAPABILITY_MASKS[pin_number] & CAP_PWM:
+        raise ValueError(
+            f"Pin {pin_number} has no hardware PWM; use a PWM pin "
+            f"({', '.join(map(str, PINS_BY_CAPABILITY['pwm']))}) or kind 'soft_dimmer'"
+        )
+    if pin_number in _used:
+        raise ValueError(f"Pin {pin_number} is already in use")
+
+
+def reserve(pin_number, kind="switch"):
+    """Validate and mark a pin as used in one step; raises ValueError"""
+    with _lock:
+        validate_device_pin(pin_number, kind)
+        _used.add(pin_number)
+
+
+def release(pin_number):
+    """Mark a pin as free again"""
+    with _lock:
+        _used.discard(pin_number)
+
+
+def available_pins():
+    """All header pins with their usage, ordered by pin number"""
+    used = set(_used)
+    return [
+        dict(_PIN_RECORDS[pin], is_used=pin in used) for pin in sorted(GPIO_PINS)
+    ]
+
+
+def usable_pins():
+    """Free pins that can drive devices, GPIO first, then SPI, UART and I2C"""
+    used = set(_used)
+    return [dict(_PIN_RECORDS[pin]) for pin in USABLE_PINS if pin not in used]
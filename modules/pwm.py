@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+
+from modules import config
+
+# PWM outputs for dimmable devices.
+#
+# Hardware PWM uses the SoC's two PWM channels through the kernel's sysfs
+# interface (/sys/class/pwm), enabled with the pwm-2chan overlay in
+# /boot/config.txt:
+#
+#     dtoverlay=pwm-2chan                             # GPIO18 + GPIO19
+#     dtoverlay=pwm-2chan,pin=12,func=4,pin2=13,func2=4   # GPIO12 + GPIO13
+#
+# The duty cycle is generated by the PWM peripheral, so nothing runs in Python
+# between brightness changes. Software PWM toggles the pin from a thread and
+# costs CPU for as long as the output is dimmed (see
+# benchmarks/bench_pwm.py); it is only used when a device asks for it.
+
+# BCM GPIO -> hardware PWM channel. Pins sharing a channel share its output,
+# so only one of each pair can be a hardware dimmer.
+HARDWARE_CHANNELS = {12: 0, 18: 0, 13: 1, 19: 1}
+
+FADE_STEP_SECONDS = 0.02  # 50 duty updates per second while fading
+
+
+def hardware_channel(bcm_pin):
+    """Hardware PWM channel of a BCM pin, or None"""
+    return HARDWARE_CHANNELS.get(bcm_pin)
+
+
+class SysfsPWM:
+    """One hardware PWM channel driven through /sys/class/pwm"""
+
+    def __init__(self, channel, frequency, duty, chip=None):
+        self.path = os.path.join(chip or config.PWM_CHIP, f"pwm{channel}")
+        self.chip = chip or config.PWM_CHIP
+        self.channel = channel
+
+        if not os.path.isdir(self.path):
+            try:
+                self._write(os.path.join(self.chip, "export"), channel)
+            except OSError as e:
+                raise OSError(
+                    f"Hardware PWM channel {channel} is not available ({e}); "
+                    "enable it with dtoverlay=pwm-2chan in /boot/config.txt"
+                )
+            # udev needs a moment to make the new files writable
+            deadline = time.monotonic() + 1.0
+            while not os.access(os.path.join(self.path, "period"), os.W_OK):
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.01)
+
+        self.period_ns = int(1e9 / frequency)
+        self._write(os.path.join(self.path, "duty_cycle"), 0)
+        self._write(os.path.join(self.path, "period"), self.period_ns)
+        self.set_duty(duty)
+        self._write(os.path.join(self.path, "enable"), 1)
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, "w") as f:
+            f.write(str(value))
+
+    def set_duty(self, duty):
+        """Duty cycle in percent (0-100)"""
+        self._write(
+            os.path.join(self.path, "duty_cycle"), int(self.period_ns * duty / 100)
+        )
+
+    def stop(self):
+        try:
+            self._write(os.path.join(self.path, "duty_cycle"), 0)
+            self._write(os.path.join(self.path, "enable"), 0)
+            self._write(os.path.join(self.chip, "unexport"), self.channel)
+        except OSError as e:
+            print(f"Error releasing hardware PWM channel {self.channel}: {e}")
+
+
+class SoftwarePWM:
+    """Duty cycle generated by toggling a pin from a Python thread
+
+    write(level) sets the pin. At 0% and 100% the pin is held steady and the
+    thread sleeps, so only a dimmed output costs CPU.
+    """
+
+    def __init__(self, write, frequency, duty):
+        self.write = write
+        self.period = 1.0 / frequency
+        self.duty = None
+        self._changed = threading.Condition()
+        self._stopped = False
+        self.set_duty(duty)
+        self._thread = threading.Thread(
+            target=self._run, name="dewhome-soft-pwm", daemon=True
+        )
+        self._thread.start()
+
+    def set_duty(self, duty):
+        with self._changed:
+            self.duty = max(0.0, min(100.0, duty))
+            self._changed.notify()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                if self._stopped:
+                    return
+                duty = self.duty
+                if duty <= 0 or duty >= 100:
+                    self.write(1 if duty >= 100 else 0)
+                    self._changed.wait()  # Steady level: no CPU until it changes
+                    continue
+
+            on_time = self.period * duty / 100
+            self.write(1)
+            time.sleep(on_time)
+            self.write(0)
+            time.sleep(self.period - on_time)
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify()
+        self._thread.join(timeout=1)
+
+
+class Fader:
+    """Moves PWM outputs to a target duty cycle over time, off the request thread
+
+    set_duty(key, duty) is called for every step. A new fade for the same key
+    replaces the one in progress, starting from wherever it had got to.
+    """
+
+    def __init__(self, set_duty):
+        self.set_duty = set_duty
+        self._fades = {}  # key -> (start duty, target duty, start time, duration)
+        self._current = {}  # key -> last duty written
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def current(self, key, default=0.0):
+        with self._lock:
+            return self._current.get(key, default)
+
+    def reset(self, key, duty):
+        """Record a duty cycle that was set directly on the output"""
+        with self._lock:
+            self._fades.pop(key, None)
+            self._current[key] = duty
+
+    def jump(self, key, duty):
+        """Set a duty cycle immediately, cancelling any fade"""
+        with self._lock:
+            self._fades.pop(key, None)
+            self._current[key] = duty
+        self.set_duty(key, duty)
+
+    def fade(self, key, target, duration):
+        """Fade to target over duration seconds (0 jumps straight there)"""
+        if duration <= 0:
+            self.jump(key, target)
+            return
+
+        with self._lock:
+            start = self._current.get(key, 0.0)
+            self._fades[key] = (start, target, time.monotonic(), duration)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="dewhome-fader", daemon=True
+                )
+                self._thread.start()
+            self._lock.notify()
+
+    def forget(self, key):
+        with self._lock:
+            self._fades.pop(key, None)
+            self._current.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._fades:
+                    self._lock.wait()
+
+                now = time.monotonic()
+                steps = {}
+                for key, (start, target, began, duration) in list(self._fades.items()):
+                    progress = min(1.0, (now - began) / duration)
+                    steps[key] = start + (target - start) * progress
+                    self._current[key] = steps[key]
+                    if progress >= 1.0:
+                        del self._fades[key]
+
+            for key, duty in steps.items():
+                try:
+                    self.set_duty(key, duty)
+                except Exception as e:
+                    print(f"Error fading PWM output {key}: {e}")
+            time.sleep(FADE_STEP_SECONDS)
@@ -0,0 +1,433 @@
+import datetime
+import heapq
+import threading
+import time
+
+from modules import config
+from modules import events
+from modules import metrics
+from modules.db_pool import get_connection
+
+# Event-driven automation rules, stored in the rules table.
+#
+# A rule is "when <trigger>, switch <device> to <action> [after <delay>
+# seconds]". The trigger is a device reaching a state
+# ({"device_id": 3, "state": "high"}) or a daily time of day
+# ({"at": "22:30"}, local time). A delayed rule that triggers again before
+# its action has run starts its delay over.
+#
+# Rules are compiled into indexes when they are loaded or added, so an event
+# only looks at the rules it can trigger, however many there are:
+#
+# - (device id, state) -> rule ids, for device triggers: a device_state
+#   event costs one dict lookup;
+# - a min-heap of (due time, rule id, kind, depth) for time triggers and
+#   delayed actions, like modules/scheduler.py. Removed or restarted entries
+#   are left in the heap and skipped when they surface.
+#
+# The events listener runs under the state lock, so it only looks up the
+# index and queues what matched. A worker thread applies the actions through
+# the controller's normal path (one control_devices call per batch, last
+# action per device winning), so rule actions are written, recorded and
+# published like any other command.
+#
+# Actions can trigger further rules. Each queued action carries its cascade
+# depth: changes made by the worker while applying depth-d actions trigger
+# rules at depth d + 1 (delayed actions keep theirs). Anything deeper than
+# config.RULES_MAX_DEPTH is dropped and counted, so rules that switch each
+# other stop instead of looping. Only real changes trigger rules: a device
+# reported in the state it was already in does not.
+#
+# Pending delays live in memory only, and time triggers missed while the hub
+# was off are not run late; use schedules for actions that must survive a
+# restart.
+
+MAX_SLEEP_SECONDS = 60  # Re-check at least this often, in case the clock jumps
+
+RULE_ACTIONS = metrics.counter(
+    "dewhome_rule_actions",
+    "Rule actions by outcome (applied, failed, loop)",
+    ["result"],
+)
+
+_lock = threading.Condition()
+_rules = {}  # rule id -> rule dict
+_by_state = {}  # (device id, state) -> [rule id, ...]
+_timers = []  # (due, rule id, "time" or "action", depth)
+_pending = {}  # rule id -> due time of its delayed action
+_ready = []  # (rule id, depth) of actions to apply now
+_states = {}  # device id -> last state seen
+_context = threading.local()  # depth of the actions the worker is applying
+_fire = None
+_thread = None
+_stopping = False
+_listening = False
+
+_stats = {"triggered": 0, "applied": 0, "failed": 0, "loops": 0}
+
+
+def _public(rule):
+    """API representation of a rule"""
+    if rule["trigger_at"] is not None:
+        trigger = {"at": rule["trigger_at"]}
+    else:
+        trigger = {"device_id": rule["trigger_device_id"], "state": rule["trigger_state"]}
+    return {
+        "id": rule["id"],
+        "name": rule["name"],
+        "trigger": trigger,
+        "device_id": rule["device_id"],
+        "action": rule["action"],
+        "delay": rule["delay"],
+        "created_at": rule["created_at"],
+    }
+
+
+def parse_trigger(trigger):
+    """(device id, state, at) of a trigger dict; raises ValueError if invalid"""
+    if not isinstance(trigger, dict):
+        raise ValueError("trigger must be {device_id, state} or {at}")
+
+    if trigger.get("at") is not None:
+        try:
+            at = datetime.datetime.strptime(str(trigger["at"]), "%H:%M").strftime("%H:%M")
+        except ValueError:
+            raise ValueError("Trigger time must be HH:MM")
+        return None, None, at
+
+    try:
+        device_id = int(trigger.get("device_id"))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid trigger device ID")
+    state = trigger.get("state")
+    if state not in ["high", "low"]:
+        raise ValueError("Trigger state must be high or low")
+    return device_id, state, None
+
+
+def _next_time(at, now):
+    """Next occurrence of a local "HH:MM" time after now"""
+    hour, minute = (int(part) for part in at.split(":"))
+    moment = datetime.datetime.fromtimestamp(now).replace(
+        hour=hour, minute=minute, second=0, microsecond=0
+    )
+    if moment.timestamp() <= now:
+        moment += datetime.timedelta(days=1)
+    return moment.timestamp()
+
+
+def _index(rule, now):
+    """Add a rule to the trigger indexes; call with _lock held"""
+    _rules[rule["id"]] = rule
+    if rule["trigger_at"] is not None:
+        rule["next_run"] = _next_time(rule["trigger_at"], now)
+        heapq.heappush(_timers, (rule["next_run"], rule["id"], "time", 0))
+    else:
+        key = (rule["trigger_device_id"], rule["trigger_state"])
+        _by_state.setdefault(key, []).append(rule["id"])
+
+
+def _unindex(rule_id):
+    """Remove a rule from the indexes; call with _lock held"""
+    rule = _rules.pop(rule_id, None)
+    if rule is None:
+        return False
+    _pending.pop(rule_id, None)  # Its heap entries are skipped later
+    if rule["trigger_at"] is None:
+        key = (rule["trigger_device_id"], rule["trigger_state"])
+        rule_ids = _by_state.get(key, [])
+        if rule_id in rule_ids:
+            rule_ids.remove(rule_id)
+        if not rule_ids:
+            _by_state.pop(key, None)
+    return True
+
+
+def load():
+    """(Re)load every rule from the database and rebuild the indexes"""
+    rows = get_connection().execute(
+        """
+        SELECT id, name, trigger_device_id, trigger_state, trigger_at,
+               device_id, action, delay, created_at
+        FROM rules
+    """
+    ).fetchall()
+
+    now = time.time()
+    with _lock:
+        _rules.clear()
+        _by_state.clear()
+        _timers.clear()
+        _pending.clear()
+        for row in rows:
+            _index(
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "trigger_device_id": row[2],
+                    "trigger_state": row[3],
+                    "trigger_at": row[4],
+                    "device_id": row[5],
+                    "action": row[6],
+                    "delay": row[7],
+                    "created_at": row[8],
+                },
+                now,
+            )
+        _lock.notify()
+
+
+def get_rules():
+    """All rules, ordered by id"""
+    with _lock:
+        return [_public(_rules[rule_id]) for rule_id in sorted(_rules)]
+
+
+def add_rule(trigger, device_id, action, delay=0, name=""):
+    """Add a rule: when trigger happens, switch device_id to action after delay seconds
+
+    trigger is {"device_id", "state"} or {"at": "HH:MM"}. Returns the new rule.
+    """
+    trigger_device_id, trigger_state, trigger_at = parse_trigger(trigger)
+    if action not in ["high", "low"]:
+        raise ValueError("Invalid action")
+    try:
+        delay = int(delay or 0)
+    except (TypeError, ValueError):
+        raise ValueError("delay must be a number of seconds")
+    if delay < 0:
+        raise ValueError("delay cannot be negative")
+
+    rule = {
+        "name": str(name or ""),
+        "trigger_device_id": trigger_device_id,
+        "trigger_state": trigger_state,
+        "trigger_at": trigger_at,
+        "device_id": device_id,
+        "action": action,
+        "delay": delay,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+    }
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO rules (name, trigger_device_id, trigger_state, trigger_at,
+                               device_id, action, delay, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                rule["name"],
+                trigger_device_id,
+                trigger_state,
+                trigger_at,
+                device_id,
+                action,
+                delay,
+                rule["created_at"],
+            ),
+        )
+    rule["id"] = cursor.lastrowid
+
+    with _lock:
+        _index(rule, time.time())
+        _lock.notify()
+    return _public(rule)
+
+
+def remove_rule(rule_id):
+    """Delete a rule; a delayed action it has pending is dropped"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+    with _lock:
+        _unindex(rule_id)
+    if not cursor.rowcount:
+        raise ValueError(f"Rule {rule_id} does not exist")
+
+
+def remove_device_rules(device_id):
+    """Delete every rule that is triggered by, or switches, a device being removed"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM rules WHERE device_id = ? OR trigger_device_id = ?",
+            (device_id, device_id),
+        )
+    with _lock:
+        for rule_id in [
+            rule["id"]
+            for rule in _rules.values()
+            if device_id in (rule["device_id"], rule["trigger_device_id"])
+        ]:
+            _unindex(rule_id)
+        _states.pop(device_id, None)
+
+
+def _trigger(rule_id, depth, now):
+    """Queue a triggered rule's action; call with _lock held"""
+    _stats["triggered"] += 1
+    if depth > config.RULES_MAX_DEPTH:
+        _stats["loops"] += 1
+        RULE_ACTIONS.inc("loop")
+        print(f"Rule {rule_id} dropped: more than {config.RULES_MAX_DEPTH} chained rules")
+        return
+    delay = _rules[rule_id]["delay"]
+    if delay:
+        due = now + delay
+        _pending[rule_id] = due  # Triggering again restarts the delay
+        heapq.heappush(_timers, (due, rule_id, "action", depth))
+    else:
+        _ready.append((rule_id, depth))
+
+
+def _on_event(event):
+    """events listener; runs under the state lock, so it only queues"""
+    if _thread is None:
+        return
+    data = event["data"]
+    if event["type"] == "device_state":
+        device_id, state = data["id"], data["state"]
+        with _lock:
+            if _states.get(device_id) == state:
+                return  # Not a change
+            _states[device_id] = state
+            rule_ids = _by_state.get((device_id, state))
+            if not rule_ids:
+                return
+            depth = getattr(_context, "depth", 0) + 1
+            now = time.time()
+            for rule_id in rule_ids:
+                _trigger(rule_id, depth, now)
+            _lock.notify()
+    elif event["type"] in ("device_added", "device_updated"):
+        with _lock:
+            _states[data["id"]] = data["state"]
+
+
+def _pop_due(now):
+    """Move due timers to _ready, rescheduling time triggers; call with _lock held"""
+    while _timers and _timers[0][0] <= now:
+        due, rule_id, kind, depth = heapq.heappop(_timers)
+        rule = _rules.get(rule_id)
+        if rule is None:
+            continue  # Removed since it was pushed
+        if kind == "action":
+            if _pending.get(rule_id) != due:
+                continue  # Restarted since it was pushed
+            del _pending[rule_id]
+            _ready.append((rule_id, depth))
+        elif rule.get("next_run") == due:
+            rule["next_run"] = _next_time(rule["trigger_at"], now)
+            heapq.heappush(_timers, (rule["next_run"], rule_id, "time", 0))
+            _trigger(rule_id, 1, now)
+
+
+def run_ready(now=None):
+    """Apply every queued and due action; returns the number applied
+
+    Actions are applied one batch per cascade depth, in a single
+    control_devices call each, the last action per device winning.
+    """
+    now = time.time() if now is None else now
+    with _lock:
+        _pop_due(now)
+        batches = {}  # depth -> {device id: action}
+        for rule_id, depth in _ready:
+            rule = _rules.get(rule_id)
+            if rule is not None:
+                batches.setdefault(depth, {})[rule["device_id"]] = rule["action"]
+        _ready.clear()
+
+    applied = 0
+    for depth, actions in sorted(batches.items()):
+        _context.depth = depth  # Changes made now trigger rules at depth + 1
+        try:
+            errors = _fire(actions)
+        except Exception as e:
+            print(f"Error running rule actions: {e}")
+            errors = {device_id: str(e) for device_id in actions}
+        finally:
+            _context.depth = 0
+
+        for device_id, error in errors.items():
+            print(f"Rule action for device {device_id} failed: {error}")
+        with _lock:
+            _stats["failed"] += len(errors)
+            _stats["applied"] += len(actions) - len(errors)
+        if errors:
+            RULE_ACTIONS.inc("failed", amount=len(errors))
+        if len(actions) > len(errors):
+            RULE_ACTIONS.inc("applied", amount=len(actions) - len(errors))
+        applied += len(actions) - len(errors)
+    return applied
+
+
+def stats():
+    """Counters describing rule activity"""
+    with _lock:
+        return dict(_stats, rules=len(_rules), pending=len(_pending))
+
+
+metrics.gauge("dewhome_rules", "Automation rules loaded", lambda: len(_rules))
+
+
+def _run_loop():
+    """Sleep until an action is queued or a timer is due, then apply them"""
+    while True:
+        with _lock:
+            if _stopping:
+                return
+            if not _ready:
+                delay = MAX_SLEEP_SECONDS
+                if _timers:
+                    delay = min(delay, max(0.0, _timers[0][0] - time.time()))
+                if delay > 0:
+                    _lock.wait(delay)
+            if _stopping:
+                return
+        try:
+            run_ready()
+        except Exception as e:
+            print(f"Error in rules engine: {e}")
+
+
+def start(fire, get_states):
+    """Load the rules and start evaluating them
+
+    fire(actions) switches devices (device id -> action) in one pass and
+    returns device id -> error for the ones that failed; get_states() returns
+    device id -> current state.
+    """
+    global _fire, _thread, _stopping, _listening
+
+    if _thread is not None:
+        return
+
+    _fire = fire
+    _stopping = False
+    load()
+    with _lock:
+        _states.clear()
+        _states.update(get_states())
+    if not _listening:
+        events.add_listener(_on_event)
+        _listening = True
+    _thread = threading.Thread(target=_run_loop, name="dewhome-rules", daemon=True)
+    _thread.start()
+
+
+def stop():
+    """Stop evaluating rules; pending delayed actions are dropped"""
+    global _thread, _stopping
+
+    if _thread is None:
+        return
+    with _lock:
+        _stopping = True
+        _lock.notify()
+    _thread.join(timeout=5)
+    _thread = None
+    with _lock:
+        _ready.clear()
+        _pending.clear()
@@ -0,0 +1,293 @@
+import heapq
+import threading
+import time
+
+from modules import config
+from modules import metrics
+from modules.db_pool import get_connection
+from modules.history import parse_time
+
+# Timed device actions, stored in the schedules table.
+#
+# Pending runs live in a min-heap of (next_run, schedule id), so finding the
+# next due action is O(1) and adding or rescheduling one is O(log n). Removed
+# or rescheduled entries are left in the heap and skipped when they surface.
+#
+# A single thread sleeps until the head of the heap is due, then fires every
+# action due by then in one call to the fire callback (one GPIO pass), last
+# action per device winning. One-shot schedules are deleted after running;
+# recurring ones move to their next future occurrence.
+#
+# After downtime, runs missed by less than config.SCHEDULER_MISFIRE_GRACE_SECONDS
+# are fired once at startup (again only the latest per device); older ones are
+# skipped.
+
+MAX_SLEEP_SECONDS = 60  # Re-check at least this often, in case the clock jumps
+
+_lock = threading.Condition()
+_schedules = {}  # schedule id -> schedule dict
+_heap = []  # (next_run, schedule id)
+_fire = None
+_thread = None
+_stopping = False
+
+_stats = {"fired": 0, "batches": 0, "skipped": 0, "errors": 0}
+
+
+def _format_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def _public(schedule):
+    """API representation of a schedule"""
+    return {
+        "id": schedule["id"],
+        "device_id": schedule["device_id"],
+        "action": schedule["action"],
+        "next_run": _format_time(schedule["next_run"]),
+        "next_run_ts": schedule["next_run"],
+        "every": schedule["every"],
+        "created_at": schedule["created_at"],
+    }
+
+
+def _next_occurrence(schedule, now):
+    """First occurrence of a recurring schedule after now"""
+    missed = int((now - schedule["next_run"]) // schedule["every"]) + 1
+    return schedule["next_run"] + missed * schedule["every"]
+
+
+def load():
+    """(Re)load every schedule from the database"""
+    rows = get_connection().execute(
+        "SELECT id, device_id, action, next_run, every, created_at FROM schedules"
+    ).fetchall()
+
+    with _lock:
+        _schedules.clear()
+        for row in rows:
+            _schedules[row[0]] = {
+                "id": row[0],
+                "device_id": row[1],
+                "action": row[2],
+                "next_run": row[3],
+                "every": row[4],
+                "created_at": row[5],
+            }
+        _heap[:] = [(s["next_run"], s["id"]) for s in _schedules.values()]
+        heapq.heapify(_heap)
+        _lock.notify()
+
+
+def get_schedules(device_id=None):
+    """All schedules ordered by next run, optionally for one device"""
+    with _lock:
+        schedules = [
+            _public(schedule)
+            for schedule in _schedules.values()
+            if device_id is None or schedule["device_id"] == device_id
+        ]
+    return sorted(schedules, key=lambda schedule: (schedule["next_run_ts"], schedule["id"]))
+
+
+def add_schedule(device_id, action, at, every=None):
+    """Schedule action for a device at a time, optionally repeating every N seconds
+
+    at is unix seconds or an ISO 8601 string. A recurring schedule whose first
+    run is in the past starts at its next future occurrence. Returns the new
+    schedule.
+    """
+    if action not in ["high", "low"]:
+        raise ValueError("Invalid action")
+
+    next_run = parse_time(at)
+    if every is not None:
+        try:
+            every = int(every)
+        except (TypeError, ValueError):
+            raise ValueError("every must be a number of seconds")
+        if every < 1:
+            raise ValueError("every must be at least 1 second")
+
+    schedule = {
+        "device_id": device_id,
+        "action": action,
+        "next_run": next_run,
+        "every": every,
+        "created_at": _format_time(time.time()),
+    }
+    now = time.time()
+    if every and next_run <= now:
+        schedule["next_run"] = _next_occurrence(schedule, now)
+
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO schedules (device_id, action, next_run, every, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            (device_id, action, schedule["next_run"], every, schedule["created_at"]),
+        )
+    schedule["id"] = cursor.lastrowid
+
+    with _lock:
+        _schedules[schedule["id"]] = schedule
+        heapq.heappush(_heap, (schedule["next_run"], schedule["id"]))
+        _lock.notify()
+    return _public(schedule)
+
+
+def remove_schedule(schedule_id):
+    """Delete a schedule"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+    with _lock:
+        _schedules.pop(schedule_id, None)  # Its heap entry is skipped later
+    if not cursor.rowcount:
+        raise ValueError(f"Schedule {schedule_id} does not exist")
+
+
+def remove_device_schedules(device_id):
+    """Delete every schedule of a device that is being removed"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM schedules WHERE device_id = ?", (device_id,))
+    with _lock:
+        for schedule_id in [
+            s["id"] for s in _schedules.values() if s["device_id"] == device_id
+        ]:
+            del _schedules[schedule_id]
+
+
+def _pop_due(now):
+    """Remove due entries from the heap; returns their schedules. Call with _lock held"""
+    due = []
+    while _heap and _heap[0][0] <= now:
+        next_run, schedule_id = heapq.heappop(_heap)
+        schedule = _schedules.get(schedule_id)
+        if schedule is None or schedule["next_run"] != next_run:
+            continue  # Removed or rescheduled since it was pushed
+        due.append(schedule)
+    return due
+
+
+def run_due(now=None):
+    """Fire every action due by now in one batch; returns the number fired"""
+    now = time.time() if now is None else now
+    grace = config.SCHEDULER_MISFIRE_GRACE_SECONDS
+
+    with _lock:
+        due = _pop_due(now)
+        if not due:
+            return 0
+
+        actions = {}  # device id -> (due time, action); the latest wins
+        finished = []
+        rescheduled = []
+        for schedule in due:
+            due_at = schedule["next_run"]
+            if schedule["every"]:
+                # Only the most recent of several missed occurrences matters
+                due_at += (now - due_at) // schedule["every"] * schedule["every"]
+
+            if now - due_at <= grace:
+                latest = actions.get(schedule["device_id"])
+                if latest is None or due_at >= latest[0]:
+                    actions[schedule["device_id"]] = (due_at, schedule["action"])
+            else:
+                _stats["skipped"] += 1
+
+            if schedule["every"]:
+                schedule["next_run"] = _next_occurrence(schedule, now)
+                heapq.heappush(_heap, (schedule["next_run"], schedule["id"]))
+                rescheduled.append((schedule["next_run"], schedule["id"]))
+            else:
+                del _schedules[schedule["id"]]
+                finished.append((schedule["id"],))
+
+    conn = get_connection()
+    with conn:
+        conn.executemany("DELETE FROM schedules WHERE id = ?", finished)
+        conn.executemany("UPDATE schedules SET next_run = ? WHERE id = ?", rescheduled)
+
+    if not actions:
+        return 0
+
+    try:
+        errors = _fire({device_id: action for device_id, (_, action) in actions.items()})
+    except Exception as e:
+        print(f"Error running scheduled actions: {e}")
+        _stats["errors"] += len(actions)
+        return 0
+
+    for device_id, error in errors.items():
+        print(f"Scheduled action for device {device_id} failed: {error}")
+    _stats["errors"] += len(errors)
+    _stats["fired"] += len(actions) - len(errors)
+    _stats["batches"] += 1
+    print(f"Ran {len(actions)} scheduled actions")
+    return len(actions) - len(errors)
+
+
+def stats():
+    """Counters describing scheduler activity"""
+    with _lock:
+        return dict(_stats, scheduled=len(_schedules))
+
+
+metrics.gauge(
+    "dewhome_schedules", "Timed actions waiting to run", lambda: len(_schedules)
+)
+
+
+def _run_loop():
+    """Sleep until the next action is due, then run everything due"""
+    while True:
+        with _lock:
+            if _stopping:
+                return
+            delay = MAX_SLEEP_SECONDS
+            if _heap:
+                delay = min(delay, max(0.0, _heap[0][0] - time.time()))
+            if delay > 0:
+                _lock.wait(delay)
+            if _stopping:
+                return
+        try:
+            run_due()
+        except Exception as e:
+            print(f"Error in scheduler: {e}")
+
+
+def start(fire):
+    """Load schedules, catch up on missed runs and start the scheduler thread
+
+    fire(actions) switches devices (device id -> action) in one pass and
+    returns device id -> error for the ones that failed.
+    """
+    global _fire, _thread, _stopping
+
+    if _thread is not None:
+        return
+
+    _fire = fire
+    _stopping = False
+    load()
+    run_due()  # Catch up on runs missed while stopped
+    _thread = threading.Thread(target=_run_loop, name="dewhome-scheduler", daemon=True)
+    _thread.start()
+
+
+def stop():
+    """Stop the scheduler thread"""
+    global _thread, _stopping
+
+    if _thread is None:
+        return
+    with _lock:
+        _stopping = True
+        _lock.notify()
+    _thread.join(timeout=5)
+    _thread = None
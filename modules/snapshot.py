@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from modules import config
+
+# Fixed-layout binary snapshot of the relay output levels.
+#
+# gpio_control records every output write here, so the file always holds the
+# level each relay pin was last driven to, even when the SQLite write-behind
+# has not caught up. restore_pins.py reads it at boot and drives the pins
+# before Python has loaded Flask or SQLite; controller.start() then takes any
+# state the database missed from it.
+#
+# The file holds two 64-byte slots. Each slot is: magic "DWSS", format
+# version, pin count, reserved, sequence number, CRC32 of the sequence and
+# levels, then one byte per BCM pin 0-27: LOW (0), HIGH (1) or UNSET (0xFF)
+# for pins that are not plain outputs. A write fills the slot that does not
+# hold the newest snapshot and msyncs it, so a power cut in the middle of a
+# write leaves the other slot intact; readers take the valid slot with the
+# highest sequence number.
+
+MAGIC = b"DWSS"
+FORMAT_VERSION = 1
+PIN_COUNT = 28
+UNSET = 0xFF
+SLOT_SIZE = 64
+_SLOT = struct.Struct(f"<4sBBHII{PIN_COUNT}s")  # 44 bytes, padded to SLOT_SIZE
+
+_lock = threading.Lock()
+_map = None
+_file = None
+_levels = bytearray([UNSET] * PIN_COUNT)
+_sequence = 0
+
+
+def _checksum(sequence, levels):
+    return zlib.crc32(struct.pack("<I", sequence) + bytes(levels))
+
+
+def _pack(sequence, levels):
+    slot = _SLOT.pack(
+        MAGIC, FORMAT_VERSION, PIN_COUNT, 0, sequence, _checksum(sequence, levels), bytes(levels)
+    )
+    return slot.ljust(SLOT_SIZE, b"\0")
+
+
+def _unpack(data):
+    """(sequence, levels) of a slot, or None if it is empty or torn"""
+    if len(data) < _SLOT.size:
+        return None
+    magic, version, pins, _, sequence, crc, levels = _SLOT.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or pins != PIN_COUNT:
+        return None
+    if crc != _checksum(sequence, levels):
+        return None
+    return sequence, levels
+
+
+def _newest(data):
+    """(sequence, levels) of the newest valid slot in data, or None"""
+    slots = [_unpack(data[i * SLOT_SIZE : (i + 1) * SLOT_SIZE]) for i in range(2)]
+    slots = [slot for slot in slots if slot is not None]
+    return max(slots) if slots else None
+
+
+def read(path=None):
+    """{BCM pin: level} of the newest snapshot; {} if there is none"""
+    path = config.SNAPSHOT_PATH if path is None else path
+    if not path:
+        return {}
+    try:
+        with open(path, "rb") as f:
+            newest = _newest(f.read(2 * SLOT_SIZE))
+    except OSError:
+        return {}
+    if newest is None:
+        return {}
+    return {pin: level for pin, level in enumerate(newest[1]) if level != UNSET}
+
+
+def _open():
+    """Map the snapshot file, creating it if needed; call with _lock held"""
+    global _map, _file, _sequence
+
+    fd = os.open(config.SNAPSHOT_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    _file = os.fdopen(fd, "r+b")
+    if os.fstat(fd).st_size != 2 * SLOT_SIZE:
+        _file.truncate(2 * SLOT_SIZE)
+    _map = mmap.mmap(fd, 2 * SLOT_SIZE)
+
+    newest = _newest(_map[:])
+    if newest is not None:
+        _sequence = newest[0]
+        _levels[:] = newest[1]
+
+
+def record(levels):
+    """Record new output levels; levels maps BCM pin -> level, or None to unset
+
+    Returns without writing if nothing changed. Errors are reported and
+    otherwise ignored: the snapshot must never stop a relay from switching.
+    """
+    global _sequence
+
+    if not config.SNAPSHOT_PATH:
+        return
+    with _lock:
+        try:
+            if _map is None:
+                _open()
+            changed = False
+            for pin, level in levels.items():
+                value = UNSET if level is None else level
+                if 0 <= pin < PIN_COUNT and _levels[pin] != value:
+                    _levels[pin] = value
+                    changed = True
+            if not changed:
+                return
+
+            _sequence = (_sequence + 1) & 0xFFFFFFFF
+            offset = (_sequence % 2) * SLOT_SIZE
+            _map[offset : offset + SLOT_SIZE] = _pack(_sequence, _levels)
+            if config.SNAPSHOT_SYNC:
+                _map.flush()
+        except (OSError, ValueError) as e:
+            print(f"Error writing pin snapshot {config.SNAPSHOT_PATH}: {e}")
+
+
+def close():
+    """Unmap the snapshot file (its contents stay for the next boot)"""
+    global _map, _file
+
+    with _lock:
+        if _map is not None:
+            _map.close()
+            _file.close()
+        _map = None
+        _file = None
@@ -0,0 +1,303 @@
+import atexit
+import copy
+import threading
+import time
+
+from modules import config
+from modules import db_operations
+from modules import events
+from modules import metrics
+
+# In-memory, authoritative copy of every device record.
+#
+# Reads (GET /devices, the dashboard, GPIO restore) are served from here and
+# never touch SQLite. State changes are applied in memory immediately and
+# written behind: a flusher thread persists them in one transaction at most
+# config.STATE_MAX_LOSS_SECONDS after the first unflushed change, coalescing
+# repeated toggles of the same device into a single row update.
+#
+# Every change is also announced through modules.events while the store lock
+# is held, so subscribers see changes in the order they were applied, and bumps
+# a monotonically increasing version that HTTP responses use as their ETag.
+#
+# Unlike row updates, transitions are never coalesced: every actual change of
+# state is appended to the device_events log in the same flush.
+
+_lock = threading.RLock()
+_devices = {}  # device id -> device dict, same shape as db_operations.get_all_devices
+_dirty = {}  # device id -> (state, brightness, updated_at) waiting to be flushed
+_transitions = []  # (device id, state, unix ts) for the device_events log
+
+_dirty_event = threading.Event()
+_stop_event = threading.Event()
+_flusher = None
+_version = 0
+
+_stats = {
+    "changes": 0,
+    "flushes": 0,
+    "rows_written": 0,
+    "transitions_logged": 0,
+    "flush_errors": 0,
+}
+
+
+def _timestamp():
+    """UTC timestamp in SQLite's CURRENT_TIMESTAMP format"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+def _bump_version():
+    """Mark the device list (and pin usage) as changed; call with _lock held"""
+    global _version
+    _version += 1
+
+
+def version():
+    """Current state version; changes whenever any device or its state changes"""
+    return _version
+
+
+def load(devices=None):
+    """(Re)load every device from the database, or from an already-read device list"""
+    if devices is None:
+        devices = db_operations.get_all_devices()
+    with _lock:
+        _bump_version()
+        _devices.clear()
+        for device in devices:
+            pending = _dirty.get(device["id"])
+            if pending:
+                # Keep unflushed changes; they are newer than the database
+                device["state"] = pending[0]
+                if pending[1] is not None:
+                    device["brightness"] = pending[1]
+            _devices[device["id"]] = device
+
+
+def load_device(device_id):
+    """Load (or refresh) a single device from the database"""
+    device = db_operations.get_device(device_id)
+    if device is None:
+        raise ValueError(f"Device {device_id} does not exist")
+
+    with _lock:
+        is_new = device_id not in _devices
+        _devices[device_id] = device
+        _bump_version()
+        events.publish(
+            "device_added" if is_new else "device_updated", copy.copy(device)
+        )
+    return copy.copy(device)
+
+
+def remove_device(device_id):
+    """Forget a device that has been deleted from the database"""
+    with _lock:
+        _dirty.pop(device_id, None)
+        _bump_version()
+        device = _devices.pop(device_id, None)
+        if device is None:
+            return
+        events.publish("device_removed", {"id": device_id})
+        if device["state"] == "low":
+            return
+        # Close the device's on-time in the history log
+        _transitions.append((device_id, "low", time.time()))
+
+    _schedule_flush()
+
+
+def get_all_devices():
+    """All devices ordered by id, as returned by db_operations.get_all_devices"""
+    with _lock:
+        return [copy.copy(_devices[device_id]) for device_id in sorted(_devices)]
+
+
+def get_device(device_id):
+    """A single device record, or None"""
+    with _lock:
+        device = _devices.get(device_id)
+        return copy.copy(device) if device else None
+
+
+def get_device_states():
+    """Device states for GPIO control, as returned by db_operations.get_device_states"""
+    with _lock:
+        return {
+            device_id: {
+                "pin": device["pin_number"],
+                "state": device["state"],
+                "kind": device.get("kind", "switch"),
+                "brightness": device.get("brightness", 100),
+            }
+            for device_id, device in _devices.items()
+        }
+
+
+def get_states():
+    """device id -> state for every device (cheaper than get_device_states)"""
+    with _lock:
+        return {device_id: device["state"] for device_id, device in _devices.items()}
+
+
+def set_state(device_id, state):
+    """Record a device's new state; persisted within the configured loss window"""
+    set_states({device_id: state})
+
+
+def set_states(states):
+    """Record several state changes at once
+
+    states maps device id -> state. All changes are persisted together in the
+    same flush. Raises ValueError (and changes nothing) if any device is unknown.
+    """
+    now = _timestamp()
+    ts = time.time()
+    with _lock:
+        for device_id in states:
+            if device_id not in _devices:
+                raise ValueError(f"Device {device_id} not found")
+
+        _bump_version()
+        for device_id, state in states.items():
+            if _devices[device_id]["state"] != state:
+                _transitions.append((device_id, state, ts))
+            brightness = _dirty.get(device_id, (None, None))[1]
+            _devices[device_id]["state"] = state
+            _dirty[device_id] = (state, brightness, now)
+            events.publish("device_state", {"id": device_id, "state": state})
+        _stats["changes"] += len(states)
+
+    _schedule_flush()
+
+
+def set_brightness(device_id, brightness):
+    """Record a dimmer's new brightness (0-100)
+
+    0 switches the device off and keeps its last brightness, so switching it
+    back on restores that level. Raises ValueError if the device is unknown.
+    """
+    with _lock:
+        device = _devices.get(device_id)
+        if device is None:
+            raise ValueError(f"Device {device_id} not found")
+
+        _bump_version()
+        state = "high" if brightness > 0 else "low"
+        if device["state"] != state:
+            _transitions.append((device_id, state, time.time()))
+        device["state"] = state
+        if brightness > 0:
+            device["brightness"] = brightness
+        _dirty[device_id] = (state, device["brightness"], _timestamp())
+        events.publish(
+            "device_state",
+            {"id": device_id, "state": state, "brightness": device["brightness"]},
+        )
+        _stats["changes"] += 1
+
+    _schedule_flush()
+
+
+def _schedule_flush():
+    if config.STATE_MAX_LOSS_SECONDS <= 0 or _flusher is None:
+        # Write-through mode, or no flusher running (e.g. scripts and tools)
+        flush()
+    else:
+        _dirty_event.set()
+
+
+def pending_count():
+    """Number of devices with changes not yet written to the database"""
+    with _lock:
+        return len(_dirty)
+
+
+def stats():
+    """Counters describing write-behind activity"""
+    with _lock:
+        return dict(_stats, pending=len(_dirty))
+
+
+def flush():
+    """Write all pending state changes to the database in one transaction"""
+    with _lock:
+        if not _dirty and not _transitions:
+            return 0
+        batch = dict(_dirty)
+        transitions = list(_transitions)
+        _dirty.clear()
+        _transitions.clear()
+        _dirty_event.clear()
+
+    try:
+        db_operations.update_device_states(
+            (
+                (device_id, state, brightness, updated_at)
+                for device_id, (state, brightness, updated_at) in batch.items()
+            ),
+            transitions,
+        )
+    except Exception as e:
+        print(f"Error flushing device states: {e}")
+        with _lock:
+            # Requeue, without overwriting anything changed since
+            for device_id, change in batch.items():
+                if device_id in _devices:
+                    _dirty.setdefault(device_id, change)
+            _transitions[:0] = transitions  # Keep the log in order
+            _stats["flush_errors"] += 1
+            if _dirty or _transitions:
+                _dirty_event.set()
+        return 0
+
+    with _lock:
+        _stats["flushes"] += 1
+        _stats["rows_written"] += len(batch)
+        _stats["transitions_logged"] += len(transitions)
+    return len(batch)
+
+
+def _flush_loop():
+    """Background writer: flush at most STATE_MAX_LOSS_SECONDS after a change"""
+    while not _stop_event.is_set():
+        _dirty_event.wait()
+        if _stop_event.wait(config.STATE_MAX_LOSS_SECONDS):
+            break
+        flush()
+
+
+def start():
+    """Start the background flusher (no-op in write-through mode)"""
+    global _flusher
+
+    if _flusher is not None or config.STATE_MAX_LOSS_SECONDS <= 0:
+        return
+
+    _stop_event.clear()
+    _flusher = threading.Thread(
+        target=_flush_loop, name="dewhome-state-flusher", daemon=True
+    )
+    _flusher.start()
+
+
+def stop():
+    """Stop the flusher and persist everything still pending"""
+    global _flusher
+
+    if _flusher is not None:
+        _stop_event.set()
+        _dirty_event.set()
+        _flusher.join(timeout=5)
+        _flusher = None
+    flush()
+
+
+metrics.gauge(
+    "dewhome_state_pending_writes",
+    "Device state changes waiting for the write-behind flush",
+    pending_count,
+)
+
+atexit.register(stop)
@@ -0,0 +1,48 @@
+"""DEWHOME early relay restore.
+
+Drives every relay pin to the level recorded in the pin snapshot
+(modules/snapshot.py) and exits. systemd runs it at boot before the GPIO
+daemon and the web app, so relays are back in their last state within
+milliseconds of the interpreter starting, instead of after Flask, SQLite and
+the device list have loaded. It only imports the snapshot reader and the GPIO
+backend for that reason.
+
+The pins are left configured (no cleanup) so they hold their level until the
+app takes them over at the same level. Dimmers and inputs are not in the
+snapshot; the app brings those back when it starts.
+
+    python restore_pins.py [--snapshot PATH]
+"""
+
+import argparse
+import time
+
+start = time.perf_counter()
+
+from modules import snapshot  # noqa: E402
+from modules.gpio_backend import create_backend  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore relay levels from the pin snapshot")
+    parser.add_argument("--snapshot", help="snapshot file (default: DEWHOME_SNAPSHOT_PATH)")
+    args = parser.parse_args()
+
+    levels = snapshot.read(args.snapshot)
+    if not levels:
+        print("No pin snapshot; nothing to restore")
+        return
+
+    backend = create_backend()
+    for pin, level in sorted(levels.items()):
+        try:
+            backend.setup_output(pin, level)
+        except Exception as e:
+            print(f"Error restoring BCM pin {pin}: {e}")
+
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Restored {len(levels)} relay pin(s) from the snapshot in {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
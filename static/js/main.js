@@ -34,6 +34,7 @@
 })()
 
 // Global variables
+const REMOTE_REFRESH_MS = 5000;
 let availablePins = [];
 let confirmCallback = null;
 
@@ -42,6 +43,10 @@ document.addEventListener('DOMContentLoaded', function() {
   loadUsablePins();
   loadInitialDeviceStates();
   setupEventListeners();
+  if (document.getElementById('remote-devices')) {
+    loadRemoteDevices();
+    setInterval(loadRemoteDevices, REMOTE_REFRESH_MS);
+  }
 });
 
 // Setup event listeners
@@ -162,7 +167,8 @@ async function handleAddDevice(event) {
   const deviceData = {
     name: formData.get('deviceName'),
     icon: formData.get('deviceIcon'),
-    pin_number: parseInt(formData.get('devicePin'))
+    pin_number: parseInt(formData.get('devicePin')),
+    kind: formData.get('deviceKind')
   };
   
   try {
@@ -179,7 +185,9 @@ async function handleAddDevice(event) {
     if (response.ok) {
       showNotification(`Device "${deviceData.name}" added successfully!`, 'success');
       closeAddDeviceModal();
-      location.reload(); // Refresh the page to show new device
+      if (!eventsConnected()) {
+        syncDevices(); // Otherwise the device_added event shows the new device
+      }
     } else {
       showNotification(result.error || 'Failed to add device', 'error');
     }
@@ -206,7 +214,7 @@ function deleteDevice(deviceId) {
         
         if (response.ok) {
           showNotification(`Device "${deviceName}" deleted successfully!`, 'success');
-          deviceCard.remove();
+          removeDeviceCard(deviceId);
         } else {
           showNotification(result.error || 'Failed to delete device', 'error');
         }
@@ -218,18 +226,20 @@ function deleteDevice(deviceId) {
   );
 }
 
-// Toggle device function
-function toggleDevice(deviceId) {
-  const button = document.getElementById("toggle-btn-" + deviceId);
+// Toggle device function (hub is set for devices of other hubs)
+function toggleDevice(deviceId, hub) {
+  const key = hub ? `${hub}:${deviceId}` : deviceId;
+  const button = document.getElementById("toggle-btn-" + key);
   let currentState = button.getAttribute("data-state");
   let newAction = currentState === "1" ? "low" : "high";
 
-  fetch("/device", {
+  fetch(hub ? "/federation/device" : "/device", {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
     },
     body: JSON.stringify({
+      hub: hub,
       device_id: deviceId,
       action: newAction,
     }),
@@ -237,23 +247,8 @@ function toggleDevice(deviceId) {
     .then((response) => response.json())
     .then((data) => {
       if (data.message) {
-        // Update the device state on the page
-        const newState = newAction === "high" ? "1" : "0";
-        button.setAttribute("data-state", newState);
-        const stateLabel = document.getElementById("device-state-" + deviceId);
-        stateLabel.className = newAction;
-
-        // Update the button text
-        button.textContent = newAction === "high" ? "Turn Off" : "Turn On";
-
-        // Update the button class
-        if (newAction === "high") {
-          button.classList.remove("off");
-          button.classList.add("on");
-        } else {
-          button.classList.remove("on");
-          button.classList.add("off");
-        }
+        // The server may have merged a later command for this device
+        applyDeviceState(key, data.state);
       } else {
         showNotification(data.error || 'Failed to control device', 'error');
       }
@@ -264,32 +259,175 @@ function toggleDevice(deviceId) {
     });
 }
 
-// Load initial device states
-function loadInitialDeviceStates() {
-  fetch("/devices")
+// Set a dimmer's brightness (the server fades to it)
+function setBrightness(deviceId, brightness) {
+  fetch("/device", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      device_id: deviceId,
+      brightness: parseInt(brightness),
+    }),
+  })
     .then((response) => response.json())
-    .then((devices) => {
-      devices.forEach(device => {
-        const stateLabel = document.getElementById("device-state-" + device.id);
-        if (stateLabel) {
-          stateLabel.className = device.state;
-        }
+    .then((data) => {
+      if (data.message) {
+        applyDeviceState(deviceId, "high", data.brightness);
+      } else {
+        showNotification(data.error || 'Failed to set brightness', 'error');
+      }
+    })
+    .catch((error) => {
+      console.error("Error:", error);
+      showNotification('Failed to set brightness', 'error');
+    });
+}
+
+// Show a device's state (and a dimmer's brightness) on its card
+function applyDeviceState(deviceId, state, brightness) {
+  if (brightness !== undefined) {
+    const slider = document.getElementById("brightness-" + deviceId);
+    const label = document.getElementById("brightness-value-" + deviceId);
+    if (slider) {
+      slider.value = brightness;
+    }
+    if (label) {
+      label.textContent = `${brightness}%`;
+    }
+  }
+
+  const stateLabel = document.getElementById("device-state-" + deviceId);
+  if (stateLabel) {
+    stateLabel.className = state;
+  }
+
+  const button = document.getElementById("toggle-btn-" + deviceId);
+  if (button) {
+    button.setAttribute("data-state", state === "high" ? "1" : "0");
+    button.textContent = state === "high" ? "Turn Off" : "Turn On";
+
+    if (state === "high") {
+      button.classList.add("on");
+      button.classList.remove("off");
+    } else {
+      button.classList.add("off");
+      button.classList.remove("on");
+    }
+  }
+}
+
+// Build a device card (same markup as templates/index.html); hub is set for
+// devices of other hubs, which can be switched but not edited from here
+function renderDeviceCard(device, hub) {
+  const key = hub ? device.uid : device.id;
+  const card = document.createElement('div');
+  card.className = 'device-card';
+  card.dataset.deviceId = key;
+
+  const header = document.createElement('div');
+  header.className = 'device-header';
+  const title = document.createElement('h2');
+  title.className = 'device-title';
+  const icon = document.createElement('i');
+  icon.className = `fas ${device.icon}`;
+  title.appendChild(icon);
+  title.appendChild(document.createTextNode(' ' + device.name + (hub ? ` (${hub})` : '')));
+  header.appendChild(title);
+  if (!hub) {
+    const deleteButton = document.createElement('button');
+    deleteButton.className = 'btn delete-btn';
+    deleteButton.title = 'Delete Device';
+    deleteButton.innerHTML = '<i class="fas fa-trash"></i>';
+    deleteButton.addEventListener('click', () => deleteDevice(device.id));
+    header.appendChild(deleteButton);
+  }
+
+  const info = document.createElement('div');
+  info.className = 'device-info';
+  const pin = document.createElement('p');
+  pin.className = 'device-pin';
+  pin.innerHTML = '<i class="fas fa-microchip"></i>';
+  pin.appendChild(document.createTextNode(` Pin ${device.pin_number} (${device.pin_type}) `));
+  const category = document.createElement('span');
+  category.className = `pin-category pin-category-${device.pin_category}`;
+  category.textContent = device.pin_category.toUpperCase();
+  pin.appendChild(category);
+  const state = document.createElement('p');
+  state.className = 'device-state';
+  state.innerHTML = `State: <span id="device-state-${key}"></span>`;
+  info.appendChild(pin);
+  info.appendChild(state);
+  if (!hub && device.kind && device.kind !== 'switch' && device.kind !== 'input') {
+    const dimmer = document.createElement('label');
+    dimmer.className = 'device-brightness';
+    dimmer.innerHTML = '<i class="fas fa-sun"></i>';
+    const slider = document.createElement('input');
+    slider.type = 'range';
+    slider.min = '1';
+    slider.max = '100';
+    slider.value = device.brightness;
+    slider.id = `brightness-${device.id}`;
+    slider.addEventListener('change', () => setBrightness(device.id, slider.value));
+    const value = document.createElement('span');
+    value.id = `brightness-value-${device.id}`;
+    value.textContent = `${device.brightness}%`;
+    dimmer.appendChild(slider);
+    dimmer.appendChild(value);
+    info.appendChild(dimmer);
+  }
+
+  card.appendChild(header);
+  card.appendChild(info);
+
+  if (device.kind === 'input') {
+    // Inputs are read, not switched: their state follows the pin
+    const input = document.createElement('p');
+    input.className = 'device-input';
+    input.innerHTML = '<i class="fas fa-wave-square"></i> Input';
+    card.appendChild(input);
+    return card;
+  }
+
+  const toggle = document.createElement('button');
+  toggle.className = 'btn toggle-btn';
+  toggle.id = `toggle-btn-${key}`;
+  toggle.setAttribute('data-state', '0');
+  toggle.textContent = 'Toggle';
+  toggle.addEventListener('click', () => toggleDevice(device.id, hub));
+  card.appendChild(toggle);
+  return card;
+}
+
+// Add a card for a device that is not on the page yet
+function addDeviceCard(device) {
+  if (!document.querySelector(`[data-device-id="${device.id}"]`)) {
+    document.getElementById('devices').appendChild(renderDeviceCard(device));
+  }
+  applyDeviceState(device.id, device.state, device.brightness);
+}
+
+// Remove a device's card from the page
+function removeDeviceCard(deviceId) {
+  const deviceCard = document.querySelector(`[data-device-id="${deviceId}"]`);
+  if (deviceCard) {
+    deviceCard.remove();
+  }
+}
 
-        const button = document.getElementById("toggle-btn-" + device.id);
-        if (button) {
-          const newState = device.state === "high" ? "1" : "0";
-          button.setAttribute("data-state", newState);
-          button.textContent = device.state === "high" ? "Turn Off" : "Turn On";
-
-          if (device.state === "high") {
-            button.classList.add("on");
-            button.classList.remove("off");
-          } else {
-            button.classList.add("off");
-            button.classList.remove("on");
-          }
+// Bring the page in line with the full device list from the server
+function syncDevices() {
+  return fetch("/devices")
+    .then((response) => response.json())
+    .then((devices) => {
+      const known = new Set(devices.map((device) => String(device.id)));
+      document.querySelectorAll('#devices .device-card').forEach((card) => {
+        if (!known.has(card.dataset.deviceId)) {
+          card.remove();
         }
       });
+      devices.forEach(addDeviceCard);
     })
     .catch((error) => {
       console.error("Error fetching device states:", error);
@@ -297,6 +435,80 @@ function loadInitialDeviceStates() {
     });
 }
 
+// Show the devices of the other hubs (federation mode)
+function loadRemoteDevices() {
+  return fetch("/federation/devices")
+    .then((response) => response.json())
+    .then((data) => {
+      const localHub = data.hubs.find((hub) => hub.status === 'local').name;
+      document.getElementById('remote-hubs').textContent = data.hubs
+        .filter((hub) => hub.status !== 'local')
+        .map((hub) => `${hub.name}: ${hub.status}`)
+        .join(' · ');
+
+      const container = document.getElementById('remote-devices');
+      const remote = data.devices.filter((device) => device.hub !== localHub);
+      const known = new Set(remote.map((device) => device.uid));
+      container.querySelectorAll('.device-card').forEach((card) => {
+        if (!known.has(card.dataset.deviceId)) {
+          card.remove();
+        }
+      });
+      remote.forEach((device) => {
+        if (!container.querySelector(`[data-device-id="${device.uid}"]`)) {
+          container.appendChild(renderDeviceCard(device, device.hub));
+        }
+        applyDeviceState(device.uid, device.state);
+      });
+    })
+    .catch((error) => {
+      console.error("Error fetching other hubs:", error);
+    });
+}
+
+// Load initial device states, then follow changes pushed by the server
+function loadInitialDeviceStates() {
+  syncDevices().then(connectEvents);
+}
+
+let eventSource = null;
+
+// Subscribe to the server-sent event stream of device changes
+function connectEvents() {
+  if (!window.EventSource || eventSource) {
+    return;
+  }
+
+  eventSource = new EventSource('/events');
+  let hadError = false;
+
+  eventSource.addEventListener('device_state', (event) => {
+    const change = JSON.parse(event.data);
+    applyDeviceState(change.id, change.state, change.brightness);
+  });
+  eventSource.addEventListener('device_added', (event) => {
+    addDeviceCard(JSON.parse(event.data));
+  });
+  eventSource.addEventListener('device_removed', (event) => {
+    removeDeviceCard(JSON.parse(event.data).id);
+  });
+  // We fell behind, or the server restarted: fetch the full list once
+  eventSource.addEventListener('resync', syncDevices);
+  eventSource.addEventListener('open', () => {
+    if (hadError) {
+      hadError = false;
+      syncDevices();
+    }
+  });
+  eventSource.addEventListener('error', () => {
+    hadError = true;
+  });
+}
+
+function eventsConnected() {
+  return eventSource !== null && eventSource.readyState === EventSource.OPEN;
+}
+
 // Show notification function
 function showNotification(message, type = 'info') {
   // Create notification element
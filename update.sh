@@ -331,6 +331,9 @@ except Exception as e:
     print(f'Database migration failed: {e}')
     exit(1)
 " >> "$LOG_FILE" 2>&1
+
+    # Content-hashed, precompressed static assets for nginx (also rebuilt at startup)
+    python3 -m modules.assets >> "$LOG_FILE" 2>&1 || true
     deactivate
     
     print_success "Database updated"
@@ -344,12 +347,66 @@ update_configuration() {
     if [ -f "/etc/systemd/system/${SERVICE_NAME}.service" ]; then
         print_status "Updating systemd service..."
         # Regenerate service file with current paths
+        # One web worker per CPU core; the GPIO daemon is the only process
+        # that touches the pins
+        WEB_WORKERS=$(nproc 2>/dev/null || echo 1)
+
+        # Relays go back to their last state from the pin snapshot before
+        # anything else loads
+        sudo tee /etc/systemd/system/${SERVICE_NAME}-restore.service > /dev/null << EOF
+[Unit]
+Description=DEWHOME early relay restore
+Documentation=https://github.com/dewanshDT/dewhome
+DefaultDependencies=no
+After=local-fs.target systemd-udev-settle.service
+Before=${SERVICE_NAME}-gpio.service ${SERVICE_NAME}.service
+
+[Service]
+Type=oneshot
+User=$UPDATE_USER
+Group=gpio
+WorkingDirectory=$PROJECT_DIR
+ExecStart=$PROJECT_DIR/venv/bin/python restore_pins.py
+StandardOutput=journal
+StandardError=journal
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+        sudo tee /etc/systemd/system/${SERVICE_NAME}-gpio.service > /dev/null << EOF
+[Unit]
+Description=DEWHOME GPIO daemon
+Documentation=https://github.com/dewanshDT/dewhome
+After=syslog.target systemd-udev-settle.service
+PartOf=${SERVICE_NAME}.service
+
+[Service]
+Type=simple
+User=$UPDATE_USER
+Group=gpio
+WorkingDirectory=$PROJECT_DIR
+Environment="PATH=$PROJECT_DIR/venv/bin"
+Environment="DEWHOME_GPIO_SOCKET=/run/dewhome/gpio.sock"
+RuntimeDirectory=dewhome
+RuntimeDirectoryMode=0750
+ExecStart=$PROJECT_DIR/venv/bin/python gpio_daemon.py
+Restart=always
+RestartSec=1
+StandardOutput=journal
+StandardError=journal
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
         sudo tee /etc/systemd/system/${SERVICE_NAME}.service > /dev/null << EOF
 [Unit]
 Description=Gunicorn instance to serve DEWHOME Flask app
 Documentation=https://github.com/dewanshDT/dewhome
-After=network.target syslog.target multi-user.target systemd-udev-settle.service
+After=network.target syslog.target multi-user.target systemd-udev-settle.service ${SERVICE_NAME}-gpio.service
 Wants=network.target
+Requires=${SERVICE_NAME}-gpio.service
 
 [Service]
 Type=notify
@@ -357,7 +414,9 @@ User=$UPDATE_USER
 Group=gpio
 WorkingDirectory=$PROJECT_DIR
 Environment="PATH=$PROJECT_DIR/venv/bin"
-ExecStart=$PROJECT_DIR/venv/bin/gunicorn --workers 1 --bind 127.0.0.1:5000 --timeout 300 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 app:app
+Environment="DEWHOME_GPIO_SOCKET=/run/dewhome/gpio.sock"
+Environment="DEWHOME_WEB_WORKERS=$WEB_WORKERS"
+ExecStart=$PROJECT_DIR/venv/bin/gunicorn --workers $WEB_WORKERS --worker-class gthread --threads 64 --bind 127.0.0.1:5000 --timeout 300 --keep-alive 2 --max-requests 1000 --max-requests-jitter 50 app:app
 ExecReload=/bin/kill -s HUP \$MAINPID
 Restart=always
 RestartSec=3
@@ -372,12 +431,80 @@ WantedBy=multi-user.target
 EOF
         
         sudo systemctl daemon-reload
+        sudo systemctl enable ${SERVICE_NAME}-restore.service
+        sudo systemctl enable ${SERVICE_NAME}-gpio.service
         print_success "Systemd service updated"
     fi
     
     # Update nginx configuration if it exists
     if [ -f "/etc/nginx/sites-available/dewhome" ]; then
-        print_status "Nginx configuration is current"
+        print_status "Updating nginx configuration..."
+        sudo cp /etc/nginx/sites-available/dewhome /etc/nginx/sites-available/dewhome.pre-update
+        sudo tee /etc/nginx/sites-available/dewhome > /dev/null << EOF
+server {
+    listen 80;
+    server_name _;
+
+    # Security headers
+    add_header X-Frame-Options "SAMEORIGIN" always;
+    add_header X-XSS-Protection "1; mode=block" always;
+    add_header X-Content-Type-Options "nosniff" always;
+
+    # Favicon
+    location = /favicon.ico {
+        alias $PROJECT_DIR/static/favicon.ico;
+        access_log off;
+        log_not_found off;
+    }
+
+    # Content-hashed static assets: a URL never changes content, so cache
+    # for a year and serve the precompressed .gz built next to each file
+    location /assets/ {
+        alias $PROJECT_DIR/static/build/;
+        gzip_static on;
+        expires 1y;
+        add_header Cache-Control "public, immutable";
+        add_header Vary "Accept-Encoding";
+    }
+
+    # Unhashed static files: revalidate, their content changes on upgrade
+    location /static/ {
+        alias $PROJECT_DIR/static/;
+        add_header Cache-Control "no-cache";
+    }
+
+    # Server-sent device events: stream straight through, never buffer
+    location = /events {
+        proxy_pass http://127.0.0.1:5000;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_buffering off;
+        proxy_cache off;
+        proxy_read_timeout 1h;
+    }
+
+    # Main application
+    location / {
+        proxy_pass http://127.0.0.1:5000;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_read_timeout 300;
+        proxy_connect_timeout 300;
+        proxy_send_timeout 300;
+    }
+}
+EOF
+
+        if sudo nginx -t >> "$LOG_FILE" 2>&1; then
+            sudo systemctl reload nginx || true
+            print_success "Nginx configuration updated"
+        else
+            # Keep the site working on the configuration it had
+            sudo mv /etc/nginx/sites-available/dewhome.pre-update /etc/nginx/sites-available/dewhome
+            print_warning "Nginx configuration test failed, kept the previous configuration"
+        fi
     fi
     
     print_success "Configuration updated"